@@ -6,175 +6,545 @@ It wil be used by the main site (myisp.com) to generate new vpn clients for mikr
 It will also be accessed with Mikrotik to fetch these certs and install them on behalf of the user
 """
 import os
+import json
+import uuid
 import logging
 from pathlib import Path
-from flask import Flask, jsonify, send_file, send_from_directory
-import openvpn_api
-from celery.result import AsyncResult
+from flask import Flask, Response, jsonify, request, send_file, stream_with_context
+from celery import group
 from prometheus_client import make_wsgi_app, Counter, Histogram
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-from helper import generate_ovpn_config
+from helper import generate_ovpn_config, validate_profile
 from config import Config
-from security import validate_provision_identity, generate_secret, require_secret
-from tasks import generate_certificate
+from security import (validate_provision_identity, validate_provision_identities, generate_secret, require_secret,
+                      require_api_token, rate_limit)
+# Tasks are sent by name, so the web process doesn't import the worker code (PKI, key pool, dispatcher)
+from celery_config import celery
+from batch import chunked, create_batch, get_batch
+from file_cache import FileCache
+from hotspot import HOTSPOT_FORMS, HotspotPages, negotiate_encoding
+from task_events import TaskEvents
+from registry import registry, STATES
+from sessions import get_session
+from dispatcher import JOB_PREFIX
+from storage import client_storage
+from servers import server_pool
+import revocation
 from redis_client import redis_client
+from metrics import get_registry
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Configure logging, the file log is only added by the server (see log_to_file)
+logging.basicConfig(
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    format=LOG_FORMAT,
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+def log_to_file(log_file='logs/app.log'):
+    """Also write the log to a file, called by gunicorn in each worker.
+
+    Benchmarks and CLIs that import the app only log to the console.
+    """
+    log_file = Path(log_file)
+    root = logging.getLogger()
+    if any(isinstance(h, logging.FileHandler) and h.baseFilename == str(log_file.resolve()) for h in root.handlers):
+        return
+    # Create logs directory if it doesn't exist
+    log_file.parent.mkdir(exist_ok=True)
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root.addHandler(handler)
+
+# Prometheus metrics
+REQUEST_COUNT = Counter('http_requests_total', 'Total HTTP requests', ['method', 'endpoint', 'status'])
+REQUEST_LATENCY = Histogram('http_request_latency_seconds', 'HTTP request latency', ['endpoint'])
 
-# Create logs directory if it doesn't exist
-# log_dir = Path('logs')
-# log_dir.mkdir(exist_ok=True)
-# log_file = log_dir / 'app.log'
-#
-# # Configure logging
-# logging.basicConfig(
-#     level=os.getenv('LOG_LEVEL', 'INFO'),
-#     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-#     handlers=[
-#         logging.FileHandler(log_file),
-#         logging.StreamHandler()
-#     ]
-# )
-# logger = logging.getLogger(__name__)
-#
-# # Prometheus metrics
-# REQUEST_COUNT = Counter('http_requests_total', 'Total HTTP requests', ['method', 'endpoint', 'status'])
-# REQUEST_LATENCY = Histogram('http_request_latency_seconds', 'HTTP request latency', ['endpoint'])
-#
 app = Flask(__name__)
-# app.config.from_object(Config)
-#
-# # Add prometheus wsgi middleware to route /metrics requests
-# app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {
-#     '/metrics': make_wsgi_app()
-# })
-#
-# # Initialize OpenVPN API
-# v = openvpn_api.VPN(Config.VPN_HOST, Config.VPN_PORT)
-#
-# @app.errorhandler(Exception)
-# def handle_error(error):
-#     """Global error handler for the application."""
-#     logger.error(f"An error occurred: {str(error)}")
-#     return jsonify({"error": "Internal server error"}), 500
-#
-# @app.route('/health')
-# def health_check():
-#     """Health check endpoint for Docker."""
-#     try:
-#         # Check Redis connection
-#         redis_status = "healthy" if redis_client.ping() else "unhealthy"
-#         # Check OpenVPN connection
-#         vpn_status = "healthy"
-#         # Check certificate directory
-#         cert_dir_status = "healthy" if os.path.exists(Config.VPN_CLIENT_DIR) else "unhealthy"
-#
-#         return jsonify({
-#             "status": "healthy",
-#             "redis": redis_status,
-#             "vpn": vpn_status,
-#             "cert_dir": cert_dir_status
-#         })
-#     except Exception as e:
-#         logger.error(f"Health check failed: {str(e)}")
-#         return jsonify({"status": "unhealthy", "error": str(e)}), 500
+app.config.from_object(Config)
+
+# Take the client IP from X-Forwarded-For when running behind nginx
+if Config.TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=Config.TRUSTED_PROXIES, x_proto=Config.TRUSTED_PROXIES)
+
+# Add prometheus wsgi middleware to route /metrics requests (aggregated over all workers in multiprocess mode)
+app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {
+    '/metrics': make_wsgi_app(get_registry())
+})
+
+# In-memory LRU of the most requested .ovpn files
+ovpn_cache = FileCache(max_entries=Config.OVPN_CACHE_SIZE, max_file_size=Config.OVPN_CACHE_MAX_FILE_SIZE)
+
+# Rendered, precompressed hotspot pages per provision
+hotspot_pages = HotspotPages(max_entries=Config.HOTSPOT_CACHE_SIZE)
+
+@app.errorhandler(Exception)
+def handle_error(error):
+    """Global error handler for the application."""
+    logger.error(f"An error occurred: {str(error)}")
+    return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/health')
+def health_check():
+    """Health check endpoint for Docker."""
+    try:
+        # Check Redis connection
+        redis_status = "healthy" if redis_client.ping() else "unhealthy"
+        # Check OpenVPN connection
+        vpn_status = "healthy"
+        # Check certificate directory
+        cert_dir_status = "healthy" if os.path.exists(Config.VPN_CLIENT_DIR) else "unhealthy"
+
+        return jsonify({
+            "status": "healthy",
+            "redis": redis_status,
+            "vpn": vpn_status,
+            "cert_dir": cert_dir_status
+        })
+    except Exception as e:
+        logger.error(f"Health check failed: {str(e)}")
+        return jsonify({"status": "unhealthy", "error": str(e)}), 500
 
 @app.route('/')
 def hello_world():
     # REQUEST_COUNT.labels(method='GET', endpoint='/', status='401').inc()
     return jsonify({"status": "unauthorized"}), 401
 
-# @app.route('/mikrotik/openvpn/create_provision/<provision_identity>', methods=["POST"])
-# def mtk_create_new_provision(provision_identity):
-#     """Create a new openVPN client with given name.
-#     provision_identity: its just like name instance  (e.g client1,client2,...)
-#     """
-#     with REQUEST_LATENCY.labels(endpoint='/create_provision').time():
-#         try:
-#             # Validate provision identity
-#             validate_provision_identity(provision_identity)
-#
-#             # Check if client already exists
-#             client_conf_path = f"{Config.VPN_CLIENT_DIR}/{provision_identity}.ovpn"
-#             if os.path.exists(client_conf_path):
-#                 REQUEST_COUNT.labels(method='POST', endpoint='/create_provision', status='400').inc()
-#                 return jsonify({"error": "Client already exists"}), 400
-#
-#             # Start async certificate generation
-#             task = generate_certificate.delay(provision_identity)
-#
-#             # Generate and return the secret
-#             secret = generate_secret(provision_identity)
-#
-#             REQUEST_COUNT.labels(method='POST', endpoint='/create_provision', status='202').inc()
-#             return jsonify({
-#                 "status": "processing",
-#                 "task_id": task.id,
-#                 "provision_identity": provision_identity,
-#                 "secret": secret
-#             }), 202
-#
-#         except ValueError as e:
-#             REQUEST_COUNT.labels(method='POST', endpoint='/create_provision', status='400').inc()
-#             return jsonify({"error": str(e)}), 400
-#         except Exception as e:
-#             logger.error(f"Unexpected error: {str(e)}")
-#             REQUEST_COUNT.labels(method='POST', endpoint='/create_provision', status='500').inc()
-#             return jsonify({"error": "Internal server error"}), 500
-#
-# @app.route('/mikrotik/openvpn/task/<task_id>')
-# def get_task_status(task_id):
-#     """Get the status of a certificate generation task."""
-#     with REQUEST_LATENCY.labels(endpoint='/task_status').time():
-#         task_result = AsyncResult(task_id)
-#
-#         if task_result.ready():
-#             if task_result.successful():
-#                 result = task_result.get()
-#                 if result['status'] == 'success':
-#                     REQUEST_COUNT.labels(method='GET', endpoint='/task_status', status='200').inc()
-#                     return jsonify(result), 200
-#                 else:
-#                     REQUEST_COUNT.labels(method='GET', endpoint='/task_status', status='400').inc()
-#                     return jsonify(result), 400
-#             else:
-#                 REQUEST_COUNT.labels(method='GET', endpoint='/task_status', status='500').inc()
-#                 return jsonify({
-#                     "status": "error",
-#                     "message": str(task_result.result)
-#                 }), 500
-#         else:
-#             REQUEST_COUNT.labels(method='GET', endpoint='/task_status', status='202').inc()
-#             return jsonify({
-#                 "status": "processing",
-#                 "state": task_result.state
-#             }), 202
-#
-# @app.route("/mikrotik/openvpn/<provision_identity>/<secret>")
-# @require_secret
-# def mtk_openvpn(provision_identity, secret):
-#     """Returning openVPN client of a given provision_identity"""
-#     try:
-#         path = f"{Config.VPN_CLIENT_DIR}/{provision_identity}.ovpn"
-#         if not os.path.exists(path):
-#             return jsonify({"error": "Configuration not found"}), 404
-#         return send_file(path, as_attachment=True)
-#     except Exception as e:
-#         logger.error(f"Failed to send OpenVPN config: {str(e)}")
-#         return jsonify({"error": "Internal server error"}), 500
-#
-# @app.route("/mikrotik/hotspot/<provision_identity>/<secret>/<form>")
-# @require_secret
-# def mtk_hostpot_ui(provision_identity, secret, form):
-#     """Returning the hotspot login page.
-#         @:var form: Either login.html or rlogin.html
-#     """
-#     try:
-#         if form not in ["login.html", "rlogin.html"]:
-#             return jsonify({"error": "Form not found"}), 404
-#         return send_from_directory(Config.HOTSPOT_TEMPLATE_DIR, form)
-#     except Exception as e:
-#         logger.error(f"Failed to send hotspot template: {str(e)}")
-#         return jsonify({"error": "Internal server error"}), 500
+@app.route('/mikrotik/openvpn/create_provision/<provision_identity>', methods=["POST"])
+@rate_limit('create_provision')
+def mtk_create_new_provision(provision_identity):
+    """Create a new openVPN client with given name.
+    provision_identity: its just like name instance  (e.g client1,client2,...)
+    ?profile=<name> selects a connection profile (e.g udp, tcp) from VPN_PROFILES
+    """
+    with REQUEST_LATENCY.labels(endpoint='/create_provision').time():
+        try:
+            # Validate provision identity and profile
+            validate_provision_identity(provision_identity)
+            profile = request.args.get('profile')
+            validate_profile(profile)
+
+            # Claim the identity for the task, this fails if the client already exists or is being created
+            task_id = str(uuid.uuid4())
+            if not registry.claim(provision_identity, profile, token=task_id):
+                REQUEST_COUNT.labels(method='POST', endpoint='/create_provision', status='400').inc()
+                return jsonify({"error": "Client already exists"}), 400
+
+            # Start async certificate generation
+            try:
+                task = celery.send_task('generate_certificate', args=[provision_identity, profile], task_id=task_id)
+            except Exception:
+                registry.release(provision_identity, task_id)
+                raise
+
+            # Generate and return the secret
+            secret = generate_secret(provision_identity)
+
+            REQUEST_COUNT.labels(method='POST', endpoint='/create_provision', status='202').inc()
+            return jsonify({
+                "status": "processing",
+                "task_id": task.id,
+                "provision_identity": provision_identity,
+                "secret": secret
+            }), 202
+
+        except ValueError as e:
+            REQUEST_COUNT.labels(method='POST', endpoint='/create_provision', status='400').inc()
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            REQUEST_COUNT.labels(method='POST', endpoint='/create_provision', status='500').inc()
+            return jsonify({"error": "Internal server error"}), 500
+
+def task_result_response(endpoint, state, result):
+    """Build the status response for a finished certificate generation task."""
+    if state == 'SUCCESS':
+        if result['status'] == 'success':
+            REQUEST_COUNT.labels(method='GET', endpoint=endpoint, status='200').inc()
+            return jsonify(result), 200
+        else:
+            REQUEST_COUNT.labels(method='GET', endpoint=endpoint, status='400').inc()
+            return jsonify(result), 400
+    else:
+        REQUEST_COUNT.labels(method='GET', endpoint=endpoint, status='500').inc()
+        return jsonify({
+            "status": "error",
+            "message": str(result)
+        }), 500
+
+@app.route('/mikrotik/openvpn/task/<task_id>')
+def get_task_status(task_id):
+    """Get the status of a certificate generation task."""
+    with REQUEST_LATENCY.labels(endpoint='/task_status').time():
+        task_result = celery.AsyncResult(task_id)
+
+        if task_result.ready():
+            return task_result_response('/task_status', task_result.state, task_result.result)
+        else:
+            REQUEST_COUNT.labels(method='GET', endpoint='/task_status', status='202').inc()
+            return jsonify({
+                "status": "processing",
+                "state": task_result.state
+            }), 202
+
+@app.route('/mikrotik/openvpn/task/<task_id>/wait')
+def wait_task_status(task_id):
+    """Long-poll the status of a certificate generation task.
+    Blocks on the task's Redis channel until it finishes or ?timeout= seconds pass,
+    then answers like get_task_status. Meant for GUNICORN_WORKER_CLASS=gevent.
+    """
+    timeout = min(request.args.get('timeout', default=Config.TASK_WAIT_DEFAULT_TIMEOUT, type=float),
+                  Config.TASK_WAIT_MAX_TIMEOUT)
+    with REQUEST_LATENCY.labels(endpoint='/task_wait').time():
+        with TaskEvents(task_id) as events:
+            task_result = celery.AsyncResult(task_id)
+            if task_result.ready():
+                return task_result_response('/task_wait', task_result.state, task_result.result)
+            event = events.wait(timeout)
+
+        if event is None:
+            REQUEST_COUNT.labels(method='GET', endpoint='/task_wait', status='202').inc()
+            return jsonify({
+                "status": "processing",
+                "state": task_result.state
+            }), 202
+        return task_result_response('/task_wait', event['state'], event.get('result', event.get('message')))
+
+@app.route('/mikrotik/openvpn/task/<task_id>/events')
+def stream_task_events(task_id):
+    """Stream a certificate generation task's progress as Server-Sent Events.
+    The stream ends after the final 'result' event or ?timeout= seconds.
+    """
+    timeout = min(request.args.get('timeout', default=Config.TASK_WAIT_DEFAULT_TIMEOUT, type=float),
+                  Config.TASK_WAIT_MAX_TIMEOUT)
+
+    def generate():
+        with TaskEvents(task_id) as events:
+            task_result = celery.AsyncResult(task_id)
+            if task_result.ready():
+                event = {'type': 'result', 'final': True, 'state': task_result.state}
+                if task_result.successful():
+                    event['result'] = task_result.result
+                else:
+                    event['message'] = str(task_result.result)
+                yield f"event: result\ndata: {json.dumps(event)}\n\n"
+                return
+            for event in events.listen(timeout):
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                if event.get('final'):
+                    return
+            yield f"event: timeout\ndata: {json.dumps({'state': task_result.state})}\n\n"
+
+    REQUEST_COUNT.labels(method='GET', endpoint='/task_events', status='200').inc()
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/mikrotik/openvpn/create_provision_batch', methods=["POST"])
+@rate_limit('create_provision_batch')
+def mtk_create_provision_batch():
+    """Create many openVPN clients with one request.
+    Expects a JSON body: {"provision_identities": ["client1", "client2", ...], "profile": "udp"}
+    """
+    with REQUEST_LATENCY.labels(endpoint='/create_provision_batch').time():
+        try:
+            payload = request.get_json(silent=True) or {}
+            provision_identities = payload.get('provision_identities')
+            if not isinstance(provision_identities, list) or not provision_identities:
+                REQUEST_COUNT.labels(method='POST', endpoint='/create_provision_batch', status='400').inc()
+                return jsonify({"error": "provision_identities must be a non-empty list"}), 400
+            if len(provision_identities) > Config.PROVISION_BATCH_MAX_SIZE:
+                REQUEST_COUNT.labels(method='POST', endpoint='/create_provision_batch', status='400').inc()
+                return jsonify({"error": f"Batch exceeds {Config.PROVISION_BATCH_MAX_SIZE} provision identities"}), 400
+
+            # Validate every identity before queueing anything
+            invalid = validate_provision_identities(provision_identities)
+            if invalid:
+                REQUEST_COUNT.labels(method='POST', endpoint='/create_provision_batch', status='400').inc()
+                return jsonify({"error": "Invalid provision identity format", "invalid": invalid}), 400
+            profile = payload.get('profile')
+            validate_profile(profile)
+
+            # Skip duplicates and claim the rest, clients that already exist fail the claim
+            provision_identities = list(dict.fromkeys(provision_identities))
+            claim_token = uuid.uuid4().hex
+            pending = registry.claim_many(provision_identities, claim_token, profile)
+            claimed = set(pending)
+            existing = [provision_identity for provision_identity in provision_identities
+                        if provision_identity not in claimed]
+            if not pending:
+                REQUEST_COUNT.labels(method='POST', endpoint='/create_provision_batch', status='400').inc()
+                return jsonify({"error": "Clients already exist", "existing": existing}), 400
+
+            # Start async certificate generation, one task per chunk
+            try:
+                batch_id = create_batch(pending)
+                group(celery.signature('generate_certificate_batch', args=(batch_id, chunk, profile, claim_token))
+                      for chunk in chunked(pending, Config.PROVISION_BATCH_CHUNK_SIZE)).apply_async()
+            except Exception:
+                for provision_identity in pending:
+                    registry.release(provision_identity, claim_token)
+                raise
+
+            REQUEST_COUNT.labels(method='POST', endpoint='/create_provision_batch', status='202').inc()
+            return jsonify({
+                "status": "processing",
+                "batch_id": batch_id,
+                "total": len(pending),
+                "existing": existing,
+                "secrets": {provision_identity: generate_secret(provision_identity)
+                            for provision_identity in pending}
+            }), 202
+
+        except ValueError as e:
+            REQUEST_COUNT.labels(method='POST', endpoint='/create_provision_batch', status='400').inc()
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            REQUEST_COUNT.labels(method='POST', endpoint='/create_provision_batch', status='500').inc()
+            return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/mikrotik/openvpn/provisions')
+@require_api_token
+def list_provisions():
+    """Page through provisioned clients from the registry.
+    ?state=pending|issued|revoked filters, ?offset= and ?limit= paginate.
+    """
+    with REQUEST_LATENCY.labels(endpoint='/provisions').time():
+        state = request.args.get('state')
+        if state is not None and state not in STATES:
+            REQUEST_COUNT.labels(method='GET', endpoint='/provisions', status='400').inc()
+            return jsonify({"error": f"state must be one of {', '.join(STATES)}"}), 400
+        offset = max(request.args.get('offset', default=0, type=int), 0)
+        limit = min(max(request.args.get('limit', default=100, type=int), 1), Config.REGISTRY_PAGE_SIZE_MAX)
+
+        total, provisions = registry.list(state, offset, limit)
+        REQUEST_COUNT.labels(method='GET', endpoint='/provisions', status='200').inc()
+        return jsonify({
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "provisions": provisions
+        }), 200
+
+@app.route('/mikrotik/openvpn/sessions/<provision_identity>')
+@require_api_token
+def get_session_status(provision_identity):
+    """Tell whether a router is connected, with its virtual IP and since when.
+    Answered from the session index kept by the collector in sessions.py.
+    """
+    with REQUEST_LATENCY.labels(endpoint='/sessions').time():
+        try:
+            validate_provision_identity(provision_identity)
+        except ValueError as e:
+            REQUEST_COUNT.labels(method='GET', endpoint='/sessions', status='400').inc()
+            return jsonify({"error": str(e)}), 400
+
+        session = get_session(provision_identity)
+        if session is None:
+            REQUEST_COUNT.labels(method='GET', endpoint='/sessions', status='404').inc()
+            return jsonify({"provision_identity": provision_identity, "connected": False}), 404
+        REQUEST_COUNT.labels(method='GET', endpoint='/sessions', status='200').inc()
+        return jsonify({"provision_identity": provision_identity, "connected": True, **session}), 200
+
+@app.route('/mikrotik/openvpn/batch/<batch_id>')
+def get_batch_status(batch_id):
+    """Get the progress and per-identity results of a provisioning batch."""
+    with REQUEST_LATENCY.labels(endpoint='/batch_status').time():
+        batch = get_batch(batch_id)
+        if batch is None:
+            REQUEST_COUNT.labels(method='GET', endpoint='/batch_status', status='404').inc()
+            return jsonify({"error": "Batch not found"}), 404
+        status = 200 if batch['status'] == 'completed' else 202
+        REQUEST_COUNT.labels(method='GET', endpoint='/batch_status', status=str(status)).inc()
+        return jsonify(batch), status
+
+@app.route('/mikrotik/commands', methods=["POST"])
+@require_api_token
+def mtk_dispatch_commands():
+    """Run RouterOS API commands on many provisioned routers.
+    Expects a JSON body: {"provision_identities": ["client1", ...],
+                          "commands": [["/system/identity/print"], ["/ip/address/print", "?interface=ether1"]]}
+    """
+    with REQUEST_LATENCY.labels(endpoint='/commands').time():
+        try:
+            payload = request.get_json(silent=True) or {}
+            provision_identities = payload.get('provision_identities')
+            commands = payload.get('commands')
+            if not isinstance(provision_identities, list) or not provision_identities:
+                REQUEST_COUNT.labels(method='POST', endpoint='/commands', status='400').inc()
+                return jsonify({"error": "provision_identities must be a non-empty list"}), 400
+            if len(provision_identities) > Config.MIKROTIK_DISPATCH_MAX_ROUTERS:
+                REQUEST_COUNT.labels(method='POST', endpoint='/commands', status='400').inc()
+                return jsonify({"error": f"Job exceeds {Config.MIKROTIK_DISPATCH_MAX_ROUTERS} routers"}), 400
+            if not isinstance(commands, list) or not commands or not all(
+                    isinstance(command, list) and command and all(isinstance(word, str) for word in command)
+                    and command[0].startswith('/') for command in commands):
+                REQUEST_COUNT.labels(method='POST', endpoint='/commands', status='400').inc()
+                return jsonify({"error": "commands must be a non-empty list of RouterOS API word lists"}), 400
+
+            invalid = validate_provision_identities(provision_identities)
+            if invalid:
+                REQUEST_COUNT.labels(method='POST', endpoint='/commands', status='400').inc()
+                return jsonify({"error": "Invalid provision identity format", "invalid": invalid}), 400
+
+            # One task per chunk of routers, each fans out to its routers concurrently
+            provision_identities = list(dict.fromkeys(provision_identities))
+            job_id = create_batch(provision_identities, prefix=JOB_PREFIX)
+            group(celery.signature('dispatch_router_commands', args=(job_id, chunk, commands))
+                  for chunk in chunked(provision_identities, Config.MIKROTIK_DISPATCH_CHUNK_SIZE)).apply_async()
+
+            REQUEST_COUNT.labels(method='POST', endpoint='/commands', status='202').inc()
+            return jsonify({
+                "status": "processing",
+                "job_id": job_id,
+                "total": len(provision_identities)
+            }), 202
+
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            REQUEST_COUNT.labels(method='POST', endpoint='/commands', status='500').inc()
+            return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/mikrotik/commands/<job_id>')
+@require_api_token
+def get_command_job(job_id):
+    """Get the aggregated per-router results of a command job."""
+    with REQUEST_LATENCY.labels(endpoint='/command_job').time():
+        job = get_batch(job_id, prefix=JOB_PREFIX)
+        if job is None:
+            REQUEST_COUNT.labels(method='GET', endpoint='/command_job', status='404').inc()
+            return jsonify({"error": "Job not found"}), 404
+        job['job_id'] = job.pop('batch_id')
+        status = 200 if job['status'] == 'completed' else 202
+        REQUEST_COUNT.labels(method='GET', endpoint='/command_job', status=str(status)).inc()
+        return jsonify(job), status
+
+@app.route('/mikrotik/openvpn/servers')
+@require_api_token
+def list_servers():
+    """Show the server pool: capacity, live sessions and assigned clients per server."""
+    with REQUEST_LATENCY.labels(endpoint='/servers').time():
+        if not server_pool.enabled:
+            REQUEST_COUNT.labels(method='GET', endpoint='/servers', status='404').inc()
+            return jsonify({"error": "No server pool configured"}), 404
+        REQUEST_COUNT.labels(method='GET', endpoint='/servers', status='200').inc()
+        return jsonify({"servers": server_pool.status()}), 200
+
+@app.route('/mikrotik/openvpn/revoke', methods=["POST"])
+@require_api_token
+def mtk_revoke_provisions():
+    """Revoke the certificates of many clients.
+    Expects a JSON body: {"provision_identities": ["client1", "client2", ...]}
+    Revocations are queued and applied together after REVOCATION_BATCH_DELAY seconds, in one CRL update.
+    """
+    with REQUEST_LATENCY.labels(endpoint='/revoke').time():
+        try:
+            payload = request.get_json(silent=True) or {}
+            provision_identities = payload.get('provision_identities')
+            if not isinstance(provision_identities, list) or not provision_identities:
+                REQUEST_COUNT.labels(method='POST', endpoint='/revoke', status='400').inc()
+                return jsonify({"error": "provision_identities must be a non-empty list"}), 400
+            if len(provision_identities) > Config.REVOCATION_REQUEST_MAX_SIZE:
+                REQUEST_COUNT.labels(method='POST', endpoint='/revoke', status='400').inc()
+                return jsonify({"error": f"Request exceeds {Config.REVOCATION_REQUEST_MAX_SIZE} identities"}), 400
+
+            invalid = validate_provision_identities(provision_identities)
+            if invalid:
+                REQUEST_COUNT.labels(method='POST', endpoint='/revoke', status='400').inc()
+                return jsonify({"error": "Invalid provision identity format", "invalid": invalid}), 400
+
+            # Only issued clients have a certificate to revoke
+            provision_identities = list(dict.fromkeys(provision_identities))
+            states = registry.get_states(provision_identities)
+            issued = [p for p, state in zip(provision_identities, states) if state == 'issued']
+            not_issued = [p for p, state in zip(provision_identities, states) if state != 'issued']
+
+            queued = revocation.queue_revocations(issued)
+            if issued and revocation.should_schedule():
+                celery.send_task('apply_revocations', countdown=Config.REVOCATION_BATCH_DELAY)
+
+            REQUEST_COUNT.labels(method='POST', endpoint='/revoke', status='202').inc()
+            return jsonify({
+                "status": "queued",
+                "queued": queued,
+                "not_issued": not_issued,
+                "pending": revocation.pending_count()
+            }), 202
+
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            REQUEST_COUNT.labels(method='POST', endpoint='/revoke', status='500').inc()
+            return jsonify({"error": "Internal server error"}), 500
+
+@app.route("/mikrotik/openvpn/<provision_identity>/<secret>")
+@rate_limit('download')
+@require_secret
+def mtk_openvpn(provision_identity, secret):
+    """Returning openVPN client of a given provision_identity.
+    Answers If-None-Match/If-Modified-Since with 304 so polling scripts don't re-download.
+    """
+    try:
+        path = client_storage.locate(provision_identity, '.ovpn')
+        cached = ovpn_cache.get(path) if path else None
+        if cached is None:
+            return jsonify({"error": "Configuration not found"}), 404
+
+        if Config.OVPN_ACCEL_REDIRECT_PREFIX:
+            # Let nginx send the body from its internal location
+            response = Response(mimetype='application/octet-stream')
+            relative_path = os.path.relpath(path, client_storage.root).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = f"{Config.OVPN_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{relative_path}"
+        elif cached.body is not None:
+            response = Response(cached.body, mimetype='application/octet-stream')
+        else:
+            response = send_file(path, mimetype='application/octet-stream', conditional=False, etag=False)
+
+        response.headers.set('Content-Disposition', 'attachment', filename=f"{provision_identity}.ovpn")
+        response.set_etag(cached.etag)
+        response.last_modified = cached.last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    except Exception as e:
+        logger.error(f"Failed to send OpenVPN config: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route("/mikrotik/hotspot/<provision_identity>/<secret>/<form>")
+@require_secret
+def mtk_hostpot_ui(provision_identity, secret, form):
+    """Returning the hotspot login page.
+        @:var form: Either login.html or rlogin.html
+    Sends the precompressed variant the router accepts; routers revalidate with If-None-Match.
+    """
+    try:
+        if form not in HOTSPOT_FORMS:
+            return jsonify({"error": "Form not found"}), 404
+        page = hotspot_pages.get(provision_identity, form)
+        if page is None:
+            return jsonify({"error": "Form not found"}), 404
+
+        encoding = negotiate_encoding(request.accept_encodings, page.bodies)
+        response = Response(page.bodies[encoding], mimetype='text/html')
+        if encoding != 'identity':
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        # Each coding is a different representation, so it gets its own strong ETag
+        response.set_etag(page.etag if encoding == 'identity' else f"{page.etag}-{encoding}")
+        response.last_modified = page.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = Config.HOTSPOT_CACHE_MAX_AGE
+        return response.make_conditional(request)
+    except Exception as e:
+        logger.error(f"Failed to send hotspot template: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
 
 if __name__ == '__main__':
+    log_to_file()
     app.run(debug=False)  # Set debug=False in production
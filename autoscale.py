@@ -0,0 +1,99 @@
+"""
+Celery pool autoscaling from broker queue depth.
+
+Celery's own autoscaler sizes the pool from the messages a worker has
+reserved, which with a prefetch multiplier of 1 never exceeds the pool, so
+a backlog in Redis goes unnoticed. QueueDepthAutoscaler also counts the
+messages waiting in the queues the worker consumes: the pool grows to the
+tasks running now plus one process per CELERY_AUTOSCALE_TASKS_PER_PROCESS
+queued tasks, within the --autoscale max and min. It shrinks once the
+backlog is gone, no sooner than AUTOSCALE_KEEPALIVE seconds (Celery's
+setting, default 30) after the last scale-up. Every worker sees the whole
+backlog, so size max per host.
+
+Enable it with `celery -A celery_config worker --autoscale=<max>,<min>`.
+"""
+import math
+import time
+import logging
+import redis
+from redis.exceptions import RedisError
+from kombu.transport.redis import PRIORITY_STEPS, Channel
+from celery.worker import state
+from celery.worker.autoscale import Autoscaler
+from config import Config
+from metrics import CELERY_QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+
+class QueueDepthAutoscaler(Autoscaler):
+    """Autoscaler that also scales on the Redis backlog of the consumed queues."""
+
+    def __init__(self, pool, max_concurrency, min_concurrency=0, worker=None, **kwargs):
+        super().__init__(pool, max_concurrency, min_concurrency, worker=worker, **kwargs)
+        self._client = None
+        self._backlog = 0
+        self._backlog_read_at = 0.0
+        # Celery only re-checks on received messages and every keepalive, and a full
+        # pool receives none, so check the backlog on our own interval too
+        hub = getattr(worker, 'hub', None)
+        if hub is not None:
+            hub.call_repeatedly(Config.CELERY_AUTOSCALE_INTERVAL, self.maybe_scale)
+
+    def _redis(self):
+        if self._client is None:
+            broker_url = self.worker.app.conf.broker_url or ''
+            if broker_url.startswith(('redis://', 'rediss://', 'unix://')):
+                self._client = redis.Redis.from_url(broker_url, socket_timeout=Config.REDIS_SOCKET_TIMEOUT)
+        return self._client
+
+    def queue_depths(self):
+        """Return the messages waiting in each consumed queue, across its priority lists.
+
+        Returns:
+            dict: Depth by queue name, empty if the broker is not Redis
+        """
+        client = self._redis() if self.worker is not None else None
+        if client is None:
+            return {}
+        options = self.worker.app.conf.broker_transport_options or {}
+        steps = options.get('priority_steps', PRIORITY_STEPS)
+        sep = options.get('sep', Channel.sep)
+        queues = list(self.worker.app.amqp.queues.consume_from)
+
+        pipe = client.pipeline(transaction=False)
+        for queue in queues:
+            for priority in steps:
+                pipe.llen(f"{queue}{sep}{priority}" if priority else queue)
+        lengths = pipe.execute()
+        return {queue: sum(lengths[i * len(steps):(i + 1) * len(steps)]) for i, queue in enumerate(queues)}
+
+    def backlog(self):
+        """Return the total depth of the consumed queues, read at most every CELERY_AUTOSCALE_INTERVAL."""
+        now = time.monotonic()
+        if now - self._backlog_read_at >= Config.CELERY_AUTOSCALE_INTERVAL:
+            self._backlog_read_at = now
+            try:
+                depths = self.queue_depths()
+            except RedisError as e:
+                logger.warning(f"Could not read queue depth, scaling on reserved tasks only: {str(e)}")
+                depths = {}
+            for queue, depth in depths.items():
+                CELERY_QUEUE_DEPTH.labels(queue=queue).set(depth)
+            self._backlog = sum(depths.values())
+        return self._backlog
+
+    @property
+    def qty(self):
+        reserved = len(state.reserved_requests)
+        backlog = self.backlog()
+        if not backlog:
+            return reserved
+        wanted = len(state.active_requests) + math.ceil(backlog / max(Config.CELERY_AUTOSCALE_TASKS_PER_PROCESS, 1))
+        return max(reserved, wanted)
+
+    def info(self):
+        info = super().info()
+        info['backlog'] = self._backlog
+        return info
@@ -0,0 +1,96 @@
+import json
+import time
+import uuid
+from config import Config
+from redis_client import redis_client
+
+
+def _batch_key(batch_id, prefix):
+    return f"{prefix}:{batch_id}"
+
+
+def chunked(items, size):
+    """Split a list into consecutive chunks of at most `size` items."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def create_batch(provision_identities, prefix='provision_batch'):
+    """Create the Redis record tracking a provisioning batch.
+
+    Args:
+        provision_identities (list): The identities provisioned by the batch
+        prefix (str): The key prefix, so other fan-out jobs can share the format
+
+    Returns:
+        str: The batch id
+    """
+    batch_id = uuid.uuid4().hex
+    key = _batch_key(batch_id, prefix)
+    pending = json.dumps({'status': 'pending'})
+    pipe = redis_client.pipeline()
+    pipe.hset(f"{key}:meta", mapping={
+        'total': len(provision_identities),
+        'completed': 0,
+        'failed': 0,
+        'created_at': time.time()
+    })
+    pipe.hset(key, mapping={provision_identity: pending for provision_identity in provision_identities})
+    pipe.expire(key, Config.PROVISION_BATCH_TTL)
+    pipe.expire(f"{key}:meta", Config.PROVISION_BATCH_TTL)
+    pipe.execute()
+    return batch_id
+
+
+def record_batch_result(batch_id, provision_identity, result, prefix='provision_batch'):
+    """Store the result of one identity and update the batch counters."""
+    key = _batch_key(batch_id, prefix)
+    pipe = redis_client.pipeline()
+    pipe.hset(key, provision_identity, json.dumps(result))
+    pipe.hincrby(f"{key}:meta", 'completed', 1)
+    if result.get('status') != 'success':
+        pipe.hincrby(f"{key}:meta", 'failed', 1)
+    pipe.hget(f"{key}:meta", 'total')
+    _, completed, *_, total = pipe.execute()
+    if int(completed) == int(total):
+        redis_client.hsetnx(f"{key}:meta", 'finished_at', time.time())
+
+
+def unfinished(batch_id, provision_identities, prefix='provision_batch'):
+    """Return the identities that have no result recorded yet.
+
+    Tasks are acked late, so a chunk whose worker was lost is delivered again;
+    identities it already finished are skipped instead of being counted twice.
+    """
+    if not provision_identities:
+        return []
+    results = redis_client.hmget(_batch_key(batch_id, prefix), provision_identities)
+    return [provision_identity for provision_identity, result in zip(provision_identities, results)
+            if result is None or json.loads(result).get('status') == 'pending']
+
+
+def get_batch(batch_id, prefix='provision_batch'):
+    """Return the progress and per-identity results of a batch.
+
+    Returns:
+        dict: The batch report, or None if the batch is unknown or expired
+    """
+    key = _batch_key(batch_id, prefix)
+    meta, results = redis_client.hgetall_many([f"{key}:meta", key])
+    if not meta:
+        return None
+
+    total = int(meta['total'])
+    completed = int(meta['completed'])
+    created_at = float(meta['created_at'])
+    finished_at = float(meta['finished_at']) if 'finished_at' in meta else None
+    elapsed = (finished_at or time.time()) - created_at
+    return {
+        'batch_id': batch_id,
+        'status': 'completed' if completed == total else 'processing',
+        'total': total,
+        'completed': completed,
+        'failed': int(meta['failed']),
+        'elapsed': round(elapsed, 3),
+        'clients_per_second': round(completed / elapsed, 2) if elapsed > 0 else None,
+        'results': {provision_identity: json.loads(result) for provision_identity, result in results.items()}
+    }
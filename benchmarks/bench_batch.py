@@ -0,0 +1,83 @@
+"""Compare provisioning throughput of the single-client and batch endpoints.
+
+Usage:
+    python benchmarks/bench_batch.py --url http://localhost:5000 -n 100
+
+Runs against a live deployment (web, Redis and a Celery worker). Each run
+uses fresh, randomly prefixed provision identities, so the clients it
+creates have to be cleaned up afterwards.
+"""
+import json
+import time
+import uuid
+import argparse
+import urllib.error
+import urllib.request
+
+
+def call(method, url, payload=None):
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def bench_single(base_url, identities, poll_interval):
+    requests = 0
+    task_ids = []
+    for provision_identity in identities:
+        status, body = call('POST', f"{base_url}/mikrotik/openvpn/create_provision/{provision_identity}")
+        requests += 1
+        if status != 202:
+            raise SystemExit(f"create_provision failed for {provision_identity}: {status} {body}")
+        task_ids.append(body['task_id'])
+
+    pending = set(task_ids)
+    while pending:
+        for task_id in list(pending):
+            status, _ = call('GET', f"{base_url}/mikrotik/openvpn/task/{task_id}")
+            requests += 1
+            if status != 202:
+                pending.discard(task_id)
+        if pending:
+            time.sleep(poll_interval)
+    return requests
+
+
+def bench_batch(base_url, identities, poll_interval):
+    status, body = call('POST', f"{base_url}/mikrotik/openvpn/create_provision_batch",
+                        {'provision_identities': identities})
+    requests = 1
+    if status != 202:
+        raise SystemExit(f"create_provision_batch failed: {status} {body}")
+
+    while True:
+        status, report = call('GET', f"{base_url}/mikrotik/openvpn/batch/{body['batch_id']}")
+        requests += 1
+        if status != 202:
+            return requests
+        time.sleep(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('-n', '--count', type=int, default=100, help="clients to provision per mode")
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    args = parser.parse_args()
+
+    run_id = uuid.uuid4().hex[:8]
+    for mode, bench in (('single', bench_single), ('batch', bench_batch)):
+        identities = [f"bench-{run_id}-{mode}-{i}" for i in range(args.count)]
+        start = time.perf_counter()
+        requests = bench(args.url.rstrip('/'), identities, args.poll_interval)
+        elapsed = time.perf_counter() - start
+        print(f"{mode:6s} {args.count:5d} clients in {elapsed:8.2f}s  "
+              f"{args.count / elapsed:7.2f} clients/sec  {requests:6d} HTTP requests")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Compare Mikrotik command dispatch strategies against a fake RouterOS server.
+
+Usage:
+    python benchmarks/bench_dispatch.py --routers 200 --commands 5 --latency 0.02
+
+Starts benchmarks/fake_routeros.py in-process and runs the same job three
+ways: a fresh connection and login per command (the old one-shot style),
+pooled sessions with one round trip per command, and pooled, pipelined
+sessions fanned out concurrently (what dispatcher.dispatch does). Every
+router is the same local server, so --routers controls the number of
+independent jobs, not distinct hosts.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_routeros import FakeRouterOS  # noqa: E402
+from routeros import RouterOSConnection, RouterPool  # noqa: E402
+
+
+def one_shot(host, port, commands):
+    """Connect and log in for every command."""
+    for command in commands:
+        connection = RouterOSConnection(host, port, 'admin', '').connect()
+        try:
+            connection.pipeline([command])
+        finally:
+            connection.close()
+
+
+def make_pooled(pool, host, pipelined):
+    def run(commands):
+        connection = pool.acquire(host)
+        try:
+            if pipelined:
+                connection.pipeline(commands)
+            else:
+                for command in commands:
+                    connection.pipeline([command])
+        finally:
+            pool.release(connection)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routers', type=int, default=200)
+    parser.add_argument('--commands', type=int, default=5, help="commands per router")
+    parser.add_argument('--latency', type=float, default=0.02, help="emulated round trip in seconds")
+    parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    server = FakeRouterOS(('127.0.0.1', 0), args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    commands = [['/system/resource/print']] * args.commands
+
+    pool = RouterPool(size=args.concurrency, idle_timeout=60, port=port)
+
+    modes = (
+        ('one-shot', lambda: one_shot(host, port, commands), 1),
+        ('pooled', lambda: make_pooled(pool, host, pipelined=False)(commands), args.concurrency),
+        ('pipelined', lambda: make_pooled(pool, host, pipelined=True)(commands), args.concurrency),
+    )
+    for mode, run, workers in modes:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda _: run(), range(args.routers)))
+        elapsed = time.perf_counter() - start
+        total = args.routers * args.commands
+        print(f"{mode:10s} {args.routers:5d} routers x {args.commands} commands in {elapsed:8.2f}s  "
+              f"{total / elapsed:9.1f} commands/sec")
+
+    pool.close_all()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
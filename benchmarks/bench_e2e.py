@@ -0,0 +1,268 @@
+"""End-to-end provisioning benchmark that runs offline on one Linux box.
+
+Usage:
+    python benchmarks/bench_e2e.py -n 200 --levels 1 2 4 8
+    python benchmarks/bench_e2e.py -n 200 --levels 4 --engine native --json run.json
+    python benchmarks/bench_e2e.py -n 200 --levels 4 --baseline run.json
+
+Everything runs against throwaway state in a temp dir: a CA and PKI, a
+VPN_CLIENT_DIR, and an easy-rsa directory whose `easyrsa` is
+fake_easyrsa.py, sleeping --easyrsa-latency per certificate before it signs.
+Redis (broker, result backend, registry, task events) is a fakeredis server
+on a local port unless --redis-url points at a real one.
+
+For each worker concurrency in --levels a Celery worker is started, warmed
+up, then --clients threads drive the Flask app (test client, in this
+process) through the full flow: POST create_provision, long-poll
+task/<id>/wait and download the .ovpn. Reported per level: p50/p95/p99 of
+that flow, tasks/sec over the run and the peak RSS of the worker's pool
+processes. --json saves the results, --baseline prints the change against
+a saved run. Needs fakeredis (and lupa for its Lua scripts) unless
+--redis-url is given.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import signal
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def start_fake_redis():
+    """Serve an in-memory Redis on a free local port, return its URL."""
+    import fakeredis
+    server = fakeredis.TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+    server.daemon_threads = True  # connection threads must not keep the benchmark from exiting
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return f"redis://{host}:{port}/0"
+
+
+def prepare(work_dir, redis_url, args):
+    """Set up the environment for the app and worker, then create the PKI, client dir and fake easyrsa."""
+    easyrsa_dir = os.path.join(work_dir, "easy-rsa")
+    pki_dir = os.path.join(easyrsa_dir, "pki")
+    client_dir = os.path.join(work_dir, "clients")
+    host_port = redis_url.split('://', 1)[1].split('/', 1)[0]
+    os.environ.update({
+        # No .env.<FLASK_ENV> file exists for 'bench', so nothing overrides these
+        'FLASK_ENV': 'bench',
+        'LOG_LEVEL': 'WARNING',
+        'REDIS_HOST': host_port.rsplit(':', 1)[0],
+        'REDIS_PORT': host_port.rsplit(':', 1)[1],
+        'CELERY_BROKER_URL': redis_url,
+        'CELERY_RESULT_BACKEND': redis_url,
+        'CELERY_METRICS_PORT': '0',
+        'VPN_CLIENT_DIR': client_dir,
+        'PKI_ENGINE': args.engine,
+        'EASYRSA_DIR': easyrsa_dir,
+        'EASYRSA_PKI': pki_dir,
+        'EASYRSA_ALGO': args.algo,
+        'EASYRSA_FAKE_LATENCY': str(args.easyrsa_latency),
+        'KEY_POOL_ENABLED': 'false',
+        'RATE_LIMIT_ENABLED': 'false',
+    })
+    # Project modules read their configuration at import, so nothing of theirs is imported before this
+    from bench_pki import create_ca
+
+    create_ca(pki_dir)
+    os.makedirs(os.path.join(pki_dir, "issued"))
+    os.makedirs(client_dir)
+    shutil.copy(os.path.join(pki_dir, "ca.crt"), os.path.join(client_dir, "ca.crt"))
+
+    easyrsa = os.path.join(easyrsa_dir, "easyrsa")
+    with open(easyrsa, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(ROOT, "benchmarks", "fake_easyrsa.py")}" "$@"\n')
+    os.chmod(easyrsa, 0o755)
+
+
+def start_worker(concurrency):
+    return subprocess.Popen(
+        [sys.executable, "-m", "celery", "--quiet", "-A", "celery_config", "worker", "--loglevel=warning",
+         "--pool=prefork", f"--concurrency={concurrency}", "--without-gossip", "--without-mingle",
+         "--without-heartbeat", f"--hostname=bench-{uuid.uuid4().hex[:8]}@%h"],
+        cwd=ROOT)
+
+
+def wait_for_worker(worker, timeout=60):
+    from celery_config import celery
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if worker.poll() is not None:
+            raise SystemExit("Celery worker exited during startup")
+        if celery.control.ping(timeout=1):
+            return
+    raise SystemExit("Celery worker did not come up")
+
+
+def stop_worker(worker):
+    worker.send_signal(signal.SIGTERM)
+    try:
+        worker.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        worker.kill()
+        worker.wait()
+
+
+def pool_processes(pid):
+    """Return the pids of a process's children, from /proc."""
+    children = []
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{tid}/children") as f:
+            children.extend(int(child) for child in f.read().split())
+    return children
+
+
+def peak_rss_mib(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def provision(client, provision_identity, timeout):
+    """Run one client through create, wait and download.
+
+    Returns:
+        float: Seconds from the create request to the downloaded config, or None on failure
+    """
+    start = time.perf_counter()
+    resp = client.post(f"/mikrotik/openvpn/create_provision/{provision_identity}")
+    if resp.status_code != 202:
+        return None
+    body = resp.get_json()
+    deadline = start + timeout
+    while True:
+        resp = client.get(f"/mikrotik/openvpn/task/{body['task_id']}/wait?timeout=5")
+        if resp.status_code != 202:
+            break
+        if time.perf_counter() > deadline:
+            return None
+    if resp.status_code != 200:
+        return None
+    resp = client.get(f"/mikrotik/openvpn/{provision_identity}/{body['secret']}")
+    resp.close()
+    if resp.status_code != 200:
+        return None
+    return time.perf_counter() - start
+
+
+def drive(app, prefix, count, clients, timeout):
+    """Provision `count` new clients from `clients` threads, return (latencies, errors, seconds)."""
+    local = threading.local()
+
+    def run(i):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        return provision(local.client, f"{prefix}-{i}", timeout)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(run, range(count)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(r for r in results if r is not None)
+    return latencies, len(results) - len(latencies), elapsed
+
+
+def percentile(latencies, q):
+    if not latencies:
+        return float('nan')
+    return latencies[min(int(len(latencies) * q), len(latencies) - 1)]
+
+
+def run_level(app, concurrency, args):
+    worker = start_worker(concurrency)
+    try:
+        wait_for_worker(worker)
+        run_id = uuid.uuid4().hex[:8]
+        # Warm up: the worker connects, every pool process imports its first task
+        drive(app, f"warmup-{run_id}", concurrency * 2, concurrency * 2, args.timeout + 60)
+        latencies, errors, elapsed = drive(app, f"bench-{run_id}", args.count, args.clients or concurrency * 2,
+                                           args.timeout)
+        children = pool_processes(worker.pid)
+        rss = [peak_rss_mib(pid) for pid in children]
+    finally:
+        stop_worker(worker)
+    return {
+        'concurrency': concurrency,
+        'tasks': len(latencies),
+        'errors': errors,
+        'tasks_per_sec': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) if latencies else float('nan'),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'worker_rss_mib': statistics.mean(rss) if rss else 0.0,
+    }
+
+
+def print_result(result, baseline=None):
+    line = (f"concurrency {result['concurrency']:3d}  {result['tasks']:5d} tasks  {result['errors']:3d} errors  "
+            f"{result['tasks_per_sec']:7.1f} tasks/sec  p50 {result['p50'] * 1000:7.1f}ms  "
+            f"p95 {result['p95'] * 1000:7.1f}ms  p99 {result['p99'] * 1000:7.1f}ms  "
+            f"{result['worker_rss_mib']:6.1f} MiB/worker")
+    if baseline is not None:
+        deltas = []
+        for key in ('tasks_per_sec', 'p95', 'worker_rss_mib'):
+            if baseline.get(key):
+                deltas.append(f"{key} {(result[key] - baseline[key]) / baseline[key] * 100:+.1f}%")
+        line += "  vs baseline: " + ", ".join(deltas)
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, default=100, help="clients provisioned per level")
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 2, 4], help="worker concurrency levels")
+    parser.add_argument('--clients', type=int, default=0, help="client threads, defaults to twice the concurrency")
+    parser.add_argument('--engine', choices=('easyrsa', 'native'), default='easyrsa')
+    parser.add_argument('--easyrsa-latency', type=float, default=0.2,
+                        help="seconds the fake easyrsa sleeps per certificate")
+    parser.add_argument('--algo', choices=('rsa', 'ec'), default='ec', help="client key type (EASYRSA_ALGO)")
+    parser.add_argument('--timeout', type=float, default=120, help="seconds before a client counts as failed")
+    parser.add_argument('--redis-url', help="use this Redis instead of fakeredis; its db is written to")
+    parser.add_argument('--json', help="save the results to this file")
+    parser.add_argument('--baseline', help="compare against results saved with --json")
+    parser.add_argument('--keep', action='store_true', help="keep the temp dir (PKI, client files)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench-e2e-")
+    redis_url = args.redis_url or start_fake_redis()
+    prepare(work_dir, redis_url, args)
+    import app as web
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r['concurrency']: r for r in json.load(f)['results']}
+
+    print(f"engine {args.engine} ({args.algo}), easyrsa latency {args.easyrsa_latency}s, redis {redis_url}, "
+          f"work dir {work_dir}")
+    results = []
+    try:
+        for concurrency in args.levels:
+            result = run_level(web.app, concurrency, args)
+            results.append(result)
+            print_result(result, baseline.get(concurrency) if args.baseline else None)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': {k: v for k, v in vars(args).items() if k not in ('json', 'baseline')},
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
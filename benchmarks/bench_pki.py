@@ -0,0 +1,96 @@
+"""Compare client certificates per second: in-process PKIEngine vs `easyrsa build-client-full`.
+
+Usage:
+    python benchmarks/bench_pki.py -n 20
+    python benchmarks/bench_pki.py -n 20 --easyrsa /usr/share/easy-rsa
+
+Without --easyrsa only the native engine is measured, against a throwaway CA.
+With --easyrsa the easy-rsa directory is copied into a temp dir, a PKI is
+initialised with it and both engines issue into that same PKI.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from pki import PKIEngine, easyrsa_build_client_full
+
+
+def create_ca(pki_dir):
+    """Create a self-signed CA in the easy-rsa layout."""
+    os.makedirs(os.path.join(pki_dir, "private"), exist_ok=True)
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "bench-ca")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    with open(os.path.join(pki_dir, "ca.crt"), 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(os.path.join(pki_dir, "private", "ca.key"), 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+
+
+def init_easyrsa(source_dir, work_dir):
+    """Copy easy-rsa into work_dir and build a CA with it."""
+    easyrsa_dir = os.path.join(work_dir, "easy-rsa")
+    shutil.copytree(source_dir, easyrsa_dir)
+    env = {**os.environ, 'EASYRSA_BATCH': '1'}
+    subprocess.run(["./easyrsa", "init-pki"], cwd=easyrsa_dir, env=env, check=True, capture_output=True)
+    subprocess.run(["./easyrsa", "build-ca", "nopass"], cwd=easyrsa_dir, env=env, check=True, capture_output=True)
+    return easyrsa_dir
+
+
+def run(label, count, issue):
+    start = time.perf_counter()
+    for i in range(count):
+        issue(f"{label}-{i}")
+    elapsed = time.perf_counter() - start
+    print(f"{label:8s} {count:5d} certs in {elapsed:8.3f}s  {count / elapsed:8.2f} certs/sec")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, default=20, help="certificates to issue per engine")
+    parser.add_argument('--easyrsa', help="easy-rsa directory containing the ./easyrsa script")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.easyrsa:
+            easyrsa_dir = init_easyrsa(args.easyrsa, work_dir)
+            pki_dir = os.path.join(easyrsa_dir, "pki")
+        else:
+            easyrsa_dir = None
+            pki_dir = os.path.join(work_dir, "pki")
+            create_ca(pki_dir)
+
+        engine = PKIEngine(pki_dir)
+        native = run("native", args.count, engine.build_client_full)
+        if easyrsa_dir:
+            subproc = run("easyrsa", args.count, lambda name: easyrsa_build_client_full(name, easyrsa_dir))
+            print(f"speedup  {subproc / native:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
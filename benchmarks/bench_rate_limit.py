@@ -0,0 +1,96 @@
+"""Check that the API stays responsive while routers flood it.
+
+Usage:
+    python benchmarks/bench_rate_limit.py --url http://localhost:5000 --abusers 32 --duration 20
+
+First measures a well-behaved client (GET --probe, /health by default) on an
+idle server, then again while --abusers threads loop as fast as they can on
+create_provision for one identity and on .ovpn downloads with a wrong
+secret. With the rate limiter on, the abusers should mostly get 429s and the
+probe latency should stay close to the baseline; run once with
+RATE_LIMIT_ENABLED=false on the server to compare.
+
+With --spoof-ips each abuser sends its own X-Forwarded-For address, which
+the server only honours with TRUSTED_PROXIES=1 (as behind nginx).
+"""
+import time
+import argparse
+import threading
+import statistics
+import urllib.error
+import urllib.request
+from collections import Counter
+
+
+def request(method, url, headers=None):
+    req = urllib.request.Request(url, method=method, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+    except (urllib.error.URLError, OSError):
+        return 'error'
+
+
+def abuser(base_url, index, spoof_ips, stop, statuses, lock):
+    headers = {'X-Forwarded-For': f"198.51.100.{index % 250 + 1}"} if spoof_ips else {}
+    paths = [('POST', f"{base_url}/mikrotik/openvpn/create_provision/bench-abuse"),
+             ('GET', f"{base_url}/mikrotik/openvpn/bench-abuse/not-the-secret")]
+    counts = Counter()
+    i = 0
+    while not stop.is_set():
+        method, url = paths[i % len(paths)]
+        counts[request(method, url, headers)] += 1
+        i += 1
+    with lock:
+        statuses.update(counts)
+
+
+def probe(url, duration):
+    latencies = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        request('GET', url)
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.05)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1], len(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--probe', default='/health')
+    parser.add_argument('--abusers', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20.0, help="seconds per phase")
+    parser.add_argument('--spoof-ips', action='store_true')
+    args = parser.parse_args()
+    base_url = args.url.rstrip('/')
+
+    p50, p95, count = probe(base_url + args.probe, args.duration)
+    print(f"idle        probe p50 {p50 * 1000:7.1f}ms  p95 {p95 * 1000:7.1f}ms  ({count} requests)")
+
+    stop = threading.Event()
+    statuses = Counter()
+    lock = threading.Lock()
+    threads = [threading.Thread(target=abuser, args=(base_url, i, args.spoof_ips, stop, statuses, lock))
+               for i in range(args.abusers)]
+    for thread in threads:
+        thread.start()
+    p50, p95, count = probe(base_url + args.probe, args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    print(f"under abuse probe p50 {p50 * 1000:7.1f}ms  p95 {p95 * 1000:7.1f}ms  ({count} requests)")
+
+    total = sum(statuses.values())
+    breakdown = '  '.join(f"{status}: {n}" for status, n in statuses.most_common())
+    print(f"abusers     {total} requests, {total / args.duration:.1f} req/s  {breakdown}")
+
+
+if __name__ == '__main__':
+    main()
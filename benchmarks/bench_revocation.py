@@ -0,0 +1,63 @@
+"""Compare revoking clients one CRL update at a time vs in one batch.
+
+Usage:
+    python benchmarks/bench_revocation.py -n 1000 --existing 5000
+
+Issues --existing + 2 * n client certificates against a throwaway CA (keys
+are shared to keep setup quick), pre-revokes --existing of them so the CRL
+starts out non-empty, then revokes n clients with one PKIEngine.revoke call
+each (what a per-client `easyrsa revoke` + `gen-crl` amounts to) and another
+n with a single call.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pki import create_ca  # noqa: E402
+from pki import PKIEngine  # noqa: E402
+
+
+def issue(engine, names, key):
+    certs = {}
+    for name in names:
+        certs[name] = engine.build_client_full(name, key)[2]
+    return certs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, default=200, help="clients to revoke per mode")
+    parser.add_argument('--existing', type=int, default=1000, help="certificates already on the CRL")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        pki_dir = os.path.join(work_dir, "pki")
+        create_ca(pki_dir)
+        engine = PKIEngine(pki_dir)
+        key = engine.generate_private_key()
+
+        engine.revoke(issue(engine, [f"old-{i}" for i in range(args.existing)], key))
+        single = issue(engine, [f"single-{i}" for i in range(args.count)], key)
+        batch = issue(engine, [f"batch-{i}" for i in range(args.count)], key)
+
+        start = time.perf_counter()
+        for name, cert in single.items():
+            engine.revoke({name: cert})
+        one_by_one = time.perf_counter() - start
+        print(f"one-by-one {args.count:5d} revocations in {one_by_one:8.3f}s  "
+              f"{args.count / one_by_one:9.1f} revocations/sec")
+
+        start = time.perf_counter()
+        engine.revoke(batch)
+        batched = time.perf_counter() - start
+        print(f"batched    {args.count:5d} revocations in {batched:8.3f}s  "
+              f"{args.count / batched:9.1f} revocations/sec")
+        print(f"speedup    {one_by_one / batched:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
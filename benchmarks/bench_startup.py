@@ -0,0 +1,80 @@
+"""Measure the cold start of the web app and the Celery worker code.
+
+Usage:
+    python benchmarks/bench_startup.py -n 10
+    python benchmarks/bench_startup.py --module tasks --importtime 15
+
+Each run is a fresh interpreter that imports --module and, for the web app,
+serves one /health request through the Flask test client, which is what a
+gunicorn worker does after a boot or a max_requests recycle. Nothing should
+need Redis, the OpenVPN management interface or the PKI at import time, so
+the numbers hold with those services down (/health then reports them
+unhealthy, it is timed anyway). --importtime prints the modules with the
+largest cumulative import time, from `python -X importtime`.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+first_request = None
+if {serve}:
+    client = {module}.app.test_client()
+    client.get('/health')
+    first_request = time.perf_counter() - imported
+print(json.dumps({{'import': imported - start, 'first_request': first_request, 'modules': len(sys.modules)}}))
+"""
+
+
+def run_once(module):
+    code = PROBE.format(module=module, serve=module == 'app')
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def import_profile(module, top):
+    """Return the `top` (cumulative microseconds, module) pairs of `python -X importtime`."""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--runs', type=int, default=5)
+    parser.add_argument('--module', default='app', help="module to import: app (web) or tasks (worker)")
+    parser.add_argument('--importtime', type=int, default=0, metavar='TOP',
+                        help="also print the TOP modules by cumulative import time")
+    args = parser.parse_args()
+
+    runs = [run_once(args.module) for _ in range(args.runs)]
+    imports = [r['import'] * 1000 for r in runs]
+    print(f"import {args.module}: median {statistics.median(imports):.0f} ms, "
+          f"min {min(imports):.0f} ms, max {max(imports):.0f} ms, {runs[-1]['modules']} modules loaded")
+    if args.module == 'app':
+        first = [r['first_request'] * 1000 for r in runs]
+        print(f"first /health: median {statistics.median(first):.0f} ms, max {max(first):.0f} ms")
+
+    if args.importtime:
+        print(f"\n{'cumulative ms':>14}  module")
+        for cumulative, name in import_profile(args.module, args.importtime):
+            print(f"{cumulative / 1000:14.1f}  {name}")
+
+
+if __name__ == '__main__':
+    main()
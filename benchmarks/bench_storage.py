@@ -0,0 +1,88 @@
+"""Compare flat and sharded VPN_CLIENT_DIR layouts at a large client count.
+
+Usage:
+    python benchmarks/bench_storage.py -n 100000 --dir /var/tmp
+
+For each shard depth, fills a fresh directory under --dir with -n clients
+(.ovpn only, untimed), then times: --samples atomic writes of new clients
+(ClientStorage.write: temp file, fsync, rename), the old direct open/write
+for reference, lookups of existing and missing clients, and one full listing
+as done by the registry rebuild. Use a --dir on the filesystem
+VPN_CLIENT_DIR lives on; tmpfs hides most of the fsync and lookup cost.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import ClientStorage  # noqa: E402
+
+CONFIG = "client\n" + "x" * 4000 + "\n"
+
+
+def timed(func, count):
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def bench_layout(root, depth, count, samples):
+    storage = ClientStorage(root, shard_depth=depth, flat_fallback=False)
+    for i in range(count):
+        path = storage.path(f"client-{i}", '.ovpn')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(CONFIG)
+
+    def atomic_writes():
+        for i in range(samples):
+            storage.write(f"new-{i}", '.ovpn', CONFIG)
+
+    def direct_writes():
+        for i in range(samples):
+            path = storage.path(f"direct-{i}", '.ovpn')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(CONFIG)
+
+    existing = [f"client-{random.randrange(count)}" for _ in range(samples)]
+    missing = [f"missing-{i}" for i in range(samples)]
+
+    results = {
+        'atomic write': timed(atomic_writes, samples),
+        'direct write': timed(direct_writes, samples),
+        'lookup hit': timed(lambda: [storage.locate(p, '.ovpn') for p in existing], samples),
+        'lookup miss': timed(lambda: [storage.locate(p, '.ovpn') for p in missing], samples),
+    }
+    start = time.perf_counter()
+    listed = sum(1 for _ in storage.iter_clients('.ovpn'))
+    results['full listing'] = (time.perf_counter() - start) * 1e6
+    return results, listed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, default=100000, help="clients per layout")
+    parser.add_argument('--samples', type=int, default=1000, help="timed operations per measurement")
+    parser.add_argument('--depths', type=int, nargs='+', default=[0, 1, 2], help="shard depths, 0 = flat")
+    parser.add_argument('--dir', default=None, help="parent directory for the test layouts")
+    args = parser.parse_args()
+
+    for depth in args.depths:
+        root = tempfile.mkdtemp(prefix=f"bench-storage-{depth}-", dir=args.dir)
+        try:
+            results, listed = bench_layout(root, depth, args.count, args.samples)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        label = 'flat' if depth == 0 else f"depth {depth}"
+        line = '  '.join(f"{name} {value:8.1f}us" for name, value in results.items() if name != 'full listing')
+        print(f"{label:8s} {line}  full listing {results['full listing'] / 1e6:6.2f}s ({listed} files)")
+
+
+if __name__ == '__main__':
+    main()
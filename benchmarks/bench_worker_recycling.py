@@ -0,0 +1,67 @@
+"""Measure Celery tasks/sec with and without per-task worker recycling.
+
+Usage:
+    python benchmarks/bench_worker_recycling.py -n 50 --concurrency 2
+
+For each setting of CELERY_WORKER_MAX_TASKS_PER_CHILD (1 and 0 by default)
+a worker is started against the configured broker, the `generate_certificate`
+task is submitted `-n` times with fresh provision identities and the time
+until every result is back is reported. Needs Redis and a PKI the worker can
+issue from; the clients it creates have to be cleaned up afterwards.
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from celery_config import celery
+
+
+def wait_for_worker(timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if celery.control.ping(timeout=1):
+            return
+    raise SystemExit("Celery worker did not come up")
+
+
+def run(max_tasks_per_child, count, concurrency):
+    env = {**os.environ, 'CELERY_WORKER_MAX_TASKS_PER_CHILD': str(max_tasks_per_child)}
+    worker = subprocess.Popen(
+        ["celery", "-A", "celery_config", "worker", "--loglevel=warning",
+         f"--concurrency={concurrency}", f"--hostname=bench-{uuid.uuid4().hex[:8]}@%h"],
+        cwd=ROOT, env=env)
+    try:
+        wait_for_worker()
+        run_id = uuid.uuid4().hex[:8]
+        start = time.perf_counter()
+        results = [celery.send_task('generate_certificate', args=[f"bench-{run_id}-{i}"]) for i in range(count)]
+        failures = sum(1 for result in results if result.get(timeout=600)['status'] != 'success')
+        elapsed = time.perf_counter() - start
+    finally:
+        worker.terminate()
+        worker.wait()
+
+    print(f"max_tasks_per_child={max_tasks_per_child:<3d} {count:5d} tasks in {elapsed:8.2f}s  "
+          f"{count / elapsed:7.2f} tasks/sec  {failures} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=2)
+    parser.add_argument('--settings', type=int, nargs='+', default=[1, 0],
+                        help="values of CELERY_WORKER_MAX_TASKS_PER_CHILD to compare")
+    args = parser.parse_args()
+
+    for max_tasks_per_child in args.settings:
+        run(max_tasks_per_child, args.count, args.concurrency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""Stand-in for the easyrsa script, for benchmarks and local testing.
+
+Usage:
+    ./easyrsa build-client-full <name> nopass    (via a wrapper that runs this file)
+
+Only build-client-full is supported. It sleeps EASYRSA_FAKE_LATENCY seconds
+(the cost of easy-rsa's openssl runs on the emulated host, default 0), then
+issues a real certificate with PKIEngine into EASYRSA_PKI (./pki by default),
+so the files, index.txt and serials look the same to the rest of the code.
+Variables are read with an EASYRSA_ prefix because the worker only passes
+those through to easy-rsa. EASYRSA_ALGO selects rsa or ec keys as usual.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main(argv):
+    if len(argv) < 2 or argv[0] != 'build-client-full':
+        print(f"fake easyrsa: unsupported command: {' '.join(argv)}", file=sys.stderr)
+        return 1
+    time.sleep(float(os.environ.get('EASYRSA_FAKE_LATENCY', 0)))
+
+    from pki import PKIEngine
+    pki_dir = os.environ.get('EASYRSA_PKI') or os.path.join(os.getcwd(), "pki")
+    try:
+        PKIEngine(pki_dir).build_client_full(argv[1])
+    except FileExistsError as e:
+        print(f"Easy-RSA error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
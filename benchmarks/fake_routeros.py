@@ -0,0 +1,93 @@
+"""Minimal RouterOS API server for benchmarks and local testing.
+
+Usage:
+    python benchmarks/fake_routeros.py --port 8728 --latency 0.02
+
+Accepts any /login, answers every other command with one !re row echoing
+the command and a !done, after --latency seconds per sentence batch (an
+emulated round trip). Tags are echoed, so pipelined commands work.
+"""
+import os
+import sys
+import time
+import argparse
+import socketserver
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routeros import encode_sentence  # noqa: E402
+
+
+class RouterOSHandler(socketserver.BaseRequestHandler):
+    latency = 0.0
+
+    def _read_sentences(self, buffer):
+        """Split complete sentences off the front of the buffer."""
+        sentences = []
+        while True:
+            words, offset = [], 0
+            while True:
+                if offset >= len(buffer):
+                    return sentences, buffer
+                first = buffer[offset]
+                if first < 0x80:
+                    length, size = first, 1
+                elif first < 0xC0:
+                    length, size = int.from_bytes(buffer[offset:offset + 2], 'big') & 0x3FFF, 2
+                elif first < 0xE0:
+                    length, size = int.from_bytes(buffer[offset:offset + 3], 'big') & 0x1FFFFF, 3
+                elif first < 0xF0:
+                    length, size = int.from_bytes(buffer[offset:offset + 4], 'big') & 0xFFFFFFF, 4
+                else:
+                    length, size = int.from_bytes(buffer[offset + 1:offset + 5], 'big'), 5
+                if offset + size + length > len(buffer):
+                    return sentences, buffer
+                offset += size
+                if length == 0:
+                    break
+                words.append(buffer[offset:offset + length].decode())
+                offset += length
+            sentences.append(words)
+            buffer = buffer[offset:]
+
+    def handle(self):
+        buffer = b''
+        while True:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return
+            sentences, buffer = self._read_sentences(buffer + chunk)
+            if not sentences:
+                continue
+            if self.latency:
+                time.sleep(self.latency)
+            reply = b''
+            for words in sentences:
+                tag = [word for word in words if word.startswith('.tag=')]
+                if words[0] != '/login':
+                    reply += encode_sentence(['!re', f'=command={words[0]}'] + tag)
+                reply += encode_sentence(['!done'] + tag)
+            self.request.sendall(reply)
+
+
+class FakeRouterOS(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, latency=0.0):
+        handler = type('Handler', (RouterOSHandler,), {'latency': latency})
+        super().__init__(address, handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8728)
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds per round trip")
+    args = parser.parse_args()
+    with FakeRouterOS((args.host, args.port), args.latency) as server:
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
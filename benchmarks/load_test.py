@@ -0,0 +1,96 @@
+"""Find the API's concurrency ceiling by stepping up concurrent clients.
+
+Usage:
+    GUNICORN_WORKER_CLASS=sync   gunicorn -c gunicorn_config.py app:app
+    python benchmarks/load_test.py --url http://localhost:5000 --levels 1 2 4 8 16 32 64
+
+    GUNICORN_WORKER_CLASS=gevent gunicorn -c gunicorn_config.py app:app
+    python benchmarks/load_test.py --url http://localhost:5000 --levels 1 2 4 8 16 32 64
+
+Each client loops on GET --path (by default a task status lookup, which hits
+the Redis result backend) for --duration seconds. --slow-clients opens that
+many extra connections that send their request headers byte by byte,
+tying up one sync worker each for as long as they stay open. Compare the
+req/s and p95 columns between worker classes: throughput flattening and
+latency climbing with concurrency is the ceiling.
+"""
+import time
+import socket
+import argparse
+import threading
+import statistics
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def client(url, deadline):
+    latencies = []
+    errors = 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=30) as resp:
+                resp.read()
+        except urllib.error.HTTPError as e:
+            e.read()
+        except (urllib.error.URLError, OSError):
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    return latencies, errors
+
+
+def slow_client(url, stop):
+    parsed = urllib.parse.urlparse(url)
+    request = f"GET {parsed.path} HTTP/1.1\r\nHost: {parsed.hostname}\r\n"
+    try:
+        with socket.create_connection((parsed.hostname, parsed.port or 80), timeout=5) as sock:
+            for char in request:
+                if stop.is_set():
+                    return
+                sock.sendall(char.encode())
+                time.sleep(0.5)
+            stop.wait()
+    except OSError:
+        pass
+
+
+def run_level(url, concurrency, duration):
+    deadline = time.monotonic() + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: client(url, deadline), range(concurrency)))
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+    if not latencies:
+        print(f"{concurrency:5d} clients  no successful requests, {errors} errors")
+        return
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else latencies[0]
+    print(f"{concurrency:5d} clients  {len(latencies) / duration:8.1f} req/s  "
+          f"p50 {statistics.median(latencies) * 1000:7.1f}ms  p95 {p95 * 1000:7.1f}ms  {errors} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--path', default='/mikrotik/openvpn/task/00000000-0000-0000-0000-000000000000')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument('--slow-clients', type=int, default=0)
+    args = parser.parse_args()
+
+    url = args.url.rstrip('/') + args.path
+    stop = threading.Event()
+    slow = [threading.Thread(target=slow_client, args=(url, stop), daemon=True) for _ in range(args.slow_clients)]
+    for thread in slow:
+        thread.start()
+    try:
+        for concurrency in args.levels:
+            run_level(url, concurrency, args.duration)
+    finally:
+        stop.set()
+
+
+if __name__ == '__main__':
+    main()
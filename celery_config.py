@@ -1,11 +1,23 @@
 from celery import Celery
+from celery.signals import before_task_publish
+from kombu import Queue
 from config import Config
 import os
+import time
+
+# Queues in priority order: a worker consuming several always drains the earlier ones first.
+# Interactive provisioning (a router waiting on its config), router command fan-out, then
+# bulk and background work (batches, key pool refills, revocations, reconciliation).
+PROVISIONING_QUEUE = 'provisioning'
+ROUTER_QUEUE = 'routers'
+BULK_QUEUE = 'bulk'
+QUEUES = (PROVISIONING_QUEUE, ROUTER_QUEUE, BULK_QUEUE)
 
 # Initialize Celery
 celery = Celery('vpn_tasks',
                 broker=os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0'),
-                backend=os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0'))
+                backend=os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0'),
+                include=['tasks'])
 
 # Configure Celery
 celery.conf.update(
@@ -16,6 +28,46 @@ celery.conf.update(
     enable_utc=True,
     task_track_started=True,
     task_time_limit=300,  # 5 minutes
-    worker_max_tasks_per_child=1,  # Restart worker after each task
-    broker_connection_retry_on_startup=True
-)
\ No newline at end of file
+    # Certificate tasks are safe in long-lived workers; recycling is opt-in
+    worker_max_tasks_per_child=Config.CELERY_WORKER_MAX_TASKS_PER_CHILD or None,
+    worker_max_memory_per_child=Config.CELERY_WORKER_MAX_MEMORY_PER_CHILD or None,  # KiB
+    broker_connection_retry_on_startup=True,
+    task_queues=[Queue(name) for name in QUEUES],
+    task_default_queue=BULK_QUEUE,
+    task_routes={
+        'generate_certificate': {'queue': PROVISIONING_QUEUE},
+        'dispatch_router_commands': {'queue': ROUTER_QUEUE},
+    },
+    broker_transport_options={
+        'queue_order_strategy': 'priority',
+        # Has to outlast task_time_limit and the countdown of delayed tasks, or they run twice
+        'visibility_timeout': Config.CELERY_VISIBILITY_TIMEOUT,
+    },
+    # Reserve one message per process, so a burst of slow jobs can't hold back
+    # tasks that another process or worker could start right away
+    worker_prefetch_multiplier=Config.CELERY_PREFETCH_MULTIPLIER,
+    task_acks_late=Config.CELERY_ACKS_LATE,
+    # Sizes the pool from queue depth when the worker runs with --autoscale=max,min
+    worker_autoscaler='autoscale:QueueDepthAutoscaler',
+    beat_schedule={
+        'refill-key-pool': {
+            'task': 'refill_key_pool',
+            'schedule': Config.KEY_POOL_REFILL_INTERVAL,
+        },
+        'apply-revocations': {
+            'task': 'apply_revocations',
+            'schedule': Config.REVOCATION_INTERVAL,
+        },
+        'renew-certificates': {
+            'task': 'renew_certificates',
+            'schedule': Config.CERT_RENEWAL_INTERVAL,
+        },
+    }
+)
+
+
+@before_task_publish.connect
+def stamp_published_at(headers=None, **kwargs):
+    """Record when a task was queued so the worker can measure queue wait."""
+    if headers is not None:
+        headers['published_at'] = time.time()
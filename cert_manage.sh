@@ -46,8 +46,8 @@ revoke_cert() {
     local client_name=$1
     if check_client "$client_name"; then
         echo -e "${YELLOW}Revoking certificate for $client_name...${NC}"
-        # Add certificate to CRL
-        docker-compose exec web python -c "from app import create_app; from app.tasks import revoke_certificate; app = create_app(); with app.app_context(): revoke_certificate.delay('$client_name')"
+        # Queue the revocation, the worker adds it to the CRL with the next batch
+        docker-compose exec web python -c "import revocation; from tasks import apply_revocations; revocation.queue_revocations(['$client_name']); apply_revocations.delay()"
         echo -e "${GREEN}Certificate revocation initiated${NC}"
     else
         echo -e "${RED}Client $client_name does not exist${NC}"
@@ -11,16 +11,110 @@ class Config:
     # Redis Configuration
     REDIS_HOST = config.get('REDIS_HOST', 'localhost')
     REDIS_PORT = config.get_int('REDIS_PORT', 6379)
+    REDIS_DB = config.get_int('REDIS_DB', 0)
+    REDIS_MAX_CONNECTIONS = config.get_int('REDIS_MAX_CONNECTIONS', 50)  # per process
+    REDIS_POOL_TIMEOUT = config.get_float('REDIS_POOL_TIMEOUT', 5.0)  # seconds to wait for a free connection
+    REDIS_SOCKET_TIMEOUT = config.get_float('REDIS_SOCKET_TIMEOUT', 5.0)
+    REDIS_HEALTH_CHECK_INTERVAL = config.get_int('REDIS_HEALTH_CHECK_INTERVAL', 30)
+    REDIS_MAX_RETRIES = config.get_int('REDIS_MAX_RETRIES', 3)
+    REDIS_RETRY_BACKOFF_CAP = config.get_float('REDIS_RETRY_BACKOFF_CAP', 1.0)
+    REDIS_SENTINELS = config.get('REDIS_SENTINELS')  # e.g. sentinel1:26379,sentinel2:26379
+    REDIS_SENTINEL_MASTER = config.get('REDIS_SENTINEL_MASTER', 'mymaster')
+    REDIS_CLUSTER = config.get_bool('REDIS_CLUSTER', False)  # registry keys get a {provisions} hash tag, start empty
+    REDIS_METRICS_ENABLED = config.get_bool('REDIS_METRICS_ENABLED', True)
     CELERY_BROKER_URL = config.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
     CELERY_RESULT_BACKEND = config.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+    CELERY_WORKER_MAX_TASKS_PER_CHILD = config.get_int('CELERY_WORKER_MAX_TASKS_PER_CHILD', 0)  # 0 disables recycling
+    CELERY_WORKER_MAX_MEMORY_PER_CHILD = config.get_int('CELERY_WORKER_MAX_MEMORY_PER_CHILD', 0)  # KiB, 0 disables
+    CELERY_METRICS_PORT = config.get_int('CELERY_METRICS_PORT', 5555)  # /metrics of the worker, 0 disables
+    CELERY_PREFETCH_MULTIPLIER = config.get_int('CELERY_PREFETCH_MULTIPLIER', 1)  # messages reserved per process
+    CELERY_ACKS_LATE = config.get_bool('CELERY_ACKS_LATE', True)  # ack after the task ran, redelivered if lost
+    CELERY_VISIBILITY_TIMEOUT = config.get_int('CELERY_VISIBILITY_TIMEOUT', 3600)  # seconds before redelivery
+    CELERY_AUTOSCALE_TASKS_PER_PROCESS = config.get_int('CELERY_AUTOSCALE_TASKS_PER_PROCESS', 4)  # queued backlog
+    CELERY_AUTOSCALE_INTERVAL = config.get_float('CELERY_AUTOSCALE_INTERVAL', 1.0)  # seconds between depth reads
 
     # OpenVPN Configuration
     VPN_HOST = config.get('VPN_HOST', 'localhost')
     VPN_PORT = config.get_int('VPN_PORT', 1194)
     VPN_CLIENT_DIR = config.get('VPN_CLIENT_DIR', './dev_certs')
+    VPN_CLIENT_SHARD_DEPTH = config.get_int('VPN_CLIENT_SHARD_DEPTH', 1)  # levels of 256 subdirectories, 0 = flat
+    VPN_CLIENT_FLAT_FALLBACK = config.get_bool('VPN_CLIENT_FLAT_FALLBACK', True)  # also find unmigrated flat files
+    # Extra connection profiles, e.g. {"tcp": {"proto": "tcp", "remotes": [["vpn.myisp.com", 443]]}}
+    VPN_PROFILES = config.get_json('VPN_PROFILES', {})
+    VPN_DEFAULT_PROFILE = config.get('VPN_DEFAULT_PROFILE', 'default')
+    # Server pool, e.g. {"vpn1": {"host": "vpn1.example.com", "capacity": 2000}}; unset uses the profiles' remotes
+    VPN_SERVERS = config.get_json('VPN_SERVERS', {})
+    VPN_SERVER_REMOTES = config.get_int('VPN_SERVER_REMOTES', 3)  # servers listed in a client config, in order
+    VPN_SERVER_NAME = config.get('VPN_SERVER_NAME', 'default')  # the server a session collector reports for
+    VPN_TUNNEL_NETWORK = config.get('VPN_TUNNEL_NETWORK')  # e.g. 10.8.0.0/16, enables static tunnel addresses
+    VPN_TUNNEL_STATIC_POOL = config.get('VPN_TUNNEL_STATIC_POOL')  # static addresses, upper half if unset
+    OPENVPN_CCD_DIR = config.get('OPENVPN_CCD_DIR', f"{VPN_CLIENT_DIR}/ccd")  # the server's client-config-dir
+
+    # OpenVPN Management Interface (used by the session collector)
+    OPENVPN_MANAGEMENT_HOST = config.get('OPENVPN_MANAGEMENT_HOST', 'localhost')
+    OPENVPN_MANAGEMENT_PORT = config.get_int('OPENVPN_MANAGEMENT_PORT', 7505)
+    OPENVPN_MANAGEMENT_PASSWORD = config.get('OPENVPN_MANAGEMENT_PASSWORD')
+    SESSION_POLL_INTERVAL = config.get_float('SESSION_POLL_INTERVAL', 5.0)  # seconds
+    SESSION_SOCKET_TIMEOUT = config.get_float('SESSION_SOCKET_TIMEOUT', 10.0)  # seconds
+
+    # Mikrotik Command Dispatch
+    MIKROTIK_API_PORT = config.get_int('MIKROTIK_API_PORT', 8728)
+    MIKROTIK_USERNAME = config.get('MIKROTIK_USERNAME', 'admin')
+    MIKROTIK_PASSWORD = config.get('MIKROTIK_PASSWORD', '')
+    MIKROTIK_TIMEOUT = config.get_float('MIKROTIK_TIMEOUT', 10.0)  # seconds, per router
+    MIKROTIK_POOL_SIZE = config.get_int('MIKROTIK_POOL_SIZE', 2)  # sessions per router per worker
+    MIKROTIK_POOL_IDLE_TIMEOUT = config.get_float('MIKROTIK_POOL_IDLE_TIMEOUT', 300.0)  # seconds
+    MIKROTIK_DISPATCH_CONCURRENCY = config.get_int('MIKROTIK_DISPATCH_CONCURRENCY', 32)  # routers in flight per task
+    MIKROTIK_DISPATCH_CHUNK_SIZE = config.get_int('MIKROTIK_DISPATCH_CHUNK_SIZE', 100)  # routers per task
+    MIKROTIK_DISPATCH_MAX_ROUTERS = config.get_int('MIKROTIK_DISPATCH_MAX_ROUTERS', 5000)
+
+    # PKI Configuration
+    PKI_ENGINE = config.get('PKI_ENGINE', 'native')  # 'native' or 'easyrsa'
+    EASYRSA_DIR = config.get('EASYRSA_DIR', '.')
+    EASYRSA_PKI = config.get('EASYRSA_PKI', f"{EASYRSA_DIR}/pki")
+    EASYRSA_ALGO = config.get('EASYRSA_ALGO', 'rsa')
+    EASYRSA_KEY_SIZE = config.get_int('EASYRSA_KEY_SIZE', 2048)
+    EASYRSA_CURVE = config.get('EASYRSA_CURVE', 'secp384r1')
+    EASYRSA_CERT_EXPIRE = config.get_int('EASYRSA_CERT_EXPIRE', 3650)
+    EASYRSA_CA_PASSPHRASE = config.get('EASYRSA_CA_PASSPHRASE')
+    EASYRSA_CRL_DAYS = config.get_int('EASYRSA_CRL_DAYS', 180)
+
+    # Revocation
+    OPENVPN_CRL_PATH = config.get('OPENVPN_CRL_PATH')  # copy of pki/crl.pem read by the server's crl-verify
+    REVOCATION_BATCH_SIZE = config.get_int('REVOCATION_BATCH_SIZE', 1000)  # revocations per CRL update
+    REVOCATION_BATCH_DELAY = config.get_int('REVOCATION_BATCH_DELAY', 10)  # seconds to collect revocations
+    REVOCATION_INTERVAL = config.get_int('REVOCATION_INTERVAL', 300)  # seconds between scheduled runs
+    REVOCATION_LOCK_TIMEOUT = config.get_int('REVOCATION_LOCK_TIMEOUT', 600)  # seconds
+    REVOCATION_REQUEST_MAX_SIZE = config.get_int('REVOCATION_REQUEST_MAX_SIZE', 10000)
+
+    # Certificate Renewal
+    CERT_RENEWAL_ENABLED = config.get_bool('CERT_RENEWAL_ENABLED', True)
+    CERT_RENEWAL_WINDOW = config.get_int('CERT_RENEWAL_WINDOW', 30)  # days before expiry a certificate is renewed
+    CERT_RENEWAL_BATCH_SIZE = config.get_int('CERT_RENEWAL_BATCH_SIZE', 100)  # renewals per run
+    CERT_RENEWAL_INTERVAL = config.get_int('CERT_RENEWAL_INTERVAL', 3600)  # seconds between scheduled runs
+    CERT_RENEWAL_LOCK_TIMEOUT = config.get_int('CERT_RENEWAL_LOCK_TIMEOUT', 1800)  # seconds
+    CERT_RENEWAL_RETRY_DELAY = config.get_int('CERT_RENEWAL_RETRY_DELAY', 86400)  # seconds after a failed renewal
+
+    # Key Pool Configuration
+    KEY_POOL_ENABLED = config.get_bool('KEY_POOL_ENABLED', True)
+    KEY_POOL_KEY_TYPE = config.get('KEY_POOL_KEY_TYPE', EASYRSA_ALGO)
+    KEY_POOL_SIZE = config.get_int('KEY_POOL_SIZE', 50)
+    KEY_POOL_LOW_WATERMARK = config.get_int('KEY_POOL_LOW_WATERMARK', 10)
+    KEY_POOL_REFILL_BATCH = config.get_int('KEY_POOL_REFILL_BATCH', 25)
+    KEY_POOL_REFILL_INTERVAL = config.get_int('KEY_POOL_REFILL_INTERVAL', 30)  # seconds
+    KEY_POOL_REFILL_LOCK_TIMEOUT = config.get_int('KEY_POOL_REFILL_LOCK_TIMEOUT', 120)  # seconds
+    KEY_POOL_SECRET = config.get('KEY_POOL_SECRET', SECRET_KEY)
+
+    # Config Delivery
+    OVPN_CACHE_SIZE = config.get_int('OVPN_CACHE_SIZE', 512)  # files kept in memory per worker
+    OVPN_CACHE_MAX_FILE_SIZE = config.get_int('OVPN_CACHE_MAX_FILE_SIZE', 64 * 1024)  # bytes
+    # Internal nginx location serving VPN_CLIENT_DIR, e.g. /protected/ovpn/ (unset to send from Flask)
+    OVPN_ACCEL_REDIRECT_PREFIX = config.get('OVPN_ACCEL_REDIRECT_PREFIX')
 
     # Hotspot Configuration
     HOTSPOT_TEMPLATE_DIR = config.get('HOTSPOT_TEMPLATE_DIR', './templates')
+    HOTSPOT_CACHE_SIZE = config.get_int('HOTSPOT_CACHE_SIZE', 1024)  # rendered pages kept per worker
+    HOTSPOT_CACHE_MAX_AGE = config.get_int('HOTSPOT_CACHE_MAX_AGE', 86400)  # seconds browsers may reuse a page
 
     # Logging Configuration
     LOG_LEVEL = config.get('LOG_LEVEL', 'INFO')
@@ -40,7 +134,32 @@ class Config:
     IS_DEVELOPMENT = ENV == 'development'
 
     # Security
+    # Bearer token for routes that act on routers; those routes refuse all requests while it is unset
+    API_TOKEN = config.get('API_TOKEN')
     ALLOWED_PROVISION_IDENTITY_PATTERN = r'^[a-zA-Z0-9_-]+$'
+    # Reverse proxies in front of the app (nginx = 1); their X-Forwarded-For is trusted for the client IP
+    TRUSTED_PROXIES = config.get_int('TRUSTED_PROXIES', 0)
+
+    # Rate Limiting (token buckets: rate in requests/second, burst in requests)
+    RATE_LIMIT_ENABLED = config.get_bool('RATE_LIMIT_ENABLED', True)
+    RATE_LIMIT_IP_RATE = config.get_float('RATE_LIMIT_IP_RATE', 20.0)
+    RATE_LIMIT_IP_BURST = config.get_int('RATE_LIMIT_IP_BURST', 100)
+    RATE_LIMIT_IDENTITY_RATE = config.get_float('RATE_LIMIT_IDENTITY_RATE', 0.2)
+    RATE_LIMIT_IDENTITY_BURST = config.get_int('RATE_LIMIT_IDENTITY_BURST', 10)
+
+    # Task Status Long-Polling (seconds, keep below the gunicorn timeout)
+    TASK_WAIT_DEFAULT_TIMEOUT = config.get_float('TASK_WAIT_DEFAULT_TIMEOUT', 25.0)
+    TASK_WAIT_MAX_TIMEOUT = config.get_float('TASK_WAIT_MAX_TIMEOUT', 50.0)
+
+    # Provisioning Registry (seconds)
+    REGISTRY_CLAIM_TIMEOUT = config.get_int('REGISTRY_CLAIM_TIMEOUT', 600)
+    REGISTRY_RECONCILE_LOCK_TIMEOUT = config.get_int('REGISTRY_RECONCILE_LOCK_TIMEOUT', 600)
+    REGISTRY_PAGE_SIZE_MAX = config.get_int('REGISTRY_PAGE_SIZE_MAX', 1000)
+
+    # Batch Provisioning
+    PROVISION_BATCH_MAX_SIZE = config.get_int('PROVISION_BATCH_MAX_SIZE', 1000)
+    PROVISION_BATCH_CHUNK_SIZE = config.get_int('PROVISION_BATCH_CHUNK_SIZE', 25)
+    PROVISION_BATCH_TTL = config.get_int('PROVISION_BATCH_TTL', 86400)  # seconds
 
     # API Settings
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size 
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+import json
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -44,6 +45,16 @@ class ConfigManager:
         except (ValueError, TypeError):
             return default
 
+    def get_json(self, key, default=None):
+        """Get a JSON-encoded configuration value."""
+        value = self.get(key)
+        if value is None:
+            return default
+        try:
+            return json.loads(value)
+        except ValueError:
+            return default
+
     @property
     def is_development(self):
         """Check if running in development environment."""
@@ -0,0 +1,52 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import Config
+from routeros import router_pool
+from sessions import get_session
+
+logger = logging.getLogger(__name__)
+
+JOB_PREFIX = 'router_job'
+
+
+def resolve_router_address(provision_identity):
+    """Return the tunnel address a router is reachable on, or None if it is offline."""
+    session = get_session(provision_identity)
+    return session['virtual_address'] if session else None
+
+
+def run_on_router(provision_identity, commands, timeout=None):
+    """Run a pipelined batch of commands on one router.
+
+    Returns:
+        dict: The per-router result recorded in the job
+    """
+    address = resolve_router_address(provision_identity)
+    if not address:
+        return {'status': 'error', 'message': 'Router is not connected'}
+    try:
+        replies = router_pool.run(address, commands, timeout or Config.MIKROTIK_TIMEOUT)
+        return {'status': 'success', 'address': address, 'replies': replies}
+    except Exception as e:
+        logger.error(f"Command dispatch to {provision_identity} ({address}) failed: {str(e)}")
+        return {'status': 'error', 'address': address, 'message': str(e)}
+
+
+def dispatch(provision_identities, commands, on_result, timeout=None):
+    """Fan a command batch out to several routers concurrently.
+
+    Each router gets its own session from the pool and its own timeout, so
+    one slow or unreachable router doesn't hold up the others.
+
+    Args:
+        provision_identities (list): The routers to run the commands on
+        commands (list): Commands as lists of RouterOS API words
+        on_result (callable): Called with (provision_identity, result) as each router finishes
+        timeout (float): Per-router timeout in seconds
+    """
+    workers = max(min(len(provision_identities), Config.MIKROTIK_DISPATCH_CONCURRENCY), 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_on_router, provision_identity, commands, timeout): provision_identity
+                   for provision_identity in provision_identities}
+        for future in as_completed(futures):
+            on_result(futures[future], future.result())
@@ -172,6 +172,12 @@ server {
         proxy_set_header X-Forwarded-Proto \$scheme;
     }
 
+    # .ovpn bodies handed off by the app with X-Accel-Redirect (OVPN_ACCEL_REDIRECT_PREFIX)
+    location /protected/ovpn/ {
+        internal;
+        alias /etc/openvpn/client/;
+    }
+
     location /flower {
         proxy_pass http://localhost:5555;
         proxy_set_header Host \$host;
@@ -0,0 +1,71 @@
+import os
+import hashlib
+import threading
+import datetime
+from collections import OrderedDict, namedtuple
+
+CachedFile = namedtuple('CachedFile', ['path', 'body', 'etag', 'last_modified', 'size'])
+
+
+class FileCache:
+    """Small in-memory LRU of file contents with precomputed strong ETags.
+
+    Entries are keyed by path and validated against (mtime, size, inode) on
+    every lookup, so a single stat() replaces the exists()/open()/read()
+    sequence for files that are already cached. Files larger than
+    `max_file_size` are not kept in memory; only their ETag is.
+    """
+
+    def __init__(self, max_entries=512, max_file_size=64 * 1024):
+        self.max_entries = max_entries
+        self.max_file_size = max_file_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Return the cached file for `path`, loading it if new or changed.
+
+        Returns:
+            CachedFile: The file with body (None if too large to cache) and ETag,
+            or None if the file does not exist
+        """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(path)
+            return None
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached[0] == signature:
+                self._entries.move_to_end(path)
+                return cached[1]
+
+        entry = self._load(path, st)
+        with self._lock:
+            self._entries[path] = (signature, entry)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _load(self, path, st):
+        digest = hashlib.sha256()
+        chunks = []
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+                if st.st_size <= self.max_file_size:
+                    chunks.append(chunk)
+        body = b''.join(chunks) if st.st_size <= self.max_file_size else None
+        last_modified = datetime.datetime.fromtimestamp(int(st.st_mtime), tz=datetime.timezone.utc)
+        return CachedFile(path, body, digest.hexdigest()[:32], last_modified, st.st_size)
+
+    def invalidate(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,14 +1,17 @@
 import multiprocessing
 import os
+from metrics import mark_process_dead, reset_multiprocess_dir
 
 # Server socket
 bind = "0.0.0.0:5000"
 backlog = 2048
 
 # Worker processes
-workers = 2  # Reduced from CPU count to ensure stability
-worker_class = 'sync'
-worker_connections = 1000
+workers = int(os.getenv('GUNICORN_WORKERS', 2))  # Reduced from CPU count to ensure stability
+# 'sync' or 'gevent'. With gevent, Redis/Celery result lookups and file sends
+# yield to other requests instead of holding the worker.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))  # per worker, async classes only
 timeout = 60  # Increased timeout
 keepalive = 5
 max_requests = 1000
@@ -41,11 +44,29 @@ limit_request_fields = 100
 limit_request_field_size = 8190
 
 # Worker settings
-preload_app = False  # Changed to False to ensure proper initialization
+# Import the app once in the master so worker boots and max_requests recycles skip it. Nothing
+# connects at import time (Redis, Celery and the VPN client connect on first use), so forked
+# workers don't share sockets. Off for gevent, which has to patch before the app is imported.
+preload_app = os.getenv('GUNICORN_PRELOAD', str(worker_class == 'sync')).lower() in ('true', '1', 'yes')
 reload = False
 reload_extra_files = []
 reload_engine = 'auto'
 
 # Error handling
 graceful_timeout = 120
-forwarded_allow_ips = '*'
\ No newline at end of file
+forwarded_allow_ips = '*'
+
+
+# Prometheus multiprocess mode (PROMETHEUS_MULTIPROC_DIR)
+def on_starting(server):
+    reset_multiprocess_dir()
+
+
+def post_worker_init(worker):
+    # The app only logs to the console when imported, the server also keeps logs/app.log
+    from app import log_to_file
+    log_to_file()
+
+
+def child_exit(server, worker):
+    mark_process_dead(worker.pid)
@@ -1,61 +1,163 @@
 import os
+import threading
 from config import Config
+from storage import client_storage
 
+# Directives shared by every profile, the remote/proto lines are added per profile
+BASE_DIRECTIVES = [
+    "client",
+    "dev tun",
+    "{proto}",
+    "{remotes}",
+    "resolv-retry infinite",
+    "nobind",
+    "persist-key",
+    "persist-tun",
+    "remote-cert-tls server",
+    "auth SHA512",
+    "ignore-unknown-option block-outside-dns",
+    "verb 3"
+]
 
-def generate_ovpn_config(provision_identity):
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_profiles():
+    """Return the configured connection profiles keyed by name.
+
+    The 'default' profile is built from VPN_HOST/VPN_PORT over UDP unless
+    VPN_PROFILES overrides it. Each profile has a `proto`, a list of
+    `remotes` as [host, port] pairs (tried in order), an optional `random`
+    flag to shuffle them and optional `extra` directives.
+    """
+    profiles = {
+        'default': {'proto': 'udp', 'remotes': [[Config.VPN_HOST, Config.VPN_PORT]]}
+    }
+    profiles.update(Config.VPN_PROFILES)
+    return profiles
+
+
+def validate_profile(profile):
+    """Validate that a profile name is configured."""
+    if profile is not None and profile not in get_profiles():
+        raise ValueError(f"Unknown profile: {profile}")
+    return True
+
+
+class OvpnTemplate:
+    """Pre-rendered shared part of a client configuration for one profile.
+
+    The directives, CA and tls-crypt key are rendered once; render() only
+    splices in the client certificate and key, and the client's own remotes
+    when it is assigned to servers of the pool. The template is rebuilt when
+    ca.crt or tls-crypt.key change on disk.
+    """
+
+    def __init__(self, profile_name, profile):
+        self.profile_name = profile_name
+        self.profile = profile
+        self.ca_path = os.path.join(Config.VPN_CLIENT_DIR, "ca.crt")
+        self.tls_crypt_path = os.path.join(Config.VPN_CLIENT_DIR, "tls-crypt.key")
+        self.signature = self._signature()
+        self.head_before, self.head_after, self.tail = self._build()
+        self.head = "\n".join(self.head_before + self.remote_lines(self.profile['remotes'], self.profile.get('random'))
+                              + self.head_after)
+
+    def _signature(self):
+        """Identify the shared files' versions by mtime (None when a file is missing)."""
+        signature = []
+        for path in (self.ca_path, self.tls_crypt_path):
+            try:
+                signature.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def is_stale(self):
+        return self._signature() != self.signature
+
+    @staticmethod
+    def remote_lines(remotes, random=False):
+        lines = [f"remote {host} {port}" for host, port in remotes]
+        if random:
+            lines.append("remote-random")
+        return lines
+
+    def _build(self):
+        """Render the directives before and after the remotes, and the tail."""
+        before, after = [], []
+        config = before
+        for directive in BASE_DIRECTIVES:
+            if directive == "{proto}":
+                config.append(f"proto {self.profile.get('proto', 'udp')}")
+            elif directive == "{remotes}":
+                config = after  # the remotes go between the two parts
+            else:
+                config.append(directive)
+        config.extend(self.profile.get('extra', []))
+
+        # Add CA certificate
+        config.append("<ca>")
+        with open(self.ca_path, 'r') as f:
+            config.append(f.read().strip())
+        config.append("</ca>")
+
+        # Add TLS crypt key if exists
+        tail = ""
+        if os.path.exists(self.tls_crypt_path):
+            with open(self.tls_crypt_path, 'r') as f:
+                tail = "\n".join(["<tls-crypt>", f.read().strip(), "</tls-crypt>"])
+        return before, after, tail
+
+    def render(self, cert_pem, key_pem, remotes=None):
+        """Fill in a client's certificate and key.
+
+        Args:
+            remotes (list): [host, port] pairs in failover order, replacing the profile's
+        """
+        head = self.head
+        if remotes:
+            head = "\n".join(self.head_before + self.remote_lines(remotes) + self.head_after)
+        parts = [head, "<cert>", cert_pem.strip(), "</cert>", "<key>", key_pem.strip(), "</key>"]
+        if self.tail:
+            parts.append(self.tail)
+        return "\n".join(parts)
+
+
+def get_template(profile=None):
+    """Return the cached template for a profile, rebuilding it if stale."""
+    profile_name = profile or Config.VPN_DEFAULT_PROFILE
+    template = _templates.get(profile_name)
+    if template is None or template.is_stale():
+        profiles = get_profiles()
+        if profile_name not in profiles:
+            raise ValueError(f"Unknown profile: {profile_name}")
+        with _templates_lock:
+            template = OvpnTemplate(profile_name, profiles[profile_name])
+            _templates[profile_name] = template
+    return template
+
+
+def generate_ovpn_config(provision_identity, profile=None, cert_pem=None, key_pem=None, remotes=None):
     """Generate OpenVPN client configuration file content.
 
     Args:
         provision_identity (str): The unique identifier for the client
+        profile (str): The connection profile, defaults to Config.VPN_DEFAULT_PROFILE
+        cert_pem (str): The client certificate, read from client storage if omitted
+        key_pem (str): The client key, read from client storage if omitted
+        remotes (list): [host, port] pairs in failover order, defaults to the profile's remotes
 
     Returns:
         str: The complete OpenVPN client configuration
     """
-    # Base configuration template
-    config = [
-        "client",
-        "dev tun",
-        "proto udp",
-        f"remote {Config.VPN_HOST} {Config.VPN_PORT}",
-        "resolv-retry infinite",
-        "nobind",
-        "persist-key",
-        "persist-tun",
-        "remote-cert-tls server",
-        "auth SHA512",
-        "ignore-unknown-option block-outside-dns",
-        "verb 3"
-    ]
+    template = get_template(profile)
 
     # Read certificate files
-    cert_path = os.path.join(Config.VPN_CLIENT_DIR, f"{provision_identity}.crt")
-    key_path = os.path.join(Config.VPN_CLIENT_DIR, f"{provision_identity}.key")
-    ca_path = os.path.join(Config.VPN_CLIENT_DIR, "ca.crt")
-    tls_crypt_path = os.path.join(Config.VPN_CLIENT_DIR, "tls-crypt.key")
-
-    # Add CA certificate
-    config.append("<ca>")
-    with open(ca_path, 'r') as f:
-        config.append(f.read().strip())
-    config.append("</ca>")
-
-    # Add client certificate
-    config.append("<cert>")
-    with open(cert_path, 'r') as f:
-        config.append(f.read().strip())
-    config.append("</cert>")
-
-    # Add client key
-    config.append("<key>")
-    with open(key_path, 'r') as f:
-        config.append(f.read().strip())
-    config.append("</key>")
-
-    # Add TLS crypt key if exists
-    if os.path.exists(tls_crypt_path):
-        config.append("<tls-crypt>")
-        with open(tls_crypt_path, 'r') as f:
-            config.append(f.read().strip())
-        config.append("</tls-crypt>")
+    if cert_pem is None:
+        cert_pem = client_storage.read(provision_identity, '.crt')
+    if key_pem is None:
+        key_pem = client_storage.read(provision_identity, '.key')
 
-    return "\n".join(config)
+    return template.render(cert_pem, key_pem, remotes)
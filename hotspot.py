@@ -0,0 +1,110 @@
+import os
+import gzip
+import hashlib
+import logging
+import threading
+import datetime
+from string import Template
+from collections import OrderedDict, namedtuple
+from config import Config
+
+try:
+    import brotli
+except ImportError:  # br is skipped, gzip and identity are still served
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+HOTSPOT_FORMS = ("login.html", "rlogin.html")
+
+HotspotPage = namedtuple('HotspotPage', ['bodies', 'etag', 'last_modified'])
+
+
+class HotspotPages:
+    """Per-provision hotspot pages, rendered and compressed once.
+
+    A page is the provision's own template (HOTSPOT_TEMPLATE_DIR/<id>/<form>)
+    when there is one, otherwise the shared HOTSPOT_TEMPLATE_DIR/<form>, with
+    ${provision_identity} substituted. Mikrotik's own $(variables) are left
+    for the router. Each variant keeps identity, gzip and (when the brotli
+    package is installed) br bodies, and is rebuilt when its template file
+    changes on disk.
+    """
+
+    def __init__(self, template_dir=None, max_entries=1024):
+        self.template_dir = template_dir or Config.HOTSPOT_TEMPLATE_DIR
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _template_path(self, provision_identity, form):
+        """Return the template a provision uses and its stat, or (None, None) if there is none."""
+        for path in (os.path.join(self.template_dir, provision_identity, form),
+                     os.path.join(self.template_dir, form)):
+            try:
+                return path, os.stat(path)
+            except FileNotFoundError:
+                continue
+        return None, None
+
+    def get(self, provision_identity, form):
+        """Return the page of a provision, rendering it if new or its template changed.
+
+        Returns:
+            HotspotPage: The page bodies keyed by content coding, or None if no template exists
+        """
+        path, st = self._template_path(provision_identity, form)
+        key = (provision_identity, form)
+        if path is None:
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        signature = (path, st.st_mtime_ns, st.st_size, st.st_ino)
+
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached[0] == signature:
+                self._entries.move_to_end(key)
+                return cached[1]
+
+        page = self._render(path, st, provision_identity)
+        with self._lock:
+            self._entries[key] = (signature, page)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return page
+
+    def _render(self, path, st, provision_identity):
+        with open(path, 'r') as f:
+            template = Template(f.read())
+        body = template.safe_substitute(provision_identity=provision_identity).encode()
+
+        bodies = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            bodies['br'] = brotli.compress(body, quality=11, mode=brotli.MODE_TEXT)
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        last_modified = datetime.datetime.fromtimestamp(int(st.st_mtime), tz=datetime.timezone.utc)
+        return HotspotPage(bodies, etag, last_modified)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def negotiate_encoding(accept_encodings, available):
+    """Pick the smallest acceptable content coding, falling back to identity.
+
+    Args:
+        accept_encodings: The request's parsed Accept-Encoding header
+        available (dict): Bodies keyed by content coding
+
+    Returns:
+        str: The content coding to send
+    """
+    best = 'identity'
+    for coding in ('br', 'gzip'):
+        if coding in available and accept_encodings[coding] > 0:
+            if len(available[coding]) < len(available[best]):
+                best = coding
+    return best
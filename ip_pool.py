@@ -0,0 +1,218 @@
+"""
+Static tunnel addresses for routers, handed out from a bitmap in Redis.
+
+With VPN_TUNNEL_NETWORK set (the server's `server`/`topology subnet`
+network, e.g. 10.8.0.0/16) every client gets a fixed address from
+VPN_TUNNEL_STATIC_POOL, by default the upper half of the network; keep the
+server's dynamic `ifconfig-pool` out of it. One bit per address in
+`ip_pool:{<pool>}` marks it taken and `ip_pool:{<pool>}:addresses` maps
+identities to their bit, so allocating is one Lua call (a BITPOS over at
+most pool size / 8 bytes, 8 KB for a /16) and freeing one SETBIT, both
+atomic. Allocation is idempotent per identity.
+
+The address is written to OPENVPN_CCD_DIR/<identity> as an `ifconfig-push`
+line, which the server reads through `client-config-dir`. Run `python
+ip_pool.py rebuild` (with the workers stopped) to recreate the bitmap from
+the CCD files, e.g. after losing Redis or to adopt hand-written ones, and
+`python ip_pool.py status` to see the pool usage.
+"""
+import os
+import re
+import logging
+import argparse
+import ipaddress
+from functools import cached_property
+from config import Config
+from redis_client import redis_client
+from storage import ClientStorage
+
+logger = logging.getLogger(__name__)
+
+# Reserve the first free address for an identity, or return the one it has.
+# KEYS: bitmap, identity -> offset hash
+# ARGV: provision identity, pool size
+# Returns {offset, 1 if newly allocated}, or {-1, 0} when the pool is full
+ALLOCATE_SCRIPT = """
+local offset = redis.call('HGET', KEYS[2], ARGV[1])
+if offset then
+    return {tonumber(offset), 0}
+end
+offset = redis.call('BITPOS', KEYS[1], 0)
+if offset < 0 or offset >= tonumber(ARGV[2]) then
+    return {-1, 0}
+end
+redis.call('SETBIT', KEYS[1], offset, 1)
+redis.call('HSET', KEYS[2], ARGV[1], offset)
+return {offset, 1}
+"""
+
+# Release the address of an identity.
+# KEYS: bitmap, identity -> offset hash
+# ARGV: provision identity
+# Returns 1 if the identity had an address
+FREE_SCRIPT = """
+local offset = redis.call('HGET', KEYS[2], ARGV[1])
+if not offset then
+    return 0
+end
+redis.call('SETBIT', KEYS[1], tonumber(offset), 0)
+redis.call('HDEL', KEYS[2], ARGV[1])
+return 1
+"""
+
+IFCONFIG_PUSH = re.compile(r'^\s*ifconfig-push\s+(\S+)', re.MULTILINE)
+
+
+class IPPool:
+    """Allocates static tunnel addresses and keeps the CCD files in sync."""
+
+    def __init__(self, network=None, static_pool=None, ccd_dir=None):
+        network = network if network is not None else Config.VPN_TUNNEL_NETWORK
+        self.network = ipaddress.ip_network(network) if network else None
+        self.ccd = ClientStorage(ccd_dir or Config.OPENVPN_CCD_DIR, shard_depth=0, flat_fallback=False)
+        if self.network is None:
+            return
+        static_pool = static_pool if static_pool is not None else Config.VPN_TUNNEL_STATIC_POOL
+        pool = ipaddress.ip_network(static_pool) if static_pool else self._upper_half()
+        if not pool.subnet_of(self.network):
+            raise ValueError(f"VPN_TUNNEL_STATIC_POOL {pool} is not inside VPN_TUNNEL_NETWORK {self.network}")
+        # The network and broadcast addresses of the tunnel network can't be pushed
+        first, last = int(pool.network_address), int(pool.broadcast_address)
+        first = max(first, int(self.network.network_address) + 1)
+        last = min(last, int(self.network.broadcast_address) - 1)
+        self.pool = pool
+        self.first = first
+        self.size = last - first + 1
+        self.bitmap_key = f"ip_pool:{{{pool}}}"
+        self.addresses_key = f"ip_pool:{{{pool}}}:addresses"
+
+    def _upper_half(self):
+        if self.network.prefixlen >= self.network.max_prefixlen - 1:
+            return self.network
+        return list(self.network.subnets(prefixlen_diff=1))[1]
+
+    @property
+    def enabled(self):
+        return self.network is not None
+
+    @cached_property
+    def _allocate(self):
+        return redis_client.register_script(ALLOCATE_SCRIPT)
+
+    @cached_property
+    def _free(self):
+        return redis_client.register_script(FREE_SCRIPT)
+
+    def address(self, offset):
+        return str(ipaddress.ip_address(self.first + offset))
+
+    def offset(self, address):
+        """Return the bit of an address, or None if it is outside the static pool."""
+        offset = int(ipaddress.ip_address(address)) - self.first
+        return offset if 0 <= offset < self.size else None
+
+    def allocate(self, provision_identity):
+        """Reserve a tunnel address for an identity, or return the one it already has.
+
+        Returns:
+            tuple: (address, whether it was newly allocated)
+
+        Raises:
+            ValueError: If the static pool is exhausted
+        """
+        offset, new = self._allocate(keys=[self.bitmap_key, self.addresses_key], args=[provision_identity, self.size])
+        if offset < 0:
+            raise ValueError(f"No free tunnel address left in {self.pool}")
+        return self.address(offset), bool(new)
+
+    def get(self, provision_identity):
+        offset = redis_client.hget(self.addresses_key, provision_identity)
+        return self.address(int(offset)) if offset is not None else None
+
+    def free(self, provision_identity):
+        """Release an identity's address and remove its CCD file."""
+        self.ccd.remove(provision_identity, ('',))
+        return bool(self._free(keys=[self.bitmap_key, self.addresses_key], args=[provision_identity]))
+
+    def write_ccd(self, provision_identity, address):
+        """Write the client-config-dir entry pushing an identity's address."""
+        return self.ccd.write(provision_identity, '', f"ifconfig-push {address} {self.network.netmask}\n")
+
+    def status(self):
+        used = redis_client.hlen(self.addresses_key)
+        return {'network': str(self.network), 'pool': str(self.pool), 'size': self.size, 'used': used,
+                'free': self.size - used}
+
+    def rebuild(self, dry_run=False):
+        """Recreate the bitmap and address map from the CCD files.
+
+        Files pushing an address outside the static pool, or one already
+        claimed by another file, are reported and left out.
+
+        Returns:
+            dict: Counts of adopted addresses, conflicts and out-of-pool entries
+        """
+        bitmap = bytearray((self.size + 7) // 8)
+        addresses = {}
+        counts = {'adopted': 0, 'conflicts': 0, 'outside': 0}
+        owners = {}
+        os.makedirs(self.ccd.root, exist_ok=True)
+        with os.scandir(self.ccd.root) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                with open(entry.path, 'r') as f:
+                    match = IFCONFIG_PUSH.search(f.read())
+                if not match:
+                    continue
+                offset = self.offset(match.group(1))
+                if offset is None:
+                    logger.warning(f"{entry.name} pushes {match.group(1)}, outside {self.pool}")
+                    counts['outside'] += 1
+                    continue
+                if offset in owners:
+                    logger.warning(f"{entry.name} pushes {match.group(1)}, already used by {owners[offset]}")
+                    counts['conflicts'] += 1
+                    continue
+                owners[offset] = entry.name
+                bitmap[offset // 8] |= 0x80 >> (offset % 8)  # Redis numbers bits from the most significant
+                addresses[entry.name] = offset
+                counts['adopted'] += 1
+
+        if not dry_run:
+            pipe = redis_client.pipeline()
+            pipe.delete(self.bitmap_key, self.addresses_key)
+            pipe.set(self.bitmap_key, bytes(bitmap))
+            if addresses:
+                pipe.hset(self.addresses_key, mapping=addresses)
+            pipe.execute()
+        return counts
+
+
+# Create a global tunnel address pool instance
+ip_pool = IPPool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help="show the static pool and how much of it is used")
+    rebuild = commands.add_parser('rebuild', help="recreate the allocator state from the CCD files")
+    rebuild.add_argument('--dry-run', action='store_true', help="report what would be adopted without writing")
+    args = parser.parse_args()
+    logging.basicConfig(level=Config.LOG_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if not ip_pool.enabled:
+        parser.exit(1, "VPN_TUNNEL_NETWORK is not configured\n")
+    if args.command == 'status':
+        status = ip_pool.status()
+        print(f"{status['pool']} in {status['network']}: {status['used']} of {status['size']} addresses used, "
+              f"{status['free']} free")
+    else:
+        counts = ip_pool.rebuild(dry_run=args.dry_run)
+        print(f"{'Would adopt' if args.dry_run else 'Adopted'} {counts['adopted']} addresses from "
+              f"{ip_pool.ccd.root}, {counts['conflicts']} conflicts, {counts['outside']} outside {ip_pool.pool}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import uuid
+import base64
+import hashlib
+import logging
+from functools import cached_property
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import serialization
+from prometheus_client import Counter, Gauge
+from config import Config
+from pki import PKIEngine
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics
+KEY_POOL_DEPTH = Gauge('key_pool_depth', 'Pre-generated client keys waiting in the pool', ['key_type'],
+                       multiprocess_mode='mostrecent')
+KEY_POOL_REFILLED = Counter('key_pool_refilled_total', 'Client keys generated into the pool', ['key_type'])
+KEY_POOL_EXHAUSTED = Counter('key_pool_exhausted_total',
+                             'Provisioning requests that found the pool empty and generated inline',
+                             ['key_type'])
+
+# Drop a lock, but only if it is still held with a token.
+# KEYS: lock
+# ARGV: token
+UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class KeyPool:
+    """Pool of pre-generated client private keys kept encrypted in Redis.
+
+    Keys are generated by the `refill_key_pool` Celery task ahead of demand so
+    that provisioning only has to sign a certificate. Each entry is the PKCS8
+    PEM of a key encrypted with Fernet under a key derived from
+    Config.KEY_POOL_SECRET.
+    """
+
+    def __init__(self, key_type=None, size=None):
+        self.key_type = key_type or Config.KEY_POOL_KEY_TYPE
+        self.size = size or Config.KEY_POOL_SIZE
+        self._fernet = None
+
+    @property
+    def enabled(self):
+        """The pool only applies to the native engine, easy-rsa makes its own keys."""
+        return Config.KEY_POOL_ENABLED and Config.PKI_ENGINE == 'native'
+
+    @property
+    def redis_key(self):
+        return f"key_pool:{self.key_type}"
+
+    @cached_property
+    def _unlock(self):
+        return redis_client.register_script(UNLOCK_SCRIPT)
+
+    @property
+    def fernet(self):
+        if self._fernet is None:
+            digest = hashlib.sha256(Config.KEY_POOL_SECRET.encode()).digest()
+            self._fernet = Fernet(base64.urlsafe_b64encode(digest))
+        return self._fernet
+
+    def depth(self):
+        """Return the number of keys waiting in the pool."""
+        depth = redis_client.llen(self.redis_key)
+        KEY_POOL_DEPTH.labels(key_type=self.key_type).set(depth)
+        return depth
+
+    def pop(self):
+        """Take a ready key from the pool.
+
+        Returns:
+            The private key object, or None if the pool is empty
+        """
+        token = redis_client.lpop(self.redis_key)
+        if token is None:
+            KEY_POOL_EXHAUSTED.labels(key_type=self.key_type).inc()
+            logger.warning(f"Key pool {self.redis_key} exhausted, generating key inline")
+            return None
+        try:
+            key_pem = self.fernet.decrypt(token.encode())
+        except InvalidToken:
+            logger.error(f"Discarding undecryptable entry from {self.redis_key}")
+            return None
+        return serialization.load_pem_private_key(key_pem, password=None)
+
+    def push(self, private_key):
+        """Encrypt a private key and append it to the pool."""
+        key_pem = private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption())
+        redis_client.rpush(self.redis_key, self.fernet.encrypt(key_pem).decode())
+
+    def refill(self, limit=None):
+        """Generate keys until the pool is full or `limit` keys were made.
+
+        Only one refill runs at a time across all workers. The lock holds a
+        token, so a refill that outlived KEY_POOL_REFILL_LOCK_TIMEOUT doesn't
+        release the lock of the next one.
+
+        Returns:
+            int: The number of keys generated
+        """
+        lock_key = f"{self.redis_key}:refill_lock"
+        token = uuid.uuid4().hex
+        if not redis_client.set(lock_key, token, nx=True, ex=Config.KEY_POOL_REFILL_LOCK_TIMEOUT):
+            return 0
+        generated = 0
+        try:
+            missing = max(self.size - self.depth(), 0)
+            if limit is not None:
+                missing = min(missing, limit)
+            for _ in range(missing):
+                self.push(PKIEngine.generate_private_key(self.key_type))
+                KEY_POOL_REFILLED.labels(key_type=self.key_type).inc()
+                generated += 1
+        finally:
+            self._unlock(keys=[lock_key], args=[token])
+            self.depth()
+        return generated
+
+    def should_refill(self):
+        """Check whether the pool fell below the low watermark and no refill is queued yet."""
+        if self.depth() >= Config.KEY_POOL_LOW_WATERMARK:
+            return False
+        return bool(redis_client.set(f"{self.redis_key}:refill_queued", 1, nx=True,
+                                     ex=Config.KEY_POOL_REFILL_INTERVAL))
+
+
+# Create a global key pool instance
+key_pool = KeyPool()
@@ -0,0 +1,77 @@
+"""
+Shared Prometheus metrics and multiprocess export.
+
+Gunicorn workers and Celery pool children are separate processes, so the
+default in-process registry would only report whichever process answered the
+scrape. With PROMETHEUS_MULTIPROC_DIR set in the process environment (it has
+to be set before prometheus_client is imported, a .env file is read too late)
+every process writes its samples to files in that directory and the exporter
+aggregates them. Use one directory per service; it is emptied when the
+service starts.
+"""
+import os
+import time
+import shutil
+import logging
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, Gauge, Histogram, REGISTRY, multiprocess, start_http_server
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Stages of provisioning one client, in pipeline order:
+# queue_wait, key_generation, signing, render, write
+PROVISION_STAGE_LATENCY = Histogram('provision_stage_latency_seconds', 'Time spent in each provisioning stage',
+                                    ['stage'],
+                                    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120))
+
+# Time from publish to start of every task, by the queue it was routed to
+TASK_QUEUE_WAIT = Histogram('celery_task_queue_wait_seconds', 'Time tasks spent queued before a worker started them',
+                            ['queue'],
+                            buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+CELERY_QUEUE_DEPTH = Gauge('celery_queue_depth', 'Messages waiting in a Celery queue', ['queue'],
+                           multiprocess_mode='mostrecent')
+
+
+@contextmanager
+def time_stage(stage):
+    """Record the duration of a provisioning stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PROVISION_STAGE_LATENCY.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+def multiprocess_enabled():
+    return bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+
+def get_registry():
+    """Return the registry to export: all processes' samples in multiprocess mode, this process's otherwise."""
+    if not multiprocess_enabled():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def reset_multiprocess_dir():
+    """Remove samples left by a previous run of the service, before any worker starts."""
+    if not multiprocess_enabled():
+        return
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def mark_process_dead(pid):
+    """Drop the live gauges of an exited worker process."""
+    if multiprocess_enabled():
+        multiprocess.mark_process_dead(pid)
+
+
+def start_metrics_server(port):
+    """Serve /metrics for processes without a web server (the Celery worker)."""
+    start_http_server(port, registry=get_registry())
+    logger.info(f"Serving Prometheus metrics on port {port}")
@@ -0,0 +1,436 @@
+import os
+import fcntl
+import subprocess
+import logging
+import datetime
+import threading
+from cryptography import x509
+from cryptography.x509.oid import NameOID, ExtendedKeyUsageOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, ec
+from config import Config
+from metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+
+class PKIEngine:
+    """In-process replacement for `easyrsa build-client-full <name> nopass`.
+
+    The CA certificate and key are loaded once per process and reused for
+    every client. Issued material is written using the easy-rsa layout
+    (pki/issued, pki/private, pki/index.txt) so the easy-rsa CLI keeps working
+    against the same PKI.
+    """
+
+    def __init__(self, pki_dir=None):
+        self.pki_dir = pki_dir or Config.EASYRSA_PKI
+        self._ca_cert = None
+        self._ca_key = None
+        self._ca_mtime = None
+        self._lock = threading.Lock()
+
+    def _load_ca(self):
+        """Load the CA certificate and private key from the PKI directory."""
+        with self._lock:
+            if self._ca_key is not None:
+                return
+            self._ca_mtime = self._stat_ca()
+            with open(os.path.join(self.pki_dir, "ca.crt"), 'rb') as f:
+                ca_cert = x509.load_pem_x509_certificate(f.read())
+            passphrase = Config.EASYRSA_CA_PASSPHRASE
+            with open(os.path.join(self.pki_dir, "private", "ca.key"), 'rb') as f:
+                ca_key = serialization.load_pem_private_key(
+                    f.read(), password=passphrase.encode() if passphrase else None)
+            self._ca_cert = ca_cert
+            self._ca_key = ca_key
+            logger.info(f"Loaded CA from {self.pki_dir}")
+
+    def _stat_ca(self):
+        return (os.stat(os.path.join(self.pki_dir, "ca.crt")).st_mtime_ns,
+                os.stat(os.path.join(self.pki_dir, "private", "ca.key")).st_mtime_ns)
+
+    def reload(self):
+        """Drop the cached CA so it is read again on the next issuance."""
+        with self._lock:
+            self._ca_cert = None
+            self._ca_key = None
+            self._ca_mtime = None
+
+    def _ensure_ca(self):
+        """Load the CA, reloading it if the files changed since they were cached.
+
+        Workers are long-lived, so a CA renewed on disk must not be shadowed
+        by the copy loaded when the worker started.
+        """
+        if self._ca_key is not None and self._stat_ca() != self._ca_mtime:
+            logger.info(f"CA in {self.pki_dir} changed on disk, reloading")
+            self.reload()
+        if self._ca_key is None:
+            self._load_ca()
+
+    @property
+    def ca_cert(self):
+        self._ensure_ca()
+        return self._ca_cert
+
+    @property
+    def ca_key(self):
+        self._ensure_ca()
+        return self._ca_key
+
+    @staticmethod
+    def generate_private_key(key_type=None):
+        """Generate a client private key of the configured type.
+
+        Args:
+            key_type (str): 'rsa' or 'ec', defaults to Config.EASYRSA_ALGO
+
+        Returns:
+            The generated private key object
+        """
+        key_type = key_type or Config.EASYRSA_ALGO
+        if key_type == 'ec':
+            curve = getattr(ec, Config.EASYRSA_CURVE.upper())
+            return ec.generate_private_key(curve())
+        if key_type == 'rsa':
+            return rsa.generate_private_key(public_exponent=65537, key_size=Config.EASYRSA_KEY_SIZE)
+        raise ValueError(f"Unsupported key type: {key_type}")
+
+    def sign(self, common_name, private_key):
+        """Sign a client certificate for the given key with the CA.
+
+        Args:
+            common_name (str): The certificate common name (the provision identity)
+            private_key: The client private key
+
+        Returns:
+            x509.Certificate: The signed client certificate
+        """
+        self._ensure_ca()
+        ca_cert = self._ca_cert
+        ca_key = self._ca_key
+        now = datetime.datetime.now(datetime.timezone.utc)
+        public_key = private_key.public_key()
+
+        builder = (
+            x509.CertificateBuilder()
+            .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)]))
+            .issuer_name(ca_cert.subject)
+            .public_key(public_key)
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=Config.EASYRSA_CERT_EXPIRE))
+            .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=False)
+            .add_extension(x509.SubjectKeyIdentifier.from_public_key(public_key), critical=False)
+            .add_extension(
+                x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_key.public_key()), critical=False)
+            .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.CLIENT_AUTH]), critical=False)
+            .add_extension(
+                x509.KeyUsage(digital_signature=True, content_commitment=False, key_encipherment=False,
+                              data_encipherment=False, key_agreement=False, key_cert_sign=False,
+                              crl_sign=False, encipher_only=False, decipher_only=False),
+                critical=False)
+        )
+        return builder.sign(private_key=ca_key, algorithm=hashes.SHA256())
+
+    def build_client_full(self, common_name, private_key=None):
+        """Issue a client certificate and record it in the easy-rsa PKI.
+
+        Args:
+            common_name (str): The certificate common name (the provision identity)
+            private_key: An existing private key to certify, generated if omitted
+
+        Returns:
+            tuple: (certificate PEM, private key PEM, certificate)
+        """
+        issued_path = os.path.join(self.pki_dir, "issued", f"{common_name}.crt")
+        key_path = os.path.join(self.pki_dir, "private", f"{common_name}.key")
+        if os.path.exists(issued_path) or os.path.exists(key_path):
+            raise FileExistsError(f"Certificate already exists for {common_name}")
+
+        if private_key is None:
+            private_key = self.generate_private_key()
+        with time_stage('signing'):
+            cert = self.sign(common_name, private_key)
+
+            cert_pem = cert.public_bytes(serialization.Encoding.PEM)
+            key_pem = private_key.private_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=serialization.NoEncryption())
+
+            _write_file(key_path, key_pem, mode=0o600)
+            _write_file(issued_path, cert_pem)
+            self._append_index(cert, common_name)
+        return cert_pem.decode(), key_pem.decode(), cert
+
+    def _move_issued(self, common_name, serial, layout):
+        """Move the certificate, key and request of a common name into an easy-rsa by-serial layout.
+
+        Returns:
+            list: (source, target) pairs of the moved files
+        """
+        moves = []
+        for source, target in (
+                (os.path.join("issued", f"{common_name}.crt"), os.path.join("certs_by_serial", f"{serial}.crt")),
+                (os.path.join("private", f"{common_name}.key"), os.path.join("private_by_serial", f"{serial}.key")),
+                (os.path.join("reqs", f"{common_name}.req"), os.path.join("reqs_by_serial", f"{serial}.req"))):
+            source = os.path.join(self.pki_dir, source)
+            target = os.path.join(self.pki_dir, layout, target)
+            if os.path.exists(source):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(source, target)
+                moves.append((source, target))
+        return moves
+
+    def set_aside(self, common_name):
+        """Move the issued certificate, key and request of a common name to the easy-rsa renewed/ layout.
+
+        The index.txt entry stays valid, so clients holding the old files keep
+        connecting until the certificate expires, and the common name can be
+        issued again.
+
+        Returns:
+            list: (source, target) pairs of the moved files, for `restore`
+        """
+        cert = load_certificate(os.path.join(self.pki_dir, "issued", f"{common_name}.crt"))
+        if cert is None:
+            return []
+        return self._move_issued(common_name, format_serial(cert.serial_number), "renewed")
+
+    def restore(self, moves):
+        """Undo `set_aside`, putting the old files back over anything a failed issue wrote."""
+        for source, target in moves:
+            os.replace(target, source)
+
+    def discard(self, common_name):
+        """Move a certificate that was never handed out to the revoked/ layout, so the name can be issued again.
+
+        The caller still has to get the serial into the CRL, see `revoke`.
+
+        Returns:
+            int: The serial number of the discarded certificate, or None if there was none
+        """
+        cert = load_certificate(os.path.join(self.pki_dir, "issued", f"{common_name}.crt"))
+        if cert is None:
+            return None
+        self._move_issued(common_name, format_serial(cert.serial_number), "revoked")
+        return cert.serial_number
+
+    def revoke(self, certs, serials=()):
+        """Revoke several certificates and publish one CRL that includes them.
+
+        index.txt is rewritten once for the whole batch and the issued files
+        are moved to the easy-rsa revoked/ layout, so the common names can be
+        issued again (the registry lets a revoked identity be claimed).
+
+        Args:
+            certs (dict): Certificates to revoke keyed by common name
+            serials (list): More serial numbers to revoke in the same CRL, e.g. of certificates
+                replaced by a renewal or discarded after a failed attempt
+
+        Returns:
+            x509.CertificateRevocationList: The new CRL
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        revoked = [cert.serial_number for cert in certs.values()] + list(serials)
+        self._mark_index_revoked({format_serial(serial) for serial in revoked}, now)
+        for common_name, cert in certs.items():
+            self._move_issued(common_name, format_serial(cert.serial_number), "revoked")
+        return self.update_crl([(serial, now) for serial in revoked])
+
+    def update_crl(self, revoked=()):
+        """Add entries to the current CRL and sign it once.
+
+        The entries of the existing crl.pem are carried over instead of
+        rebuilding the list from index.txt, and the CRL number is increased.
+        With no entries this just renews the CRL before it expires.
+
+        Args:
+            revoked (list): (serial number, revocation datetime) pairs to add
+
+        Returns:
+            x509.CertificateRevocationList: The new CRL
+        """
+        self._ensure_ca()
+        ca_cert = self._ca_cert
+        ca_key = self._ca_key
+        now = datetime.datetime.now(datetime.timezone.utc)
+        current = self.load_crl()
+
+        builder = (
+            x509.CertificateRevocationListBuilder()
+            .issuer_name(ca_cert.subject)
+            .last_update(now)
+            .next_update(now + datetime.timedelta(days=Config.EASYRSA_CRL_DAYS))
+        )
+        number = 1
+        known = set()
+        if current is not None:
+            for entry in current:
+                builder = builder.add_revoked_certificate(entry)
+                known.add(entry.serial_number)
+            try:
+                number = current.extensions.get_extension_for_class(x509.CRLNumber).value.crl_number + 1
+            except x509.ExtensionNotFound:
+                pass
+        for serial, revoked_at in revoked:
+            if serial not in known:
+                known.add(serial)
+                builder = builder.add_revoked_certificate(
+                    x509.RevokedCertificateBuilder().serial_number(serial).revocation_date(revoked_at).build())
+        builder = (
+            builder
+            .add_extension(x509.CRLNumber(number), critical=False)
+            .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_key.public_key()), critical=False)
+        )
+        crl = builder.sign(private_key=ca_key, algorithm=hashes.SHA256())
+
+        crl_pem = crl.public_bytes(serialization.Encoding.PEM)
+        _replace_file(os.path.join(self.pki_dir, "crl.pem"), crl_pem)
+        if Config.OPENVPN_CRL_PATH:
+            _replace_file(Config.OPENVPN_CRL_PATH, crl_pem)
+        logger.info(f"Published CRL #{number} with {len(known)} revoked certificates")
+        return crl
+
+    def load_crl(self):
+        """Return the current CRL, or None if none was generated yet."""
+        try:
+            with open(os.path.join(self.pki_dir, "crl.pem"), 'rb') as f:
+                return x509.load_pem_x509_crl(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _mark_index_revoked(self, serials, revoked_at):
+        """Flip the index.txt entries of the given serials from V to R in one pass."""
+        index_path = os.path.join(self.pki_dir, "index.txt")
+        with open(index_path, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                lines = f.readlines()
+                for i, line in enumerate(lines):
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) == 6 and fields[0] == 'V' and fields[3] in serials:
+                        fields[0] = 'R'
+                        fields[2] = format_index_time(revoked_at)
+                        lines[i] = '\t'.join(fields) + '\n'
+                f.seek(0)
+                f.writelines(lines)
+                f.truncate()
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _append_index(self, cert, common_name):
+        """Append a valid-certificate entry to index.txt in openssl ca format."""
+        index_path = os.path.join(self.pki_dir, "index.txt")
+        line = f"V\t{format_index_time(cert.not_valid_after_utc)}\t\t{format_serial(cert.serial_number)}" \
+               f"\tunknown\t/CN={common_name}\n"
+        with open(index_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(line)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def easyrsa_build_client_full(common_name, easyrsa_dir=None):
+    """Issue a client certificate by running `./easyrsa build-client-full`.
+
+    Args:
+        common_name (str): The certificate common name (the provision identity)
+        easyrsa_dir (str): The easy-rsa directory, defaults to Config.EASYRSA_DIR
+
+    Returns:
+        tuple: (certificate PEM, private key PEM)
+    """
+    easyrsa_dir = easyrsa_dir or Config.EASYRSA_DIR
+    subprocess.run(["./easyrsa", "build-client-full", common_name, "nopass"],
+                   check=True,
+                   capture_output=True,
+                   text=True,
+                   cwd=easyrsa_dir,
+                   env=_easyrsa_env())
+
+    pki_dir = Config.EASYRSA_PKI if easyrsa_dir == Config.EASYRSA_DIR else os.path.join(easyrsa_dir, "pki")
+    with open(os.path.join(pki_dir, "issued", f"{common_name}.crt"), 'r') as f:
+        cert_pem = f.read()
+    with open(os.path.join(pki_dir, "private", f"{common_name}.key"), 'r') as f:
+        key_pem = f.read()
+    return cert_pem, key_pem
+
+
+def _easyrsa_env():
+    """Build the environment for easy-rsa from a fixed allow-list.
+
+    The worker's own environment (secrets, broker URLs, anything a previous
+    task changed) is not passed through to the subprocess.
+    """
+    env = {key: os.environ[key] for key in ('PATH', 'HOME', 'LANG', 'LC_ALL', 'TZ') if key in os.environ}
+    env.update({key: value for key, value in os.environ.items() if key.startswith('EASYRSA_')})
+    env.pop('EASYRSA_CA_PASSPHRASE', None)
+    env['EASYRSA_BATCH'] = '1'
+    return env
+
+
+def issue_client_certificate(common_name, private_key=None):
+    """Issue a client certificate with the engine selected by Config.PKI_ENGINE.
+
+    Args:
+        common_name (str): The certificate common name (the provision identity)
+        private_key: A pre-generated key to certify (native engine only)
+
+    Returns:
+        tuple: (certificate PEM, private key PEM, certificate)
+    """
+    if Config.PKI_ENGINE == 'easyrsa':
+        # easy-rsa generates the key in the same run, so it is all timed as signing
+        with time_stage('signing'):
+            cert_pem, key_pem = easyrsa_build_client_full(common_name)
+        return cert_pem, key_pem, x509.load_pem_x509_certificate(cert_pem.encode())
+    return pki_engine.build_client_full(common_name, private_key)
+
+
+def load_certificate(path):
+    """Load a PEM certificate, or return None if it is missing or unreadable."""
+    try:
+        with open(path, 'rb') as f:
+            return x509.load_pem_x509_certificate(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def format_index_time(moment):
+    """Format a datetime the way openssl writes index.txt dates."""
+    if moment.year < 2050:
+        return moment.strftime("%y%m%d%H%M%SZ")
+    return moment.strftime("%Y%m%d%H%M%SZ")
+
+
+def format_serial(serial):
+    """Format a serial number as the upper-case, even-length hex openssl uses."""
+    value = f"{serial:X}"
+    return value if len(value) % 2 == 0 else f"0{value}"
+
+
+def _replace_file(path, data, mode=0o644):
+    """Write a file atomically, readers see either the old or the new content."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _write_file(path, data, mode=0o644):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+
+
+# Create a global PKI engine instance (the CA is loaded on first use)
+pki_engine = PKIEngine()
@@ -0,0 +1,102 @@
+import math
+import logging
+from functools import cached_property
+from prometheus_client import Counter
+from redis.exceptions import RedisError
+from config import Config
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics
+RATE_LIMITED = Counter('rate_limited_requests_total', 'Requests rejected by the rate limiter', ['scope', 'bucket'])
+
+# Take one token from every bucket, or from none of them.
+# KEYS: bucket hashes
+# ARGV: rate (tokens/second) and burst for each key, in key order
+# Returns {allowed, retry after in ms, index of the first empty bucket (1-based, 0 when allowed)}
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local tokens = {}
+local retry_after = 0
+local empty = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    available = math.min(burst, available + math.max(now - ts, 0) * rate)
+    tokens[i] = available
+    if available < 1 then
+        retry_after = math.max(retry_after, (1 - available) / rate)
+        if empty == 0 then empty = i end
+    end
+end
+if empty > 0 then
+    return {0, math.ceil(retry_after * 1000), empty}
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    redis.call('HSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000))
+end
+return {1, 0, 0}
+"""
+
+
+class RateLimiter:
+    """Token buckets in Redis, shared by every web worker.
+
+    A request is checked against one bucket per source IP and, when the
+    route has one, one per provision identity. It is allowed only if every
+    bucket has a token, and then takes one from each, atomically.
+    """
+
+    @cached_property
+    def _take(self):
+        # Registered on first use, a cluster client loads its slot map when first touched
+        return redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def buckets(self, scope, remote_addr, provision_identity=None):
+        """Return the (name, key, rate, burst) of the buckets a request draws from."""
+        # The scope is the hash tag, on a cluster the script's keys have to share a slot
+        buckets = [('ip', f"ratelimit:{{{scope}}}:ip:{remote_addr}",
+                    Config.RATE_LIMIT_IP_RATE, Config.RATE_LIMIT_IP_BURST)]
+        if provision_identity:
+            buckets.append(('identity', f"ratelimit:{{{scope}}}:identity:{provision_identity}",
+                            Config.RATE_LIMIT_IDENTITY_RATE, Config.RATE_LIMIT_IDENTITY_BURST))
+        return buckets
+
+    def hit(self, scope, remote_addr, provision_identity=None):
+        """Take a token for a request.
+
+        Fails open: if Redis is unavailable the request is allowed.
+
+        Returns:
+            float: 0 if the request is allowed, otherwise seconds until it would be
+        """
+        buckets = self.buckets(scope, remote_addr, provision_identity)
+        args = []
+        for _, _, rate, burst in buckets:
+            args.extend([rate, burst])
+        try:
+            allowed, retry_after_ms, empty = self._take(keys=[key for _, key, _, _ in buckets], args=args)
+        except RedisError as e:
+            logger.error(f"Rate limiter unavailable, allowing request: {str(e)}")
+            return 0
+        if allowed:
+            return 0
+        RATE_LIMITED.labels(scope=scope, bucket=buckets[empty - 1][0]).inc()
+        return retry_after_ms / 1000
+
+
+def retry_after_header(retry_after):
+    """Format a wait in seconds as a Retry-After value (whole seconds, at least 1)."""
+    return str(max(math.ceil(retry_after), 1))
+
+
+# Create a global rate limiter instance
+rate_limiter = RateLimiter()
@@ -1,53 +1,186 @@
-import os
 import time
+import threading
 import redis
-from redis.exceptions import ConnectionError, RedisError
+from redis.backoff import ExponentialBackoff
+from redis.cluster import RedisCluster
+from redis.exceptions import ConnectionError, RedisError, TimeoutError
+from redis.retry import Retry
+from redis.sentinel import Sentinel
+from prometheus_client import Gauge, Histogram
 from config import Config
+from metrics import multiprocess_enabled
 
-class RedisClient:
-    def __init__(self, max_retries=3, retry_delay=1):
-        self.max_retries = max_retries
-        self.retry_delay = retry_delay
-        self._client = None
-        self._connect()
-
-    def _connect(self):
-        """Establish Redis connection with retry logic."""
-        for attempt in range(self.max_retries):
-            try:
-                self._client = redis.Redis(
-                    host=Config.REDIS_HOST,
-                    port=Config.REDIS_PORT,
-                    decode_responses=True,
-                    socket_timeout=5,
-                    socket_connect_timeout=5
-                )
-                # Test the connection
-                self._client.ping()
-                return
-            except (ConnectionError, RedisError) as e:
-                if attempt == self.max_retries - 1:
-                    raise Exception(f"Failed to connect to Redis after {self.max_retries} attempts: {str(e)}")
-                time.sleep(self.retry_delay)
+# Prometheus metrics
+REDIS_COMMAND_LATENCY = Histogram('redis_command_latency_seconds', 'Redis command latency', ['command'],
+                                  buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1))
+REDIS_POOL_CONNECTIONS = Gauge('redis_pool_connections', 'Redis connection pool usage', ['state'],
+                               multiprocess_mode='livesum')
+
+
+def _connection_kwargs():
+    return dict(
+        decode_responses=True,
+        socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=Config.REDIS_SOCKET_TIMEOUT,
+        health_check_interval=Config.REDIS_HEALTH_CHECK_INTERVAL,
+        retry_on_timeout=True,
+        retry=Retry(ExponentialBackoff(cap=Config.REDIS_RETRY_BACKOFF_CAP, base=0.05), Config.REDIS_MAX_RETRIES),
+        retry_on_error=[ConnectionError, TimeoutError]
+    )
+
+
+def create_connection_pool():
+    """Build the process-wide connection pool from the Redis configuration.
+
+    With REDIS_SENTINELS set the pool follows the master of
+    REDIS_SENTINEL_MASTER, otherwise it connects to REDIS_HOST:REDIS_PORT.
+    No connection is opened until the first command.
+    """
+    if Config.REDIS_SENTINELS:
+        sentinels = [(host, int(port)) for host, port in
+                     (endpoint.rsplit(':', 1) for endpoint in Config.REDIS_SENTINELS.split(','))]
+        sentinel = Sentinel(sentinels, socket_timeout=Config.REDIS_SOCKET_TIMEOUT)
+        return redis.sentinel.SentinelConnectionPool(Config.REDIS_SENTINEL_MASTER, sentinel,
+                                                     max_connections=Config.REDIS_MAX_CONNECTIONS,
+                                                     **_connection_kwargs())
+    return redis.BlockingConnectionPool(host=Config.REDIS_HOST,
+                                        port=Config.REDIS_PORT,
+                                        db=Config.REDIS_DB,
+                                        max_connections=Config.REDIS_MAX_CONNECTIONS,
+                                        timeout=Config.REDIS_POOL_TIMEOUT,
+                                        **_connection_kwargs())
+
+
+class BatchCommands:
+    """Multi-key helpers shared by the single-node and the cluster client."""
+
+    def hgetall_many(self, keys):
+        """Fetch several hashes in one round trip.
+
+        Returns:
+            list: One dict per key, in the order of `keys`
+        """
+        pipe = self.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        return pipe.execute()
+
+    def get_many(self, keys):
+        """Fetch several string keys in one round trip."""
+        return self.mget(keys) if keys else []
+
+    def set_many(self, mapping, ex=None):
+        """Set several string keys, with an optional shared expiry, in one round trip."""
+        pipe = self.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, value, ex=ex)
+        return pipe.execute()
+
+    def delete_many(self, keys):
+        """Delete several keys in one command."""
+        return self.delete(*keys) if keys else 0
+
+
+class RedisClient(BatchCommands, redis.Redis):
+    """Redis client backed by an explicit, bounded connection pool.
+
+    Commands are regular redis.Redis methods, so there is no per-call
+    delegation. Connections are opened lazily, health-checked after
+    REDIS_HEALTH_CHECK_INTERVAL idle seconds and retried with backoff.
+    """
+
+    def __init__(self, connection_pool=None):
+        super().__init__(connection_pool=connection_pool or create_connection_pool())
+        self._pool_gauges_updated = 0
+        if not multiprocess_enabled():
+            REDIS_POOL_CONNECTIONS.labels(state='max').set_function(lambda: self.pool_stats()['max'])
+            REDIS_POOL_CONNECTIONS.labels(state='created').set_function(lambda: self.pool_stats()['created'])
+            REDIS_POOL_CONNECTIONS.labels(state='in_use').set_function(lambda: self.pool_stats()['in_use'])
+
+    def execute_command(self, *args, **options):
+        if not Config.REDIS_METRICS_ENABLED:
+            return super().execute_command(*args, **options)
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            end = time.perf_counter()
+            REDIS_COMMAND_LATENCY.labels(command=str(args[0]).upper()).observe(end - start)
+            # Callback gauges can't be shared across processes, so publish pool usage at most once a second
+            if end - self._pool_gauges_updated >= 1 and multiprocess_enabled():
+                self._pool_gauges_updated = end
+                for state, value in self.pool_stats().items():
+                    REDIS_POOL_CONNECTIONS.labels(state=state).set(value)
 
     def get_client(self):
         """Get the Redis client instance."""
-        if not self._client:
-            self._connect()
-        return self._client
+        return self
 
-    def ping(self):
+    def ping(self, **kwargs):
         """Check if Redis is responsive."""
         try:
-            return self.get_client().ping()
+            return super().ping(**kwargs)
         except (ConnectionError, RedisError):
             return False
 
+    def pool_stats(self):
+        """Return the pool's connection limit and how many connections exist and are checked out."""
+        pool = self.connection_pool
+        if isinstance(pool, redis.BlockingConnectionPool):
+            # Idle connections sit in the queue; None entries are unopened slots
+            idle = sum(1 for connection in list(pool.pool.queue) if connection is not None)
+            created = len(pool._connections)
+            return {'max': pool.max_connections, 'created': created, 'in_use': created - idle}
+        return {'max': pool.max_connections,
+                'created': pool._created_connections,
+                'in_use': len(pool._in_use_connections)}
+
+
+class ClusterClient(BatchCommands, RedisCluster):
+    """Redis Cluster client with the RedisClient multi-key helpers.
+
+    Keys that a script or a transaction touches together share a hash tag
+    (`{provisions}` for the registry in cluster mode, the scope for rate
+    limit buckets, the pool for the tunnel address pool).
+    """
+
+    def get_many(self, keys):
+        # MGET only works within one slot, the non-atomic variant splits it by slot
+        return self.mget_nonatomic(keys) if keys else []
+
+
+def create_cluster_client():
+    """Build a Redis Cluster client for REDIS_CLUSTER deployments.
+
+    redis-py manages one pool per node and splits pipelines by slot.
+    pool_stats and the command latency metrics are not available on this
+    client, and constructing it contacts the cluster to load the slot map,
+    so the global instance is wrapped in LazyClient.
+    """
+    return ClusterClient(host=Config.REDIS_HOST,
+                         port=Config.REDIS_PORT,
+                         max_connections=Config.REDIS_MAX_CONNECTIONS,
+                         decode_responses=True,
+                         socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+                         socket_connect_timeout=Config.REDIS_SOCKET_TIMEOUT,
+                         health_check_interval=Config.REDIS_HEALTH_CHECK_INTERVAL)
+
+
+class LazyClient:
+    """Defers building a client until its first attribute access."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
     def __getattr__(self, name):
-        """Delegate unknown attributes to the Redis client."""
-        if not self._client:
-            self._connect()
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
         return getattr(self._client, name)
 
-# Create a global Redis client instance
-redis_client = RedisClient()
\ No newline at end of file
+
+# Create a global Redis client instance (no connection is made until first use)
+redis_client = LazyClient(create_cluster_client) if Config.REDIS_CLUSTER else RedisClient()
@@ -0,0 +1,367 @@
+import os
+import time
+import uuid
+import logging
+from functools import cached_property
+from config import Config
+from storage import client_storage
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+STATES = ('pending', 'issued', 'revoked')
+
+# Claim an identity unless it is already issued or freshly pending. A revoked identity starts
+# over with a fresh record, its certificate files were moved aside when it was revoked.
+# KEYS: record, index of all provisions, index of pending provisions, index of revoked provisions
+# ARGV: now, stale pending cutoff, profile, provision identity, claim token
+CLAIM_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], 'state')
+if state == 'revoked' then
+    redis.call('DEL', KEYS[1])
+    redis.call('ZREM', KEYS[4], ARGV[4])
+elseif state then
+    if state ~= 'pending' then return 0 end
+    local updated = tonumber(redis.call('HGET', KEYS[1], 'updated_at') or '0')
+    if updated > tonumber(ARGV[2]) then return 0 end
+end
+redis.call('HSET', KEYS[1], 'state', 'pending', 'profile', ARGV[3], 'created_at', ARGV[1], 'updated_at', ARGV[1],
+           'claim', ARGV[5])
+redis.call('ZADD', KEYS[2], ARGV[1], ARGV[4])
+redis.call('ZADD', KEYS[3], ARGV[1], ARGV[4])
+return 1
+"""
+
+# Check that a pending claim is still held with a token and refresh it.
+# KEYS: record
+# ARGV: claim token, now
+CONFIRM_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'state') ~= 'pending' or redis.call('HGET', KEYS[1], 'claim') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'updated_at', ARGV[2])
+return 1
+"""
+
+# Drop a pending claim, but only if it is still held with a token.
+# KEYS: record, index of all provisions, index of pending provisions
+# ARGV: claim token, provision identity
+RELEASE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'state') ~= 'pending' or redis.call('HGET', KEYS[1], 'claim') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[2], ARGV[2])
+redis.call('ZREM', KEYS[3], ARGV[2])
+return 1
+"""
+
+# Record a renewed certificate, but only if the identity still holds the certificate it replaced.
+# KEYS: record, expiry index
+# ARGV: replaced serial, serial, expiry, config path, now, provision identity, tunnel address
+RENEW_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'state') ~= 'issued' or (redis.call('HGET', KEYS[1], 'serial') or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'serial', ARGV[2], 'expiry', ARGV[3], 'config_path', ARGV[4], 'updated_at', ARGV[5],
+           'renewed_at', ARGV[5], 'renewed_serial', ARGV[1])
+if ARGV[7] ~= '' then
+    redis.call('HSET', KEYS[1], 'tunnel_address', ARGV[7])
+end
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[6])
+return 1
+"""
+
+
+# On a cluster every registry key carries the same hash tag, the claim script and the state
+# transactions touch a record and the indexes together
+_INDEX_BASE = "{provisions}" if Config.REDIS_CLUSTER else "provisions"
+_RECORD_PREFIX = "provision:{provisions}:" if Config.REDIS_CLUSTER else "provision:"
+
+
+def _record_key(provision_identity):
+    return f"{_RECORD_PREFIX}{provision_identity}"
+
+
+def _index_key(state=None):
+    return f"{_INDEX_BASE}:{state}" if state else _INDEX_BASE
+
+
+EXPIRY_KEY = _index_key('expiry')
+
+
+class ProvisionRegistry:
+    """Redis index of every provision identity and its certificate state.
+
+    Each identity has a hash `provision:<id>` (state, serial, expiry,
+    config_path, profile, timestamps) and is listed in the sorted sets
+    `provisions` and `provisions:<state>`, scored by creation time, for
+    pagination. Issued identities are also listed in `provisions:expiry`,
+    scored by the notAfter of their certificate, so the ones due for renewal
+    are one range query. Claims are atomic, so concurrent requests for the
+    same identity are deduplicated without touching VPN_CLIENT_DIR, and each
+    claim holds a token (the id of the task that provisions it) so only its
+    holder can confirm or release it.
+    """
+
+    @cached_property
+    def _claim(self):
+        # Registered on first use, a cluster client loads its slot map when first touched
+        return redis_client.register_script(CLAIM_SCRIPT)
+
+    @cached_property
+    def _confirm(self):
+        return redis_client.register_script(CONFIRM_SCRIPT)
+
+    @cached_property
+    def _release(self):
+        return redis_client.register_script(RELEASE_SCRIPT)
+
+    @cached_property
+    def _renew(self):
+        return redis_client.register_script(RENEW_SCRIPT)
+
+    def claim(self, provision_identity, profile=None, token=None):
+        """Atomically reserve an identity for provisioning.
+
+        A pending claim older than REGISTRY_CLAIM_TIMEOUT is treated as
+        abandoned (e.g. a killed worker) and can be claimed again, and so can
+        a revoked identity, e.g. a router put back into service.
+
+        Args:
+            token (str): Identifies the claim holder, e.g. the task id, generated if omitted
+
+        Returns:
+            str: The claim token if the caller now owns the identity, otherwise None
+        """
+        token = token or uuid.uuid4().hex
+        now = time.time()
+        claimed = self._claim(
+            keys=[_record_key(provision_identity), _index_key(), _index_key('pending'), _index_key('revoked')],
+            args=[now, now - Config.REGISTRY_CLAIM_TIMEOUT, profile or '', provision_identity, token])
+        return token if claimed else None
+
+    def claim_many(self, provision_identities, token, profile=None):
+        """Claim several identities with one token in one round trip.
+
+        Returns:
+            list: The identities that were claimed
+        """
+        now = time.time()
+        if Config.REDIS_CLUSTER:
+            # A cluster pipeline can't load the script on NOSCRIPT, make sure every primary has it
+            redis_client.script_load(CLAIM_SCRIPT)
+        pipe = redis_client.pipeline(transaction=False)
+        for provision_identity in provision_identities:
+            self._claim(keys=[_record_key(provision_identity), _index_key(), _index_key('pending'),
+                              _index_key('revoked')],
+                        args=[now, now - Config.REGISTRY_CLAIM_TIMEOUT, profile or '', provision_identity, token],
+                        client=pipe)
+        claimed = pipe.execute()
+        return [provision_identity for provision_identity, ok in zip(provision_identities, claimed) if ok]
+
+    def confirm_claim(self, provision_identity, token):
+        """Check that a token still holds an identity's claim and restart its timeout.
+
+        Returns:
+            bool: False if the claim was released, completed or taken over since
+        """
+        if not token:
+            return False
+        return bool(self._confirm(keys=[_record_key(provision_identity)], args=[token, time.time()]))
+
+    def release(self, provision_identity, token):
+        """Give up a claim after a failed provisioning attempt.
+
+        Nothing happens unless the identity is still pending under this token,
+        so a task whose stale claim was taken over can't drop the new holder's.
+
+        Returns:
+            bool: True if the claim was released
+        """
+        return bool(self._release(keys=[_record_key(provision_identity), _index_key(), _index_key('pending')],
+                                  args=[token or '', provision_identity]))
+
+    def get(self, provision_identity):
+        """Return the record of an identity, or None if it is unknown."""
+        record = redis_client.hgetall(_record_key(provision_identity))
+        return record or None
+
+    def get_state(self, provision_identity):
+        return redis_client.hget(_record_key(provision_identity), 'state')
+
+    def get_states(self, provision_identities):
+        """Return the state of several identities in one round trip (None for unknown ones)."""
+        pipe = redis_client.pipeline(transaction=False)
+        for provision_identity in provision_identities:
+            pipe.hget(_record_key(provision_identity), 'state')
+        return pipe.execute()
+
+    def _set_state(self, pipe, provision_identity, state, created_at, **fields):
+        now = time.time()
+        pipe.hset(_record_key(provision_identity), mapping={'state': state, 'updated_at': now, **fields})
+        for other in STATES:
+            if other != state:
+                pipe.zrem(_index_key(other), provision_identity)
+        pipe.zadd(_index_key(state), {provision_identity: created_at or now})
+        pipe.zadd(_index_key(), {provision_identity: created_at or now}, nx=True)
+        if state != 'issued':
+            pipe.zrem(EXPIRY_KEY, provision_identity)
+        elif fields.get('expiry'):
+            pipe.zadd(EXPIRY_KEY, {provision_identity: fields['expiry']})
+
+    def mark_issued(self, provision_identity, cert, config_path, tunnel_address=None):
+        """Record a successfully issued certificate, its config path and the client's static tunnel address."""
+        created_at = redis_client.hget(_record_key(provision_identity), 'created_at')
+        fields = {'tunnel_address': tunnel_address} if tunnel_address else {}
+        pipe = redis_client.pipeline()
+        self._set_state(pipe, provision_identity, 'issued', float(created_at) if created_at else None,
+                        serial=f"{cert.serial_number:X}",
+                        expiry=int(cert.not_valid_after_utc.timestamp()),
+                        config_path=config_path,
+                        **fields)
+        pipe.execute()
+
+    def mark_renewed(self, provision_identity, replaced_serial, cert, config_path, tunnel_address=None):
+        """Record a renewed certificate if the identity is still issued with the one it replaced.
+
+        Args:
+            replaced_serial (str): Serial of the certificate the renewal replaced, as stored in the record
+
+        Returns:
+            bool: False if the identity was revoked, forgotten or issued again meanwhile
+        """
+        return bool(self._renew(keys=[_record_key(provision_identity), EXPIRY_KEY],
+                                args=[replaced_serial or '', f"{cert.serial_number:X}",
+                                      int(cert.not_valid_after_utc.timestamp()), config_path, time.time(),
+                                      provision_identity, tunnel_address or '']))
+
+    def mark_revoked(self, provision_identity):
+        """Record that an identity's certificate was revoked."""
+        created_at = redis_client.hget(_record_key(provision_identity), 'created_at')
+        pipe = redis_client.pipeline()
+        self._set_state(pipe, provision_identity, 'revoked', float(created_at) if created_at else None,
+                        revoked_at=time.time())
+        pipe.execute()
+
+    def forget(self, provision_identity):
+        """Drop an identity's record whatever its state, e.g. when its config is gone from disk."""
+        pipe = redis_client.pipeline()
+        pipe.delete(_record_key(provision_identity))
+        pipe.zrem(_index_key(), provision_identity)
+        pipe.zrem(EXPIRY_KEY, provision_identity)
+        for state in STATES:
+            pipe.zrem(_index_key(state), provision_identity)
+        pipe.execute()
+
+    def update_config_paths(self, config_paths):
+        """Point known records at moved config files, e.g. after a storage migration."""
+        known = self.get_states(list(config_paths))
+        pipe = redis_client.pipeline(transaction=False)
+        for (provision_identity, config_path), state in zip(config_paths.items(), known):
+            if state is not None:
+                pipe.hset(_record_key(provision_identity), 'config_path', config_path)
+        pipe.execute()
+
+    def list(self, state=None, offset=0, limit=100):
+        """Page through identities in creation order.
+
+        Returns:
+            tuple: (total count, list of records with their provision_identity)
+        """
+        index = _index_key(state)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zcard(index)
+        pipe.zrange(index, offset, offset + limit - 1)
+        total, provision_identities = pipe.execute()
+        records = redis_client.hgetall_many([_record_key(p) for p in provision_identities])
+        return total, [{'provision_identity': p, **record}
+                       for p, record in zip(provision_identities, records) if record]
+
+    def expiring(self, before, offset=0, limit=100):
+        """Return issued identities whose certificate expires before a timestamp, soonest first."""
+        return redis_client.zrangebyscore(EXPIRY_KEY, '-inf', before, start=offset, num=limit)
+
+    def count_expiring(self, before):
+        return redis_client.zcount(EXPIRY_KEY, '-inf', before)
+
+    def backfill_expiry_index(self, page_size=1000):
+        """Add every issued identity to the expiry index, e.g. the ones issued before it existed.
+
+        The expiry comes from the record, or from the .crt in client storage
+        for records without one (which then get it stored too).
+
+        Returns:
+            dict: Counts of indexed identities and identities without a certificate
+        """
+        from pki import load_certificate  # worker only, keeps cryptography out of web worker startup
+
+        counts = {'indexed': 0, 'missing': 0}
+        offset = 0
+        while True:
+            provision_identities = redis_client.zrange(_index_key('issued'), offset, offset + page_size - 1)
+            if not provision_identities:
+                break
+            offset += len(provision_identities)
+            pipe = redis_client.pipeline(transaction=False)
+            for provision_identity in provision_identities:
+                pipe.hget(_record_key(provision_identity), 'expiry')
+            expiries = pipe.execute()
+
+            scores = {}
+            for provision_identity, expiry in zip(provision_identities, expiries):
+                if expiry is None:
+                    cert_path = client_storage.locate(provision_identity, '.crt')
+                    cert = load_certificate(cert_path) if cert_path else None
+                    if cert is None:
+                        logger.warning(f"No certificate found for {provision_identity}, not indexed")
+                        counts['missing'] += 1
+                        continue
+                    expiry = int(cert.not_valid_after_utc.timestamp())
+                    redis_client.hset(_record_key(provision_identity), mapping={
+                        'serial': f"{cert.serial_number:X}", 'expiry': expiry})
+                scores[provision_identity] = int(expiry)
+            if scores:
+                redis_client.zadd(EXPIRY_KEY, scores)
+            counts['indexed'] += len(scores)
+        return counts
+
+    def rebuild_from_disk(self):
+        """Reconcile the registry with the .ovpn files in client storage.
+
+        Every config on disk is recorded as issued (with serial and expiry
+        from its .crt when present); issued records whose config is gone are
+        dropped. Pending claims and revoked records are left alone.
+
+        Returns:
+            dict: Counts of added and removed records
+        """
+        from pki import load_certificate  # worker only, keeps cryptography out of web worker startup
+
+        on_disk = dict(client_storage.iter_clients('.ovpn'))
+
+        issued = set(redis_client.zrange(_index_key('issued'), 0, -1))
+        revoked = set(redis_client.zrange(_index_key('revoked'), 0, -1))
+        added = 0
+        for provision_identity, config_path in on_disk.items():
+            if provision_identity in issued or provision_identity in revoked:
+                continue
+            cert_path = client_storage.locate(provision_identity, '.crt')
+            cert = load_certificate(cert_path) if cert_path else None
+            pipe = redis_client.pipeline()
+            fields = {'config_path': config_path}
+            if cert is not None:
+                fields.update(serial=f"{cert.serial_number:X}", expiry=int(cert.not_valid_after_utc.timestamp()))
+            self._set_state(pipe, provision_identity, 'issued', os.stat(config_path).st_mtime, **fields)
+            pipe.execute()
+            added += 1
+
+        removed = 0
+        for provision_identity in issued - set(on_disk):
+            self.forget(provision_identity)
+            removed += 1
+        return {'added': added, 'removed': removed}
+
+
+# Create a global provisioning registry instance
+registry = ProvisionRegistry()
@@ -0,0 +1,232 @@
+"""
+Renewal of client certificates before they expire.
+
+The registry indexes issued identities by certificate expiry. Every
+CERT_RENEWAL_INTERVAL the `renew_certificates` task takes the identities
+expiring within CERT_RENEWAL_WINDOW days, soonest first and at most
+CERT_RENEWAL_BATCH_SIZE per run, and issues each a new certificate and
+.ovpn in client storage with the same profile, servers and tunnel address,
+so routers can pull the new config before the old one lapses. The old
+certificate is set aside in the easy-rsa renewed/ layout and stays valid
+until it expires; revoking the client revokes both. Renewals and revocations
+take the same lock, and a renewal is only recorded if the identity still
+holds the certificate it replaced. A failed renewal puts the old files back,
+queues the new certificate for the CRL and is retried after
+CERT_RENEWAL_RETRY_DELAY seconds.
+
+Run `python renewal.py backfill` once to index the identities issued before
+the index existed, `python renewal.py status` to see what is due and
+`python renewal.py run` to renew a batch right away.
+"""
+import time
+import logging
+import argparse
+from config import Config
+from helper import generate_ovpn_config
+import revocation
+from ip_pool import ip_pool
+from key_pool import key_pool
+from redis_client import redis_client
+from registry import EXPIRY_KEY, registry
+from servers import server_pool
+from storage import client_storage
+
+logger = logging.getLogger(__name__)
+
+# The PKI (and cryptography) is imported inside the functions that renew,
+# the web process never does
+
+LOCK_KEY = 'renewal:lock'
+BACKOFF_PREFIX = 'renewal:backoff'
+
+
+def _cutoff(now=None):
+    return (now or time.time()) + Config.CERT_RENEWAL_WINDOW * 86400
+
+
+def due(limit, now=None):
+    """Return up to `limit` identities due for renewal, soonest expiry first.
+
+    Identities whose last renewal failed less than CERT_RENEWAL_RETRY_DELAY
+    seconds ago are skipped, so they do not hold up the rest of the queue.
+    """
+    cutoff = _cutoff(now)
+    selected = []
+    offset = 0
+    while len(selected) < limit:
+        page = registry.expiring(cutoff, offset, limit)
+        if not page:
+            break
+        offset += len(page)
+        pipe = redis_client.pipeline(transaction=False)
+        for provision_identity in page:
+            pipe.exists(f"{BACKOFF_PREFIX}:{provision_identity}")
+        selected.extend(provision_identity for provision_identity, backing_off in zip(page, pipe.execute())
+                        if not backing_off)
+    return selected[:limit]
+
+
+def renew_client(provision_identity):
+    """Issue a new certificate and .ovpn for an issued identity.
+
+    Must run under revocation.LOCK_KEY, renewals and revocations move the same
+    files in the PKI. If anything fails, a new certificate is discarded and
+    queued for the CRL, a newly allocated tunnel address is freed, and the old
+    PKI and client files are put back.
+
+    Returns:
+        dict: The new certificate's serial and expiry, or None if the identity is no longer issued
+    """
+    from pki import PKIEngine, issue_client_certificate, pki_engine
+
+    record = registry.get(provision_identity) or {}
+    if record.get('state') != 'issued':
+        # Revoked or forgotten since it was indexed
+        redis_client.zrem(EXPIRY_KEY, provision_identity)
+        return None
+    profile = record.get('profile') or None
+    moves = []
+    previous = {}
+    new_address = False
+    issued = False
+    try:
+        servers = server_pool.assign(provision_identity)
+        tunnel_address = None
+        if ip_pool.enabled:
+            # Identities issued before VPN_TUNNEL_NETWORK was set get their address now
+            tunnel_address, new_address = ip_pool.allocate(provision_identity)
+
+        private_key = None
+        if Config.PKI_ENGINE == 'native':
+            private_key = key_pool.pop() if key_pool.enabled else None
+            if private_key is None:
+                private_key = PKIEngine.generate_private_key()
+        moves = pki_engine.set_aside(provision_identity)
+        cert_pem, key_pem, cert = issue_client_certificate(provision_identity, private_key)
+        issued = True
+        del private_key
+
+        remotes = server_pool.remotes(servers, profile) if servers else None
+        ovpn_config = generate_ovpn_config(provision_identity, profile, cert_pem, key_pem, remotes)
+        for suffix in ('.crt', '.key', '.ovpn'):
+            try:
+                previous[suffix] = client_storage.read(provision_identity, suffix)
+            except FileNotFoundError:
+                previous[suffix] = None
+        client_storage.write(provision_identity, '.crt', cert_pem)
+        client_storage.write(provision_identity, '.key', key_pem, mode=0o600)
+        del key_pem
+        client_conf_path = client_storage.write(provision_identity, '.ovpn', ovpn_config)
+        if tunnel_address:
+            ip_pool.write_ccd(provision_identity, tunnel_address)
+
+        # Record it against the serial routers are using, unless the identity changed hands meanwhile
+        if not registry.mark_renewed(provision_identity, record.get('serial'), cert, client_conf_path,
+                                     tunnel_address):
+            raise RuntimeError(f"{provision_identity} changed while it was being renewed")
+    except BaseException:
+        _roll_back(provision_identity, issued, moves, previous, new_address)
+        raise
+
+    expiry = int(cert.not_valid_after_utc.timestamp())
+    if expiry <= _cutoff():
+        logger.warning(f"Renewed certificate of {provision_identity} expires within CERT_RENEWAL_WINDOW, "
+                       f"check EASYRSA_CERT_EXPIRE")
+    return {'serial': f"{cert.serial_number:X}", 'expiry': expiry}
+
+
+def _roll_back(provision_identity, issued, moves, previous, new_address):
+    """Undo a failed renewal: discard the new certificate, restore the old PKI and client files.
+
+    A tunnel address allocated by the attempt is given back, so retries don't use up the pool.
+    """
+    from pki import pki_engine
+    try:
+        if new_address:
+            ip_pool.free(provision_identity)
+        if issued:
+            serial = pki_engine.discard(provision_identity)
+            if serial is not None:
+                revocation.queue_discarded([serial])
+        pki_engine.restore(moves)
+        for suffix, data in previous.items():
+            if data is None:
+                client_storage.remove(provision_identity, (suffix,))
+            else:
+                client_storage.write(provision_identity, suffix, data, mode=0o600 if suffix == '.key' else 0o644)
+    except Exception as e:
+        logger.error(f"Failed to roll back the renewal of {provision_identity}: {str(e)}")
+
+
+def renew_due(limit=None):
+    """Renew the certificates due, at most CERT_RENEWAL_BATCH_SIZE per call.
+
+    Args:
+        limit (int): Renew at most this many instead
+
+    Returns:
+        dict: Counts of renewed, skipped (no longer issued) and failed identities,
+        or None if another worker is renewing
+    """
+    if not redis_client.set(LOCK_KEY, 1, nx=True, ex=Config.CERT_RENEWAL_LOCK_TIMEOUT):
+        return None
+    counts = {'renewed': 0, 'skipped': 0, 'failed': 0}
+    try:
+        for provision_identity in due(limit or Config.CERT_RENEWAL_BATCH_SIZE):
+            if not redis_client.set(revocation.LOCK_KEY, 1, nx=True, ex=Config.REVOCATION_LOCK_TIMEOUT):
+                logger.info("Revocations are being applied, leaving the remaining renewals for the next run")
+                break
+            try:
+                renewed = renew_client(provision_identity)
+            except Exception as e:
+                logger.error(f"Failed to renew the certificate of {provision_identity}: {str(e)}")
+                redis_client.set(f"{BACKOFF_PREFIX}:{provision_identity}", 1, ex=Config.CERT_RENEWAL_RETRY_DELAY)
+                counts['failed'] += 1
+                continue
+            finally:
+                redis_client.delete(revocation.LOCK_KEY)
+            counts['renewed' if renewed else 'skipped'] += 1
+    finally:
+        redis_client.delete(LOCK_KEY)
+    return counts
+
+
+def status():
+    """Return how many indexed certificates are due and when the next one expires."""
+    soonest = redis_client.zrange(EXPIRY_KEY, 0, 0, withscores=True)
+    return {
+        'indexed': redis_client.zcard(EXPIRY_KEY),
+        'due': registry.count_expiring(_cutoff()),
+        'expired': registry.count_expiring(time.time()),
+        'next_expiry': int(soonest[0][1]) if soonest else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help="show how many certificates are due for renewal")
+    commands.add_parser('backfill', help="index the expiry of every issued certificate")
+    run = commands.add_parser('run', help="renew a batch of the certificates due now")
+    run.add_argument('--limit', type=int, help="renew at most this many, defaults to CERT_RENEWAL_BATCH_SIZE")
+    args = parser.parse_args()
+    logging.basicConfig(level=Config.LOG_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == 'status':
+        counts = status()
+        next_expiry = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(counts['next_expiry'])) \
+            if counts['next_expiry'] else 'none'
+        print(f"{counts['indexed']} certificates indexed, {counts['due']} due within {Config.CERT_RENEWAL_WINDOW} "
+              f"days ({counts['expired']} already expired), next expiry {next_expiry}")
+    elif args.command == 'backfill':
+        counts = registry.backfill_expiry_index()
+        print(f"Indexed {counts['indexed']} certificates, {counts['missing']} issued identities without one")
+    else:
+        counts = renew_due(limit=args.limit)
+        if counts is None:
+            parser.exit(1, "Another worker is renewing certificates\n")
+        print(f"Renewed {counts['renewed']} certificates, {counts['failed']} failed, {counts['skipped']} skipped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import os
+import time
+import logging
+from config import Config
+from ip_pool import ip_pool
+from registry import registry
+from redis_client import redis_client
+from sessions import request_disconnect
+from storage import client_storage
+
+logger = logging.getLogger(__name__)
+
+# The PKI (and cryptography) is imported inside the functions that apply revocations,
+# the web process only queues them
+
+QUEUE_KEY = 'revocation_queue'
+SCHEDULED_KEY = 'revocation_queue:scheduled'
+LOCK_KEY = 'revocation_queue:lock'
+DISCARDED_KEY = 'revocation_queue:discarded'
+
+
+def queue_revocations(provision_identities):
+    """Queue identities for revocation; they are applied together by `apply_revocations`.
+
+    Returns:
+        int: The number of identities that were not already queued
+    """
+    if not provision_identities:
+        return 0
+    now = time.time()
+    return redis_client.zadd(QUEUE_KEY, {provision_identity: now for provision_identity in provision_identities},
+                             nx=True)
+
+
+def queue_discarded(serials):
+    """Queue the serials of certificates discarded by failed attempts, the next batch adds them to the CRL."""
+    if serials:
+        redis_client.sadd(DISCARDED_KEY, *(f"{serial:X}" for serial in serials))
+
+
+def should_schedule():
+    """Check whether a batch run still has to be scheduled for the current queue."""
+    return bool(redis_client.set(SCHEDULED_KEY, 1, nx=True, ex=Config.REVOCATION_BATCH_DELAY))
+
+
+def pending_count():
+    return redis_client.zcard(QUEUE_KEY)
+
+
+def _find_certificate(provision_identity):
+    """Return the certificate of an identity, or None if it has none.
+
+    A batch interrupted after the CRL update has already moved the certificate
+    to revoked/, it is found there through the serial in the registry.
+    """
+    from pki import format_serial, load_certificate, pki_engine
+    cert = load_certificate(os.path.join(pki_engine.pki_dir, "issued", f"{provision_identity}.crt"))
+    if cert is None:
+        serial = (registry.get(provision_identity) or {}).get('serial')
+        if serial:
+            cert = load_certificate(os.path.join(pki_engine.pki_dir, "revoked", "certs_by_serial",
+                                                 f"{format_serial(int(serial, 16))}.crt"))
+    return cert
+
+
+def apply_revocations(limit=None):
+    """Revoke queued identities in batches of REVOCATION_BATCH_SIZE.
+
+    Each batch costs one index.txt rewrite and one CRL signature, however many
+    identities it holds, and also revokes the still valid certificates that
+    renewals replaced and the ones failed attempts discarded. Revoked clients
+    lose their files in client storage and their static tunnel address, and
+    are disconnected so they have to reconnect against the new CRL.
+
+    Args:
+        limit (int): Stop after this many identities, defaults to the whole queue
+
+    Returns:
+        dict: Counts of revoked identities, identities without a certificate and
+        discarded certificates, or None if another worker is applying revocations
+    """
+    from pki import pki_engine
+    if not redis_client.set(LOCK_KEY, 1, nx=True, ex=Config.REVOCATION_LOCK_TIMEOUT):
+        return None
+    counts = {'revoked': 0, 'missing': 0, 'discarded': 0}
+    try:
+        while limit is None or counts['revoked'] + counts['missing'] < limit:
+            size = Config.REVOCATION_BATCH_SIZE
+            if limit is not None:
+                size = min(size, limit - counts['revoked'] - counts['missing'])
+            batch = redis_client.zrange(QUEUE_KEY, 0, size - 1)
+            discarded = list(redis_client.smembers(DISCARDED_KEY))
+            if not batch and not discarded:
+                break
+
+            certs = {}
+            serials = [int(serial, 16) for serial in discarded]
+            for provision_identity in batch:
+                cert = _find_certificate(provision_identity)
+                if cert is None:
+                    logger.warning(f"No issued certificate to revoke for {provision_identity}")
+                    counts['missing'] += 1
+                else:
+                    certs[provision_identity] = cert
+                    renewed = _find_renewed_serial(provision_identity)
+                    if renewed is not None:
+                        serials.append(renewed)
+            if certs or serials:
+                pki_engine.revoke(certs, serials)
+
+            for provision_identity in certs:
+                registry.mark_revoked(provision_identity)
+                client_storage.remove(provision_identity)
+                if ip_pool.enabled:
+                    ip_pool.free(provision_identity)
+            request_disconnect(list(certs))
+            # Only dequeue once the CRL holds the batch, a crash before this retries it
+            if batch:
+                redis_client.zrem(QUEUE_KEY, *batch)
+            if discarded:
+                redis_client.srem(DISCARDED_KEY, *discarded)
+            counts['revoked'] += len(certs)
+            counts['discarded'] += len(discarded)
+            logger.info(f"Revoked {len(certs)} certificates and {len(discarded)} discarded ones in one CRL update")
+    finally:
+        redis_client.delete(LOCK_KEY)
+    return counts
+
+
+def _find_renewed_serial(provision_identity):
+    """Return the serial of the certificate a renewal replaced if it is still valid.
+
+    Routers may not have pulled the renewed config yet, so it has to be revoked too.
+    """
+    from pki import format_serial, load_certificate, pki_engine
+    serial = (registry.get(provision_identity) or {}).get('renewed_serial')
+    if not serial:
+        return None
+    cert = load_certificate(os.path.join(pki_engine.pki_dir, "renewed", "certs_by_serial",
+                                         f"{format_serial(int(serial, 16))}.crt"))
+    if cert is None or cert.not_valid_after_utc.timestamp() <= time.time():
+        return None
+    return cert.serial_number
+
+
+def refresh_crl_if_expiring():
+    """Re-sign the CRL when less than half of its lifetime is left, OpenVPN rejects every client on an expired CRL."""
+    from pki import pki_engine
+    crl = pki_engine.load_crl()
+    if crl is None or crl.next_update_utc is None:
+        return False
+    remaining = crl.next_update_utc.timestamp() - time.time()
+    if remaining > Config.EASYRSA_CRL_DAYS * 86400 / 2:
+        return False
+    pki_engine.update_crl()
+    return True
@@ -0,0 +1,233 @@
+import socket
+import logging
+import threading
+import time
+from collections import defaultdict
+from queue import LifoQueue, Empty
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class RouterOSError(Exception):
+    """Raised when a router answers a command with !trap or !fatal."""
+
+
+def encode_length(length):
+    """Encode a word length the way the RouterOS API expects."""
+    if length < 0x80:
+        return bytes([length])
+    if length < 0x4000:
+        return (length | 0x8000).to_bytes(2, 'big')
+    if length < 0x200000:
+        return (length | 0xC00000).to_bytes(3, 'big')
+    if length < 0x10000000:
+        return (length | 0xE0000000).to_bytes(4, 'big')
+    return b'\xf0' + length.to_bytes(4, 'big')
+
+
+def encode_sentence(words):
+    return b''.join(encode_length(len(word.encode())) + word.encode() for word in words) + b'\x00'
+
+
+def parse_reply(words):
+    """Split a reply sentence into its type, .tag and =attributes."""
+    attributes = {}
+    tag = None
+    for word in words[1:]:
+        if word.startswith('.tag='):
+            tag = word[len('.tag='):]
+        elif word.startswith('='):
+            key, _, value = word[1:].partition('=')
+            attributes[key] = value
+    return words[0], tag, attributes
+
+
+class RouterOSConnection:
+    """One RouterOS API session (plain TCP, default port 8728)."""
+
+    def __init__(self, host, port=None, username=None, password=None, timeout=None):
+        self.host = host
+        self.port = port or Config.MIKROTIK_API_PORT
+        self.username = username or Config.MIKROTIK_USERNAME
+        self.password = password if password is not None else Config.MIKROTIK_PASSWORD
+        self.timeout = timeout or Config.MIKROTIK_TIMEOUT
+        self.last_used = time.monotonic()
+        self._sock = None
+        self._buffer = b''
+        self._tag = 0
+
+    def connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        try:
+            self.pipeline([['/login', f'=name={self.username}', f'=password={self.password}']])
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def _recv_exact(self, size):
+        while len(self._buffer) < size:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError(f"Router {self.host} closed the API connection")
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _read_length(self):
+        first = self._recv_exact(1)[0]
+        if first < 0x80:
+            return first
+        if first < 0xC0:
+            return ((first & 0x3F) << 8) | self._recv_exact(1)[0]
+        if first < 0xE0:
+            return ((first & 0x1F) << 16) | int.from_bytes(self._recv_exact(2), 'big')
+        if first < 0xF0:
+            return ((first & 0x0F) << 24) | int.from_bytes(self._recv_exact(3), 'big')
+        return int.from_bytes(self._recv_exact(4), 'big')
+
+    def read_sentence(self):
+        words = []
+        while True:
+            length = self._read_length()
+            if length == 0:
+                return words
+            words.append(self._recv_exact(length).decode(errors='replace'))
+
+    def pipeline(self, commands):
+        """Send several commands at once and collect their replies.
+
+        Commands are tagged and written in one send, so a router round trip
+        is paid once per batch rather than once per command.
+
+        Args:
+            commands (list): Each command is a list of API words, e.g.
+                ['/ip/address/print', '?interface=ether1']
+
+        Returns:
+            list: One list of reply attribute dicts (!re rows) per command
+        """
+        tags = []
+        payload = b''
+        for command in commands:
+            self._tag += 1
+            tag = str(self._tag)
+            tags.append(tag)
+            payload += encode_sentence(list(command) + [f'.tag={tag}'])
+        self._sock.sendall(payload)
+
+        replies = {tag: [] for tag in tags}
+        errors = {}
+        remaining = set(tags)
+        while remaining:
+            words = self.read_sentence()
+            if not words:
+                continue
+            reply_type, tag, attributes = parse_reply(words)
+            if reply_type == '!fatal':
+                self.close()
+                raise RouterOSError(f"Router {self.host} closed the session: {' '.join(words[1:])}")
+            if tag not in replies:
+                continue
+            if reply_type == '!re':
+                replies[tag].append(attributes)
+            elif reply_type == '!trap':
+                errors[tag] = attributes.get('message', 'command failed')
+            elif reply_type in ('!done', '!empty'):
+                remaining.discard(tag)
+        self.last_used = time.monotonic()
+
+        if errors:
+            # Only the command path is reported, its arguments may hold credentials
+            failed = ', '.join(f"{commands[tags.index(tag)][0]}: {message}" for tag, message in errors.items())
+            raise RouterOSError(f"Router {self.host} rejected {failed}")
+        return [replies[tag] for tag in tags]
+
+
+class RouterPool:
+    """Bounded pool of RouterOS API sessions per router.
+
+    At most MIKROTIK_POOL_SIZE sessions are open to one router per process;
+    sessions idle longer than MIKROTIK_POOL_IDLE_TIMEOUT are closed instead
+    of reused.
+    """
+
+    def __init__(self, size=None, idle_timeout=None, port=None):
+        self.port = port
+        self.size = size or Config.MIKROTIK_POOL_SIZE
+        self.idle_timeout = idle_timeout or Config.MIKROTIK_POOL_IDLE_TIMEOUT
+        self._idle = defaultdict(LifoQueue)
+        self._slots = defaultdict(lambda: threading.BoundedSemaphore(self.size))
+        self._lock = threading.Lock()
+
+    def _slot(self, host):
+        with self._lock:
+            return self._slots[host]
+
+    def _queue(self, host):
+        with self._lock:
+            return self._idle[host]
+
+    def acquire(self, host, timeout=None):
+        """Check out a connected session to a router, opening one if none is idle."""
+        timeout = timeout or Config.MIKROTIK_TIMEOUT
+        if not self._slot(host).acquire(timeout=timeout):
+            raise TimeoutError(f"No free API session to {host} within {timeout}s")
+        try:
+            while True:
+                try:
+                    connection = self._queue(host).get_nowait()
+                except Empty:
+                    return RouterOSConnection(host, self.port, timeout=timeout).connect()
+                if connection.connected and time.monotonic() - connection.last_used < self.idle_timeout:
+                    return connection
+                connection.close()
+        except BaseException:
+            self._slot(host).release()
+            raise
+
+    def release(self, connection, broken=False):
+        """Return a session to the pool, or close it if it failed mid-command."""
+        if broken or not connection.connected:
+            connection.close()
+        else:
+            self._queue(connection.host).put(connection)
+        self._slot(connection.host).release()
+
+    def run(self, host, commands, timeout=None):
+        """Run a pipelined batch of commands on one router with a pooled session."""
+        connection = self.acquire(host, timeout)
+        broken = True
+        try:
+            result = connection.pipeline(commands)
+            broken = False
+            return result
+        except RouterOSError:
+            broken = not connection.connected
+            raise
+        finally:
+            self.release(connection, broken)
+
+    def close_all(self):
+        for queue in self._idle.values():
+            while True:
+                try:
+                    queue.get_nowait().close()
+                except Empty:
+                    break
+
+
+# Create a global router session pool (one per worker process)
+router_pool = RouterPool()
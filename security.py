@@ -1,8 +1,10 @@
 import re
+import hmac
 import hashlib
-from functools import wraps
+from functools import lru_cache, wraps
 from flask import request, jsonify
 from config import Config
+from rate_limit import rate_limiter, retry_after_header
 
 
 def validate_provision_identity(provision_identity):
@@ -12,6 +14,22 @@ def validate_provision_identity(provision_identity):
     return True
 
 
+def validate_provision_identities(provision_identities):
+    """Validate a list of provision identities in a single pass.
+
+    Returns:
+        list: The identities that failed validation
+    """
+    invalid = []
+    for provision_identity in provision_identities:
+        try:
+            validate_provision_identity(provision_identity)
+        except (ValueError, TypeError):
+            invalid.append(provision_identity)
+    return invalid
+
+
+@lru_cache(maxsize=4096)
 def generate_secret(provision_identity):
     """Generate a secret for a provision identity."""
     # In production, use a more secure method to generate secrets
@@ -21,7 +39,7 @@ def generate_secret(provision_identity):
 def verify_secret(provision_identity, secret):
     """Verify if the provided secret is valid for the provision identity."""
     expected_secret = generate_secret(provision_identity)
-    return secret == expected_secret
+    return hmac.compare_digest(secret.encode(), expected_secret.encode())
 
 
 def require_secret(f):
@@ -41,3 +59,63 @@ def require_secret(f):
         return f(*args, **kwargs)
 
     return decorated_function
+
+
+def has_api_token():
+    """Check whether the request carries the API bearer token (Config.API_TOKEN)."""
+    header = request.headers.get('Authorization', '')
+    token = header[len('Bearer '):] if header.startswith('Bearer ') else ''
+    return bool(Config.API_TOKEN) and hmac.compare_digest(token, Config.API_TOKEN)
+
+
+def require_api_token(f):
+    """Decorator to require the API bearer token (Config.API_TOKEN)."""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not has_api_token():
+            return jsonify({"error": "Unauthorized"}), 401
+
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def rate_limit(scope):
+    """Decorator to rate limit a route per source IP and provision identity.
+
+    Apply it above require_secret so floods are rejected before any other work.
+    Requests from one IP share a bucket per scope. Requests for one provision
+    identity share another, but only those that prove it with the identity's
+    secret or the API token; anyone can name an identity, so unproven requests
+    drawing from its bucket would let them keep the router from provisioning.
+
+    Args:
+        scope (str): Name of the route's buckets, routes with different scopes are limited separately
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if Config.RATE_LIMIT_ENABLED:
+                provision_identity = kwargs.get('provision_identity')
+                # Malformed identities, and requests with neither the identity's secret nor the API token,
+                # only draw from the IP bucket, so nobody can use up another router's identity bucket
+                if provision_identity and not re.match(Config.ALLOWED_PROVISION_IDENTITY_PATTERN,
+                                                       provision_identity):
+                    provision_identity = None
+                if provision_identity and not (verify_secret(provision_identity, kwargs.get('secret') or '')
+                                               or has_api_token()):
+                    provision_identity = None
+                retry_after = rate_limiter.hit(scope, request.remote_addr, provision_identity)
+                if retry_after:
+                    response = jsonify({"error": "Too many requests", "retry_after": retry_after})
+                    response.status_code = 429
+                    response.headers['Retry-After'] = retry_after_header(retry_after)
+                    return response
+
+            return f(*args, **kwargs)
+
+        return decorated_function
+
+    return decorator
@@ -0,0 +1,234 @@
+"""
+Pool of OpenVPN servers that clients are spread over.
+
+Servers are configured in VPN_SERVERS, e.g.
+    {"vpn1": {"host": "vpn1.example.com", "capacity": 2000},
+     "vpn2": {"host": "vpn2.example.com", "capacity": 1000, "enabled": false}}
+and each runs its own session collector (`VPN_SERVER_NAME=vpn1 python
+sessions.py`), which publishes the server's live session count. A new client
+is ranked against the enabled servers by rendezvous hashing weighted by free
+capacity (capacity minus live sessions), and its config lists the top
+VPN_SERVER_REMOTES as ordered `remote` lines: the pool's hosts with the
+profile's proto and ports, tried in order for failover. The ranking is
+stored, so reprovisioning a client keeps its servers.
+
+Run `python servers.py status` to see the pool, and `python servers.py
+rebalance` to move clients off disabled or over-capacity servers (--all
+re-ranks every client by capacity) and rewrite their configs.
+
+Without VPN_SERVERS, configs use the profile's remotes as before.
+"""
+import math
+import hashlib
+import logging
+import argparse
+from collections import Counter
+from config import Config
+from helper import generate_ovpn_config, get_profiles
+from redis_client import redis_client
+from registry import registry
+from sessions import SESSION_COUNTS_KEY
+from storage import client_storage
+
+logger = logging.getLogger(__name__)
+
+ASSIGNMENTS_KEY = 'vpn_servers:assignments'
+
+
+def _hash_unit(provision_identity, server):
+    """Map an (identity, server) pair to a float in (0, 1)."""
+    digest = hashlib.sha256(f"{server}:{provision_identity}".encode()).digest()
+    return (int.from_bytes(digest[:8], 'big') + 1) / (2 ** 64 + 2)
+
+
+def rank(provision_identity, weights):
+    """Order servers for an identity by weighted rendezvous hashing.
+
+    Each server scores weight / -ln(u), u being a hash of (identity, server),
+    so a server gets a share of identities proportional to its weight, and
+    adding, removing or reweighting one server only moves the identities
+    that gain or lose it. Servers with weight 0 are ranked last.
+
+    Args:
+        provision_identity (str): The client to rank servers for
+        weights (dict): Weight by server name
+
+    Returns:
+        list: Server names, best first
+    """
+    def score(server):
+        weight = weights[server]
+        return weight > 0, max(weight, 1) / -math.log(_hash_unit(provision_identity, server))
+    return sorted(weights, key=score, reverse=True)
+
+
+class ServerPool:
+    """Assigns clients to ordered lists of OpenVPN servers."""
+
+    def __init__(self, servers=None):
+        self.servers = Config.VPN_SERVERS if servers is None else servers
+
+    @property
+    def enabled(self):
+        return bool(self.servers)
+
+    def active(self):
+        """Return the enabled servers by name."""
+        return {name: server for name, server in self.servers.items() if server.get('enabled', True)}
+
+    def session_counts(self):
+        """Return the live session count of each server, as published by its collector."""
+        return {name: int(count) for name, count in redis_client.hgetall(SESSION_COUNTS_KEY).items()}
+
+    def weights(self, loads=None):
+        """Return the free capacity of each enabled server.
+
+        Args:
+            loads (dict): Clients by server, defaults to the live session counts
+        """
+        if loads is None:
+            loads = self.session_counts()
+        return {name: max(int(server.get('capacity', 0)) - loads.get(name, 0), 0)
+                for name, server in self.active().items()}
+
+    def _complete(self, provision_identity, servers, weights):
+        """Fill up a server list to VPN_SERVER_REMOTES from the identity's ranking."""
+        ranked = rank(provision_identity, weights)
+        return (servers + [name for name in ranked if name not in servers])[:Config.VPN_SERVER_REMOTES]
+
+    def assign(self, provision_identity):
+        """Return a client's servers in failover order, ranking it if it has no usable assignment.
+
+        A stored assignment is kept while its first server is enabled; servers
+        removed or disabled since are replaced from the ranking.
+
+        Returns:
+            list: Server names, or None if no pool is configured
+        """
+        if not self.enabled:
+            return None
+        active = self.active()
+        if not active:
+            raise ValueError("No enabled servers in VPN_SERVERS")
+        stored = redis_client.hget(ASSIGNMENTS_KEY, provision_identity)
+        current = stored.split(',') if stored else []
+
+        if current and current[0] in active:
+            kept = [name for name in current if name in active]
+            servers = kept if len(kept) == len(current) else self._complete(provision_identity, kept, self.weights())
+        else:
+            servers = rank(provision_identity, self.weights())[:Config.VPN_SERVER_REMOTES]
+        if servers != current:
+            redis_client.hset(ASSIGNMENTS_KEY, provision_identity, ','.join(servers))
+        return servers
+
+    def remotes(self, servers, profile=None):
+        """Return the [host, port] remotes of a server list, with the ports of a profile.
+
+        Every port of the profile is listed for a server before the next server.
+        """
+        profile = get_profiles()[profile or Config.VPN_DEFAULT_PROFILE]
+        ports = list(dict.fromkeys(port for _, port in profile['remotes']))
+        return [[self.servers[name]['host'], port] for name in servers for port in ports]
+
+    def rebalance(self, all_clients=False, dry_run=False):
+        """Reassign clients in bulk and rewrite the configs of the ones that changed.
+
+        By default a client moves only if its first server is disabled, gone or
+        holds more clients than its capacity (moving stops once it is back
+        under), and failover servers that are gone are replaced. With
+        all_clients every client is re-ranked by capacity alone, which moves
+        only the clients whose top server changed.
+
+        Returns:
+            dict: Counts of moved, repaired (failover list only) and unchanged clients
+
+        Raises:
+            ValueError: If no server is enabled, checked before anything is moved
+        """
+        active = self.active()
+        if not active:
+            raise ValueError("No enabled servers in VPN_SERVERS")
+        assignments = dict(redis_client.hscan_iter(ASSIGNMENTS_KEY))
+        loads = Counter(stored.split(',')[0] for stored in assignments.values())
+        counts = {'moved': 0, 'repaired': 0, 'unchanged': 0}
+
+        for provision_identity, stored in sorted(assignments.items()):
+            current = stored.split(',')
+            primary = current[0]
+            if all_clients:
+                servers = rank(provision_identity, self.weights({}))[:Config.VPN_SERVER_REMOTES]
+            elif primary not in active or loads[primary] > int(active[primary].get('capacity', 0)):
+                loads[primary] -= 1
+                servers = rank(provision_identity, self.weights(loads))[:Config.VPN_SERVER_REMOTES]
+                loads[servers[0]] += 1
+            else:
+                servers = self._complete(provision_identity, [name for name in current if name in active],
+                                         self.weights(loads))
+
+            if servers == current:
+                counts['unchanged'] += 1
+                continue
+            counts['moved' if servers[0] != primary else 'repaired'] += 1
+            if not dry_run:
+                redis_client.hset(ASSIGNMENTS_KEY, provision_identity, ','.join(servers))
+                self._rewrite_config(provision_identity, servers)
+        return counts
+
+    def _rewrite_config(self, provision_identity, servers):
+        """Render a client's .ovpn again with new remotes, if it has one."""
+        if client_storage.locate(provision_identity, '.ovpn') is None:
+            return
+        profile = (registry.get(provision_identity) or {}).get('profile') or None
+        try:
+            config = generate_ovpn_config(provision_identity, profile, remotes=self.remotes(servers, profile))
+        except (FileNotFoundError, ValueError) as e:
+            logger.error(f"Could not rewrite the config of {provision_identity}: {str(e)}")
+            return
+        client_storage.write(provision_identity, '.ovpn', config)
+
+    def status(self):
+        """Return capacity, live sessions and assigned clients of every configured server."""
+        sessions = self.session_counts()
+        primaries = Counter(stored.split(',')[0] for _, stored in redis_client.hscan_iter(ASSIGNMENTS_KEY))
+        return {name: {
+            'host': server['host'],
+            'enabled': server.get('enabled', True),
+            'capacity': int(server.get('capacity', 0)),
+            'sessions': sessions.get(name, 0),
+            'assigned': primaries.get(name, 0),
+        } for name, server in self.servers.items()}
+
+
+# Create a global server pool instance
+server_pool = ServerPool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help="show capacity, sessions and assigned clients per server")
+    rebalance = commands.add_parser('rebalance', help="move clients off disabled or full servers")
+    rebalance.add_argument('--all', action='store_true', help="re-rank every client by capacity")
+    rebalance.add_argument('--dry-run', action='store_true', help="report what would move without moving it")
+    args = parser.parse_args()
+    logging.basicConfig(level=Config.LOG_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if not server_pool.enabled:
+        parser.exit(1, "VPN_SERVERS is not configured\n")
+    if args.command == 'status':
+        for name, server in server_pool.status().items():
+            print(f"{name:16s} {server['host']:32s} {'enabled' if server['enabled'] else 'disabled':8s} "
+                  f"{server['sessions']:6d}/{server['capacity']:<6d} sessions  {server['assigned']:6d} assigned")
+    else:
+        try:
+            counts = server_pool.rebalance(all_clients=args.all, dry_run=args.dry_run)
+        except ValueError as e:
+            parser.exit(1, f"{e}, nothing was moved\n")
+        print(f"{'Would move' if args.dry_run else 'Moved'} {counts['moved']} clients, "
+              f"{'would repair' if args.dry_run else 'repaired'} {counts['repaired']} failover lists, "
+              f"{counts['unchanged']} unchanged")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+Live session index fed from the OpenVPN management interface.
+
+Run one collector per OpenVPN server with `python sessions.py`, naming the
+server with VPN_SERVER_NAME when there are several (see servers.py). It
+keeps a single management connection open, polls `status 3` and applies
+only the differences to the Redis hash `vpn_sessions` (common name ->
+session JSON, including the server), and publishes the server's session
+count. A collector only removes the entries of its own server, so a client
+that failed over to another server keeps its new session. Don't enable
+management-client-auth on the server: the collector never answers
+`>CLIENT:CONNECT`, so every connection would wait for it. Real-time
+notifications are skipped, changes show up on the next poll. API workers
+answer lookups with one HGET. Sessions queued with request_disconnect() are killed
+by the collector of the server they are on, before each poll.
+"""
+import json
+import time
+import socket
+import logging
+from functools import cached_property
+from config import Config
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_KEY = 'vpn_sessions'
+UPDATED_AT_KEY = 'vpn_sessions:updated_at'
+LEADER_KEY = 'vpn_sessions:collector'
+DISCONNECT_KEY = 'vpn_sessions:disconnect'
+SESSION_COUNTS_KEY = 'vpn_servers:sessions'
+
+# Remove sessions from the index, but only those still recorded on a server.
+# KEYS: sessions hash
+# ARGV: server, server of entries without one, common names...
+DELETE_SCRIPT = """
+local deleted = 0
+for i = 3, #ARGV do
+    local session = redis.call('HGET', KEYS[1], ARGV[i])
+    if session then
+        local server = cjson.decode(session)['server'] or ARGV[2]
+        if server == ARGV[1] then
+            deleted = deleted + redis.call('HDEL', KEYS[1], ARGV[i])
+        end
+    end
+end
+return deleted
+"""
+
+
+def get_session(common_name):
+    """Return the live session of a client, or None if it is not connected."""
+    session = redis_client.hget(SESSIONS_KEY, common_name)
+    return json.loads(session) if session else None
+
+
+def request_disconnect(common_names):
+    """Ask the collectors to kill the sessions of some clients.
+
+    The management interface takes one client at a time and the collector
+    holds it, so the kills are queued in Redis, per server, and sent by the
+    collector. Clients that are not connected are skipped.
+    """
+    if not common_names:
+        return
+    by_server = {}
+    for common_name, session in zip(common_names, redis_client.hmget(SESSIONS_KEY, common_names)):
+        if session:
+            server = json.loads(session).get('server', Config.VPN_SERVER_NAME)
+            by_server.setdefault(server, []).append(common_name)
+    for server, names in by_server.items():
+        redis_client.rpush(f"{DISCONNECT_KEY}:{server}", *names)
+
+
+def parse_status(lines):
+    """Parse `status 3` output into sessions keyed by common name.
+
+    Column positions are taken from the HEADER line so that extra columns
+    added by newer OpenVPN versions don't break parsing.
+    """
+    columns = None
+    sessions = {}
+    for line in lines:
+        fields = line.split('\t')
+        if fields[0] == 'HEADER' and len(fields) > 1 and fields[1] == 'CLIENT_LIST':
+            columns = {name: index for index, name in enumerate(fields[2:], start=1)}
+        elif fields[0] == 'CLIENT_LIST' and columns:
+            common_name = fields[columns['Common Name']]
+            if common_name == 'UNDEF':
+                continue
+            sessions[common_name] = {
+                'real_address': fields[columns['Real Address']],
+                'virtual_address': fields[columns['Virtual Address']],
+                'connected_since': int(fields[columns['Connected Since (time_t)']]),
+                'client_id': fields[columns['Client ID']] if 'Client ID' in columns else None
+            }
+    return sessions
+
+
+class SessionCollector:
+    """Maintains the session index from one persistent management connection."""
+
+    def __init__(self, host=None, port=None, password=None, interval=None, server=None):
+        self.host = host or Config.OPENVPN_MANAGEMENT_HOST
+        self.port = port or Config.OPENVPN_MANAGEMENT_PORT
+        self.password = password if password is not None else Config.OPENVPN_MANAGEMENT_PASSWORD
+        self.interval = interval or Config.SESSION_POLL_INTERVAL
+        self.server = server or Config.VPN_SERVER_NAME
+        self.sessions = {}
+        self._sock = None
+        self._buffer = b''
+
+    @cached_property
+    def _delete(self):
+        return redis_client.register_script(DELETE_SCRIPT)
+
+    def _delete_sessions(self, common_names):
+        """Remove sessions that ended on this server, not ones that moved to another."""
+        self._delete(keys=[SESSIONS_KEY], args=[self.server, Config.VPN_SERVER_NAME, *common_names])
+
+    def connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=Config.SESSION_SOCKET_TIMEOUT)
+        self._buffer = b''
+        if self.password:
+            self._read_prompt(b'ENTER PASSWORD:')
+            self._send(self.password)
+        self._read_until(lambda line: line.startswith('>INFO:'))
+        logger.info(f"Connected to OpenVPN management interface at {self.host}:{self.port}")
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _send(self, command):
+        self._sock.sendall(f"{command}\n".encode())
+
+    def _read_line(self):
+        while b'\n' not in self._buffer:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("Management interface closed the connection")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line.decode(errors='replace').rstrip('\r')
+
+    def _read_prompt(self, prompt):
+        """Read up to and including a prompt, which OpenVPN sends without a newline."""
+        while prompt not in self._buffer:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("Management interface closed the connection")
+            self._buffer += chunk
+        self._buffer = self._buffer.split(prompt, 1)[1]
+
+    def _read_until(self, predicate):
+        """Read lines until one matches, skipping real-time `>` notifications."""
+        while True:
+            line = self._read_line()
+            if predicate(line):
+                return line
+
+    def poll(self):
+        """Fetch `status 3` and write only the sessions that changed."""
+        self._send('status 3')
+        lines = []
+        while True:
+            line = self._read_line()
+            if line == 'END':
+                break
+            if not line.startswith('>'):
+                lines.append(line)
+        self.apply({common_name: dict(session, server=self.server)
+                    for common_name, session in parse_status(lines).items()})
+
+    def apply(self, current):
+        """Diff a full snapshot against the index and write the changes."""
+        changed = {common_name: session for common_name, session in current.items()
+                   if self.sessions.get(common_name) != session}
+        gone = [common_name for common_name in self.sessions if common_name not in current]
+        if gone:
+            self._delete_sessions(gone)
+        pipe = redis_client.pipeline()
+        if changed:
+            pipe.hset(SESSIONS_KEY, mapping={cn: json.dumps(session) for cn, session in changed.items()})
+        pipe.hset(SESSION_COUNTS_KEY, self.server, len(current))
+        pipe.set(f"{UPDATED_AT_KEY}:{self.server}", time.time())
+        pipe.execute()
+        self.sessions = current
+
+    def disconnect_requested(self):
+        """Send `kill` for the clients of this server queued by request_disconnect."""
+        while True:
+            common_name = redis_client.lpop(f"{DISCONNECT_KEY}:{self.server}")
+            if common_name is None:
+                return
+            self._send(f"kill {common_name}")
+            reply = self._read_until(lambda line: line.startswith(('SUCCESS:', 'ERROR:')))
+            if reply.startswith('SUCCESS:'):
+                logger.info(f"Disconnected {common_name}")
+
+    def load_index(self):
+        """Start from this server's part of the index so the first diff only writes real changes."""
+        sessions = {common_name: json.loads(session)
+                    for common_name, session in redis_client.hgetall(SESSIONS_KEY).items()}
+        self.sessions = {common_name: session for common_name, session in sessions.items()
+                         if session.get('server', Config.VPN_SERVER_NAME) == self.server}
+
+    def _hold_leadership(self):
+        """Keep a single collector writing the index per server."""
+        owner = f"{socket.gethostname()}:{id(self)}"
+        leader_key = f"{LEADER_KEY}:{self.server}"
+        ttl = max(int(self.interval * 3), 10)
+        if redis_client.set(leader_key, owner, nx=True, ex=ttl):
+            return True
+        if redis_client.get(leader_key) == owner:
+            redis_client.expire(leader_key, ttl)
+            return True
+        return False
+
+    def run_forever(self):
+        while True:
+            if not self._hold_leadership():
+                time.sleep(self.interval)
+                continue
+            try:
+                if self._sock is None:
+                    self.connect()
+                    self.load_index()
+                self.disconnect_requested()
+                self.poll()
+            except (OSError, ConnectionError) as e:
+                logger.error(f"Session collector lost the management interface: {str(e)}")
+                self.close()
+            time.sleep(self.interval)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=Config.LOG_LEVEL,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    SessionCollector().run_forever()
@@ -0,0 +1,217 @@
+"""
+Client file storage for VPN_CLIENT_DIR.
+
+Client files live in hash-sharded subdirectories:
+    VPN_CLIENT_DIR/<2 hex>/.../<provision_identity>.{ovpn,crt,key}
+with VPN_CLIENT_SHARD_DEPTH levels of 256 directories each (0 keeps the old
+flat layout). Shared files (ca.crt, tls-crypt.key) stay at the top level.
+Writes go to a temp file that is fsynced and renamed over the target, so a
+crash never leaves a truncated config behind.
+
+Run `python storage.py` to move the flat client files of an existing
+directory into the configured layout (add --dry-run to only report what
+would move).
+"""
+import os
+import re
+import uuid
+import hashlib
+import logging
+import argparse
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+CLIENT_SUFFIXES = ('.ovpn', '.crt', '.key')
+SHARED_FILES = ('ca.crt', 'tls-crypt.key', 'ta.key')
+
+
+class ClientStorage:
+    """Reads and writes the per-client files of VPN_CLIENT_DIR."""
+
+    def __init__(self, root=None, shard_depth=None, flat_fallback=None):
+        self.root = root or Config.VPN_CLIENT_DIR
+        self.shard_depth = Config.VPN_CLIENT_SHARD_DEPTH if shard_depth is None else shard_depth
+        self.flat_fallback = Config.VPN_CLIENT_FLAT_FALLBACK if flat_fallback is None else flat_fallback
+
+    def shard(self, provision_identity):
+        """Return the shard directories of an identity, relative to the root."""
+        digest = hashlib.sha256(provision_identity.encode()).hexdigest()
+        return [digest[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+
+    def relative_path(self, provision_identity, suffix):
+        return "/".join(self.shard(provision_identity) + [f"{provision_identity}{suffix}"])
+
+    def path(self, provision_identity, suffix):
+        """Return where a client file is stored in the configured layout."""
+        return os.path.join(self.root, *self.shard(provision_identity), f"{provision_identity}{suffix}")
+
+    def flat_path(self, provision_identity, suffix):
+        return os.path.join(self.root, f"{provision_identity}{suffix}")
+
+    def locate(self, provision_identity, suffix):
+        """Return the path of an existing client file, or None.
+
+        Until a directory is migrated, files are also looked up in the flat
+        layout (VPN_CLIENT_FLAT_FALLBACK).
+        """
+        path = self.path(provision_identity, suffix)
+        if os.path.exists(path):
+            return path
+        if self.flat_fallback and self.shard_depth:
+            flat = self.flat_path(provision_identity, suffix)
+            if os.path.exists(flat):
+                return flat
+        return None
+
+    def read(self, provision_identity, suffix):
+        """Read a client file.
+
+        Raises:
+            FileNotFoundError: If the client has no such file
+        """
+        path = self.locate(provision_identity, suffix)
+        if path is None:
+            raise FileNotFoundError(self.path(provision_identity, suffix))
+        with open(path, 'r') as f:
+            return f.read()
+
+    def write(self, provision_identity, suffix, data, mode=0o644):
+        """Atomically write a client file: temp file, fsync, rename.
+
+        Returns:
+            str: The path written
+        """
+        path = self.path(provision_identity, suffix)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f".{provision_identity}{suffix}.{uuid.uuid4().hex}.tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return path
+
+    def remove(self, provision_identity, suffixes=CLIENT_SUFFIXES):
+        """Remove client files from both layouts, ignoring ones that don't exist."""
+        for suffix in suffixes:
+            paths = [self.path(provision_identity, suffix)]
+            if self.flat_fallback and self.shard_depth:
+                paths.append(self.flat_path(provision_identity, suffix))
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _shard_dirs(self):
+        """Yield every leaf shard directory that exists."""
+        level = [self.root]
+        for _ in range(self.shard_depth):
+            next_level = []
+            for directory in level:
+                with os.scandir(directory) as entries:
+                    next_level.extend(entry.path for entry in entries
+                                      if entry.is_dir() and re.fullmatch(r'[0-9a-f]{2}', entry.name))
+            level = next_level
+        return level
+
+    def iter_clients(self, suffix='.ovpn'):
+        """Yield (provision identity, path) for every stored client file with the suffix."""
+        directories = self._shard_dirs()
+        if self.flat_fallback and self.shard_depth:
+            directories.append(self.root)
+        for directory in directories:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(suffix) and not entry.name.startswith('.') and entry.is_file():
+                        if directory == self.root and entry.name in SHARED_FILES:
+                            continue
+                        yield entry.name[:-len(suffix)], entry.path
+
+    def migrate(self, dry_run=False):
+        """Move the flat client files at the top of the root into the configured layout.
+
+        Only files directly under the root are considered, never the shard
+        directories, ccd/ or other subdirectories, and a .crt or .key only
+        moves if its identity has a .ovpn, so server certificates and keys
+        kept next to ca.crt stay where they are. Files are renamed, which is
+        atomic on one filesystem. A file whose target already exists is left
+        in place and reported as a conflict; leftover temp files from
+        interrupted writes are removed.
+
+        Returns:
+            dict: Counts of moved files, conflicts and removed temp files, and
+            the new .ovpn paths keyed by provision identity
+        """
+        counts = {'moved': 0, 'conflicts': 0, 'temp_removed': 0}
+        moved_configs = {}
+        for directory in [self.root] + self._shard_dirs():
+            with os.scandir(directory) as entries:
+                temp_files = [entry.path for entry in entries
+                              if entry.name.startswith('.') and entry.name.endswith('.tmp') and entry.is_file()]
+            counts['temp_removed'] += len(temp_files)
+            if not dry_run:
+                for path in temp_files:
+                    os.remove(path)
+
+        with os.scandir(self.root) as entries:
+            names = {entry.name for entry in entries if entry.is_file() and not entry.name.startswith('.')}
+        for name in sorted(names - set(SHARED_FILES)):
+            suffix = next((s for s in CLIENT_SUFFIXES if name.endswith(s)), None)
+            if suffix is None:
+                continue
+            provision_identity = name[:-len(suffix)]
+            if not re.match(Config.ALLOWED_PROVISION_IDENTITY_PATTERN, provision_identity):
+                continue
+            if suffix != '.ovpn' and f"{provision_identity}.ovpn" not in names \
+                    and not os.path.exists(self.path(provision_identity, '.ovpn')):
+                continue
+            source = os.path.join(self.root, name)
+            target = self.path(provision_identity, suffix)
+            if source == target:
+                continue
+            if os.path.exists(target):
+                logger.warning(f"Not moving {source}, {target} already exists")
+                counts['conflicts'] += 1
+                continue
+            if not dry_run:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.rename(source, target)
+            counts['moved'] += 1
+            if suffix == '.ovpn':
+                moved_configs[provision_identity] = target
+        counts['configs'] = moved_configs
+        return counts
+
+
+# Create a global client storage instance
+client_storage = ClientStorage()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help="report what would move without moving it")
+    args = parser.parse_args()
+    logging.basicConfig(level=Config.LOG_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    counts = client_storage.migrate(dry_run=args.dry_run)
+    if not args.dry_run and counts['configs']:
+        from registry import registry
+        registry.update_config_paths(counts['configs'])
+    print(f"{'Would move' if args.dry_run else 'Moved'} {counts['moved']} files into "
+          f"{client_storage.root} (shard depth {client_storage.shard_depth}), "
+          f"{counts['conflicts']} conflicts, {counts['temp_removed']} stale temp files")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from redis.exceptions import RedisError
+from config import Config
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+
+def task_channel(task_id):
+    return f"task_events:{task_id}"
+
+
+def publish_task_event(task_id, event):
+    """Publish a task progress or completion event to the task's channel.
+
+    Publishing is best effort: waiters fall back to the result backend, so a
+    Redis hiccup must not fail the task itself.
+    """
+    try:
+        redis_client.publish(task_channel(task_id), json.dumps(event))
+    except RedisError as e:
+        logger.error(f"Failed to publish event for task {task_id}: {str(e)}")
+
+
+class TaskEventHub:
+    """One pattern subscription to every task channel per process.
+
+    Long-polling and streaming requests would otherwise each hold a pub/sub
+    connection from the shared pool for as long as they wait, so a few dozen
+    waiters exhaust it for every other Redis user in the process. Here one
+    background thread (a greenlet under gevent) reads all task events over a
+    single connection and hands them to the waiters registered for the task.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._pid = None
+        self._pubsub = None
+
+    def _ensure_started(self):
+        # Started on first use and again after a fork, a thread does not survive it
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._waiters = {}
+            pubsub = redis_client.pubsub()
+            pubsub.psubscribe(task_channel('*'))
+            # Wait for the confirmation, every event published after it reaches us
+            deadline = time.monotonic() + Config.REDIS_SOCKET_TIMEOUT
+            while time.monotonic() < deadline:
+                message = pubsub.get_message(timeout=deadline - time.monotonic())
+                if message is not None and message['type'] == 'psubscribe':
+                    break
+            self._pubsub = pubsub
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, args=(pubsub,), name='task-events', daemon=True).start()
+
+    def _run(self, pubsub):
+        while self._pubsub is pubsub:
+            try:
+                message = pubsub.get_message(timeout=1.0)
+            except RedisError as e:
+                # redis-py reconnects and subscribes again on the next read, events in between are lost
+                # and waiters fall back to the result backend
+                logger.error(f"Task event subscription failed, reconnecting: {str(e)}")
+                time.sleep(1)
+                continue
+            if message is None or message['type'] != 'pmessage':
+                continue
+            with self._lock:
+                queues = list(self._waiters.get(message['channel'], ()))
+            if queues:
+                event = json.loads(message['data'])
+                for q in queues:
+                    q.put(event)
+
+    def register(self, task_id):
+        """Start collecting a task's events, returns the queue they are put on."""
+        self._ensure_started()
+        q = queue.Queue()
+        with self._lock:
+            self._waiters.setdefault(task_channel(task_id), set()).add(q)
+        return q
+
+    def unregister(self, task_id, q):
+        with self._lock:
+            waiters = self._waiters.get(task_channel(task_id))
+            if waiters is not None:
+                waiters.discard(q)
+                if not waiters:
+                    del self._waiters[task_channel(task_id)]
+
+    def waiting(self):
+        """Return the number of registered waiters."""
+        with self._lock:
+            return sum(len(waiters) for waiters in self._waiters.values())
+
+
+# Create a global task event hub instance (subscribes on first use)
+task_event_hub = TaskEventHub()
+
+
+class TaskEvents:
+    """Subscription to one task's events through the process's TaskEventHub.
+
+    Subscribe before checking the result backend so that a completion
+    published in between is not missed.
+    """
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self._queue = task_event_hub.register(task_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        task_event_hub.unregister(self.task_id, self._queue)
+
+    def listen(self, timeout):
+        """Yield events until a final one arrives or `timeout` seconds pass."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return
+            yield event
+            if event.get('final'):
+                return
+
+    def wait(self, timeout):
+        """Block until the task's final event or the timeout.
+
+        Returns:
+            dict: The final event, or None on timeout
+        """
+        for event in self.listen(timeout):
+            if event.get('final'):
+                return event
+        return None
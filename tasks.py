@@ -1,47 +1,115 @@
 import os
+import time
 import subprocess
 import logging
+from celery.signals import task_prerun, task_postrun, worker_init, worker_ready, worker_process_shutdown
 from celery_config import celery
 from helper import generate_ovpn_config
 from config import Config
+from pki import PKIEngine, issue_client_certificate, pki_engine
+from key_pool import key_pool
+from batch import record_batch_result, unfinished
+from task_events import publish_task_event
+from registry import registry
+from dispatcher import JOB_PREFIX, dispatch
+import revocation
+import renewal
+from redis_client import redis_client
+from storage import client_storage
+from servers import server_pool
+from ip_pool import ip_pool
+from metrics import (PROVISION_STAGE_LATENCY, TASK_QUEUE_WAIT, mark_process_dead, reset_multiprocess_dir,
+                     start_metrics_server, time_stage)
 
 logger = logging.getLogger(__name__)
 
 
-@celery.task(bind=True, name='generate_certificate')
-def generate_certificate(self, provision_identity):
-    """Generate OpenVPN certificate and configuration asynchronously."""
+def provision_client(provision_identity, profile=None, claim_token=None):
+    """Issue a certificate and write the .ovpn configuration for one client.
+
+    The identity must be claimed in the registry first; the API routes do that
+    before queueing and pass the claim token, otherwise it is claimed here. A
+    task whose claim went stale and was taken over by another request gives
+    up without touching the identity. Workers are long-lived, so
+    a failed attempt removes what it wrote to client storage, discards the
+    certificate it issued (so the identity can be issued again) and releases
+    the claim before returning.
+
+    Args:
+        provision_identity (str): The unique identifier for the client
+        profile (str): The connection profile used to render the .ovpn
+        claim_token (str): The token of the caller's claim on the identity
+
+    Returns:
+        dict: The task result reported back to the caller
+    """
+    written = []
+    claimed = False
+    issued = False
+    new_address = False
     try:
-        # Update task state
-        self.update_state(state='PROGRESS',
-                          meta={'status': 'Generating certificate...'})
-
-        # Create OpenVPN client cert and config
-        client_conf_path = f"{Config.VPN_CLIENT_DIR}/{provision_identity}.ovpn"
-
-        if os.path.exists(client_conf_path):
-            return {
-                'status': 'error',
-                'message': 'Client already exists',
-                'provision_identity': provision_identity
-            }
-
-        # Generate client certificate
-        subprocess.run(["./easyrsa", "build-client-full", provision_identity, "nopass"],
-                       check=True,
-                       capture_output=True,
-                       text=True)
-
-        # Generate .ovpn file
-        with open(client_conf_path, "w") as f:
-            f.write(generate_ovpn_config(provision_identity))
+        if not registry.confirm_claim(provision_identity, claim_token):
+            # Not claimed for this task (e.g. queued directly) or taken over since, claim it here if it's free
+            claim_token = registry.claim(provision_identity, profile, token=claim_token)
+            if claim_token is None:
+                return {
+                    'status': 'error',
+                    'message': 'Client already exists',
+                    'provision_identity': provision_identity
+                }
+        claimed = True
+        # Pick the client's servers first, nothing is issued if the pool has no enabled server
+        servers = server_pool.assign(provision_identity)
+        # Reserve the client's static tunnel address, a reprovisioned client keeps its old one
+        tunnel_address = None
+        if ip_pool.enabled:
+            tunnel_address, new_address = ip_pool.allocate(provision_identity)
 
-        return {
+        # Generate client certificate, using a pre-generated key when one is ready
+        private_key = None
+        if Config.PKI_ENGINE == 'native':
+            with time_stage('key_generation'):
+                private_key = key_pool.pop() if key_pool.enabled else None
+                if private_key is None:
+                    private_key = PKIEngine.generate_private_key()
+        cert_pem, key_pem, cert = issue_client_certificate(provision_identity, private_key)
+        issued = True
+        del private_key
+        if key_pool.enabled and key_pool.should_refill():
+            refill_key_pool.delay()
+
+        # Generate .ovpn file, listing the client's servers when there is a server pool
+        with time_stage('render'):
+            remotes = server_pool.remotes(servers, profile) if servers else None
+            ovpn_config = generate_ovpn_config(provision_identity, profile, cert_pem, key_pem, remotes)
+
+        with time_stage('write'):
+            # Keep the client cert and key next to the config, generate_ovpn_config reads them from there
+            written.append('.crt')
+            client_storage.write(provision_identity, '.crt', cert_pem)
+            written.append('.key')
+            client_storage.write(provision_identity, '.key', key_pem, mode=0o600)
+            del key_pem
+
+            written.append('.ovpn')
+            client_conf_path = client_storage.write(provision_identity, '.ovpn', ovpn_config)
+            if tunnel_address:
+                ip_pool.write_ccd(provision_identity, tunnel_address)
+        written.clear()
+        registry.mark_issued(provision_identity, cert, client_conf_path, tunnel_address)
+        claimed = False
+        issued = False
+        new_address = False
+
+        result = {
             'status': 'success',
             'message': 'Certificate generated successfully',
             'provision_identity': provision_identity,
             'config_path': client_conf_path
         }
+        if tunnel_address:
+            result['tunnel_address'] = tunnel_address
+        return result
 
     except subprocess.CalledProcessError as e:
         logger.error(f"Failed to generate certificate: {str(e)}")
@@ -56,4 +124,166 @@ def generate_certificate(self, provision_identity):
             'status': 'error',
             'message': f'Unexpected error: {str(e)}',
             'provision_identity': provision_identity
-        }
\ No newline at end of file
+        }
+    finally:
+        if written:
+            _remove_files(provision_identity, written)
+        if issued:
+            _discard_certificate(provision_identity)
+        if new_address:
+            _free_address(provision_identity)
+        if claimed:
+            registry.release(provision_identity, claim_token)
+
+
+def _remove_files(provision_identity, suffixes):
+    """Remove the client files a failed attempt wrote, ignoring ones that never got created."""
+    try:
+        client_storage.remove(provision_identity, suffixes)
+    except OSError as e:
+        logger.error(f"Failed to clean up files of {provision_identity}: {str(e)}")
+
+
+def _discard_certificate(provision_identity):
+    """Move aside the certificate a failed attempt issued and queue it for the CRL."""
+    try:
+        serial = pki_engine.discard(provision_identity)
+        if serial is not None:
+            revocation.queue_discarded([serial])
+    except Exception as e:
+        logger.error(f"Failed to discard the certificate of {provision_identity}: {str(e)}")
+
+
+def _free_address(provision_identity):
+    """Give back a tunnel address allocated by a failed attempt."""
+    try:
+        ip_pool.free(provision_identity)
+    except Exception as e:
+        logger.error(f"Failed to free the tunnel address of {provision_identity}: {str(e)}")
+
+
+@celery.task(bind=True, name='generate_certificate')
+def generate_certificate(self, provision_identity, profile=None):
+    """Generate OpenVPN certificate and configuration asynchronously."""
+    # Update task state
+    self.update_state(state='PROGRESS',
+                      meta={'status': 'Generating certificate...'})
+    publish_task_event(self.request.id, {
+        'type': 'progress',
+        'final': False,
+        'state': 'PROGRESS',
+        'status': 'Generating certificate...'
+    })
+    return provision_client(provision_identity, profile, claim_token=self.request.id)
+
+
+@task_postrun.connect(sender=generate_certificate)
+def publish_certificate_result(task_id=None, retval=None, state=None, **kwargs):
+    """Push the final result to waiters once it is stored in the result backend."""
+    event = {'type': 'result', 'final': True, 'state': state}
+    if state == 'SUCCESS':
+        event['result'] = retval
+    else:
+        event['message'] = str(retval)
+    publish_task_event(task_id, event)
+
+
+@celery.task(name='generate_certificate_batch', ignore_result=True)
+def generate_certificate_batch(batch_id, provision_identities, profile=None, claim_token=None):
+    """Provision a chunk of a batch, recording each result in the batch record."""
+    for provision_identity in unfinished(batch_id, provision_identities):
+        result = provision_client(provision_identity, profile, claim_token)
+        record_batch_result(batch_id, provision_identity, result)
+
+
+@celery.task(name='dispatch_router_commands', ignore_result=True)
+def dispatch_router_commands(job_id, provision_identities, commands):
+    """Run a command batch on a chunk of a job's routers, recording each result in the job."""
+    dispatch(unfinished(job_id, provision_identities, prefix=JOB_PREFIX), commands,
+             lambda provision_identity, result: record_batch_result(job_id, provision_identity, result,
+                                                                    prefix=JOB_PREFIX))
+
+
+@celery.task(name='refill_key_pool', ignore_result=True)
+def refill_key_pool():
+    """Top up the pre-generated client key pool."""
+    if not key_pool.enabled:
+        return 0
+    generated = key_pool.refill(limit=Config.KEY_POOL_REFILL_BATCH)
+    if generated:
+        logger.info(f"Added {generated} keys to {key_pool.redis_key}")
+    return generated
+
+
+@celery.task(name='apply_revocations', ignore_result=True)
+def apply_revocations():
+    """Apply queued revocations in batches, then keep the CRL from expiring."""
+    counts = revocation.apply_revocations()
+    if counts is None:
+        return
+    if counts['revoked'] or counts['missing'] or counts['discarded']:
+        logger.info(f"Applied revocations: {counts['revoked']} revoked, {counts['missing']} without a certificate, "
+                    f"{counts['discarded']} discarded")
+    elif revocation.refresh_crl_if_expiring():
+        logger.info("Renewed the CRL before it expired")
+
+
+@celery.task(name='renew_certificates', ignore_result=True)
+def renew_certificates():
+    """Renew a batch of the certificates expiring within CERT_RENEWAL_WINDOW days."""
+    if not Config.CERT_RENEWAL_ENABLED:
+        return
+    counts = renewal.renew_due()
+    if counts and (counts['renewed'] or counts['failed']):
+        logger.info(f"Renewed {counts['renewed']} certificates, {counts['failed']} failed")
+
+
+@celery.task(name='reconcile_registry', ignore_result=True)
+def reconcile_registry():
+    """Rebuild the provisioning registry from the configs in client storage."""
+    if not redis_client.set('registry:reconcile_lock', 1, nx=True, ex=Config.REGISTRY_RECONCILE_LOCK_TIMEOUT):
+        return
+    try:
+        counts = registry.rebuild_from_disk()
+        logger.info(f"Reconciled provisioning registry: {counts['added']} added, {counts['removed']} removed")
+    finally:
+        redis_client.delete('registry:reconcile_lock')
+
+
+@worker_ready.connect
+def reconcile_registry_on_startup(**kwargs):
+    reconcile_registry.delay()
+
+
+PROVISIONING_TASKS = ('generate_certificate', 'generate_certificate_batch')
+
+
+@task_prerun.connect
+def observe_queue_wait(task=None, **kwargs):
+    """Measure queue wait per queue and for provisioning (wall clock, so web and worker clocks must agree)."""
+    published_at = task.request.get('published_at')
+    if not published_at:
+        return
+    waited = max(time.time() - published_at, 0)
+    queue = (task.request.delivery_info or {}).get('routing_key') or 'unknown'
+    TASK_QUEUE_WAIT.labels(queue=queue).observe(waited)
+    if task.name in PROVISIONING_TASKS:
+        PROVISION_STAGE_LATENCY.labels(stage='queue_wait').observe(waited)
+
+
+@worker_init.connect
+def clear_metrics(**kwargs):
+    """Drop the samples of the previous worker run, in the main process before the pool forks."""
+    reset_multiprocess_dir()
+
+
+@worker_ready.connect
+def serve_metrics(**kwargs):
+    """Export the metrics of every pool process from the main worker process."""
+    if Config.CELERY_METRICS_PORT:
+        start_metrics_server(Config.CELERY_METRICS_PORT)
+
+
+@worker_process_shutdown.connect
+def forget_worker_process(pid=None, **kwargs):
+    mark_process_dead(pid or os.getpid())